@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+Compares wall clock time of index parsing with a thread pool and a process
+pool on synthetic index-v1.jar files.
+
+    python benchmark/index_processor.py --repos 8 --apps 2000
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+from datetime import timedelta
+from zipfile import ZipFile, ZIP_DEFLATED
+import click
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fdroid_dl.download import JarIndexStream
+from fdroid_dl.processor import IndexFileProcessor
+
+
+class SyntheticRepo(dict):
+    ''' stands in for RepoConfig '''
+    def __init__(self, url, filename):
+        super(SyntheticRepo, self).__init__()
+        self.url = url
+        self.filename = filename
+
+
+def synthetic_index(apps, versions):
+    index = {'repo': {'name': 'Synthetic', 'timestamp': int(time.time() * 1000)},
+             'requests': {'install': [], 'uninstall': []}, 'apps': [], 'packages': {}}
+    for app in range(apps):
+        appid = 'org.example.app%d' % app
+        index['apps'].append({
+            'packageName': appid, 'name': 'App %d' % app, 'icon': appid + '.png',
+            'lastUpdated': 1500000000000 + app, 'categories': ['System'],
+            'localized': dict((loc, {'summary': 'summary ' * 4, 'description': 'description ' * 40,
+                                     'icon': 'icon.png', 'phoneScreenshots': ['%d.png' % i for i in range(4)]})
+                              for loc in ('en-US', 'de', 'fr'))})
+        index['packages'][appid] = [{'apkName': '%s_%d.apk' % (appid, code), 'versionCode': code,
+                                     'hash': '0' * 64, 'hashType': 'sha256', 'size': 1024,
+                                     'uses-permission': [['android.permission.INTERNET', None]] * 5}
+                                    for code in range(versions)]
+    return index
+
+
+def run(pool, jars, workdir, workers):
+    start = time.time()
+    with IndexFileProcessor(max_workers=workers, processes=(pool == 'process')) as ifp:
+        for idx, jar in enumerate(jars):
+            repo = SyntheticRepo('https://example.org/repo%d/' % idx, os.path.join(workdir, '%s%d.cache' % (pool, idx)))
+            ifp.process(JarIndexStream(open(jar, 'rb')), repo)
+        results = list(ifp.completed())
+    return (time.time() - start, results)
+
+
+@click.command()
+@click.option('--repos', default=8, type=int, show_default=True, help='number of synthetic repos')
+@click.option('--apps', default=2000, type=int, show_default=True, help='apps per repo')
+@click.option('--versions', default=3, type=int, show_default=True, help='packages per app')
+@click.option('--workers', default=os.cpu_count(), type=int, show_default=True, help='pool size')
+def main(repos, apps, versions, workers):
+    workdir = tempfile.mkdtemp()
+    try:
+        data = json.dumps(synthetic_index(apps, versions)).encode('utf-8')
+        jars = []
+        for idx in range(repos):
+            jar = os.path.join(workdir, 'index%d.jar' % idx)
+            with ZipFile(jar, 'w', ZIP_DEFLATED) as zip_file:
+                zip_file.writestr('index-v1.json', data)
+            jars.append(jar)
+        click.echo('%d repos, %d apps, index-v1.json %.2f MB, %d workers' % (repos, apps, len(data) / 1048576., workers))
+        for pool in ('thread', 'process'):
+            (elapsed, results) = run(pool, jars, workdir, workers)
+            click.echo('%-8s %s (%d repos)' % (pool, timedelta(seconds=elapsed), len(results)))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
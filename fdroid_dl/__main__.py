@@ -4,6 +4,7 @@ import logging
 import click
 from .model import Config
 from .update import Update
+from .download import FuturesSessionFlex, RateLimiter, ENGINES, engine_error
 
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -45,24 +46,64 @@ def main(ctx, debug, config, repo, metadata, cache):
 @click.option('--apk/--no-apk', default=True, show_default=True, help='download apk files')
 @click.option('--apk-versions', default=1, type=int, show_default=True, help='how many versions of apk to download')
 @click.option('--src/--no-src', default=True, show_default=True, help='download src files')
+@click.option('--reverify', is_flag=True, default=False, show_default=True, help='hash all existing apk files again, in parallel')
+@click.option('--delta/--no-delta', default=True, show_default=True, help='only process apps changed since the last index update')
+@click.option('--pipeline/--no-pipeline', default=True, show_default=True, help='start metadata and apk downloads of a repo as soon as its index is refreshed')
 @click.option('--threads', default=10, type=int, show_default=True, help='configure number of parallel threads used for download')
-@click.option('--head-timeout', default=10, type=int, show_default=True, help='maximum time in seconds a HEAD request is allowed to take')
+@click.option('--engine', default='thread', type=click.Choice(ENGINES), show_default=True, help='download engine used for metadata and apk files, async needs httpx')
+@click.option('--max-per-host', default=8, type=int, show_default=True, help='maximum parallel downloads per host')
+@click.option('--http2/--no-http2', default=False, show_default=True, help='use HTTP/2 if the server supports it, async engine only')
+@click.option('--mirrors/--no-mirrors', default=False, show_default=True, help='spread metadata and apk downloads across the mirrors a repo advertises')
+@click.option('--rate', default=None, type=str, help='bandwidth limit for all downloads, e.g. 500K or 2M bytes/s  [default: unlimited]')
+@click.option('--rate-per-host', default=None, type=str, help='bandwidth limit per host, e.g. 500K  [default: unlimited]')
+@click.option('--rate-profile', multiple=True, type=str, help='time of day bandwidth limit replacing --rate, e.g. 08:00-18:00=1M, may be repeated')
+@click.option('--retries', default=3, type=int, show_default=True, help='how often a failed download is retried')
+@click.option('--retry-backoff', default=1.0, type=float, show_default=True, help='seconds to wait before the first retry, doubled for every further one')
+@click.option('--retry-budget', default=50, type=int, show_default=True, help='maximum retries per host and run')
+@click.option('--index-pool', default='thread', type=click.Choice(['thread', 'process']), show_default=True, help='parse index files in a thread or process pool')
+@click.option('--head-timeout', default=10, type=int, show_default=True, help='maximum time in seconds to wait for a connection to an index server')
 @click.option('--index-timeout', default=60, type=int, show_default=True, help='maximum time in seconds index file download is allowed to take')
 @click.option('--download-timeout', default=60, type=int, show_default=True, help='maximum time in seconds file download is allowed to take')
 @click.pass_context
-def update(ctx, index, metadata, apk, apk_versions, src, threads, head_timeout, index_timeout, download_timeout):
+def update(ctx, index, metadata, apk, apk_versions, src, reverify, delta, pipeline, threads, engine, max_per_host, http2, mirrors, rate, rate_per_host, rate_profile, retries, retry_backoff, retry_budget, index_pool, head_timeout, index_timeout, download_timeout):
     if apk_versions <= 0:
         apk_versions = 1
+    if not engine_error(engine, http2) is None:
+        raise click.BadParameter(engine_error(engine, http2), param_hint='--engine')
+    try:
+        rate = RateLimiter.parse_rate(rate)
+    except ValueError as ex:
+        raise click.BadParameter(str(ex), param_hint='--rate')
+    try:
+        rate_per_host = RateLimiter.parse_rate(rate_per_host)
+    except ValueError as ex:
+        raise click.BadParameter(str(ex), param_hint='--rate-per-host')
+    try:
+        rate_profiles = [RateLimiter.parse_profile(profile) for profile in rate_profile]
+    except ValueError as ex:
+        raise click.BadParameter(str(ex), param_hint='--rate-profile')
     with Config(ctx.obj['config'], cache_dir=ctx.obj['cache_dir'], apk_versions=apk_versions) as cfg:
-        update = Update(cfg, max_workers=threads, head_timeout=head_timeout, index_timeout=index_timeout, download_timeout=download_timeout)
-        if index:
-            update.index()
-        if metadata:
-            update.metadata()
-        if apk:
-            update.apk()
-        if src:
-            update.src()
+        update = Update(cfg, max_workers=threads, head_timeout=head_timeout, index_timeout=index_timeout, download_timeout=download_timeout, index_processes=(index_pool == 'process'), delta=delta, reverify=reverify,
+                        engine=engine, max_per_host=max_per_host, http2=http2, mirrors=mirrors,
+                        rate=rate, rate_per_host=rate_per_host, rate_profiles=rate_profiles,
+                        retries=retries, retry_backoff=retry_backoff, retry_budget=retry_budget)
+        if pipeline:
+            update.pipeline(index=index, metadata=metadata, apk=apk, src=src)
+        else:
+            if index:
+                update.index()
+            if metadata:
+                update.metadata()
+            if apk:
+                update.apk()
+            if src:
+                update.src()
+        if update.retry.retries > 0:
+            LOGGER.info("retried %s requests, gave up on %s: %s", update.retry.retries, update.retry.exhausted, update.retry.hosts)
+        if not update.mirrors is None:
+            for stats in sorted(update.mirrors.stats(), key=lambda stats: stats.url):
+                LOGGER.info("mirror %s requests(%s) failures(%s) latency(%s) throughput(%s/s)", stats.url, stats.requests, stats.failures,
+                            '-' if stats.latency is None else '%.3fs' % stats.latency, FuturesSessionFlex.h_size(stats.throughput or 0))
 
 if __name__ == '__main__':
     main()
@@ -3,10 +3,19 @@
 
 from .futuressession import FuturesSessionFlex
 from .verifieddownload import FuturesSessionVerifiedDownload
+from .jarstream import JarIndexStream
+from .target import DownloadTarget, IncompleteDownload
+from .hostscheduler import HostScheduler
+from .mirrors import MirrorPool
+from .ratelimit import RateLimiter, TokenBucket
+from .retry import RetryPolicy, RetryScheduler
+from .engine import ENGINES, download_session, engine_error
 
 # disable insecure warning
 # https://stackoverflow.com/questions/27981545/suppress-insecurerequestwarning-unverified-https-request-is-being-made-in-pytho
 import urllib3
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-__all__ = ['FuturesSessionFlex', 'FuturesSessionVerifiedDownload']
+__all__ = ['FuturesSessionFlex', 'FuturesSessionVerifiedDownload', 'JarIndexStream', 'DownloadTarget', 'IncompleteDownload',
+           'HostScheduler', 'MirrorPool', 'RateLimiter', 'TokenBucket', 'RetryPolicy', 'RetryScheduler', 'ENGINES', 'download_session',
+           'engine_error']
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import asyncio
+import time
+from datetime import timedelta
+from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+try:
+    import httpx
+except ImportError:
+    httpx = None
+from .futuressession import FuturesSessionFlex
+from .target import DownloadTarget
+from .retry import RetryScheduler
+
+# httpx logs every request on INFO
+logging.getLogger('httpx').setLevel(logging.WARNING)
+
+
+LOGGER = logging.getLogger('download.AsyncVerifiedDownload')
+class AsyncVerifiedDownload(object):
+    """
+    asyncio based alternative to FuturesSessionVerifiedDownload.
+
+    All transfers run on one event loop in a background thread, so hundreds
+    of small downloads can be in flight without a thread each. Connections
+    are kept alive and reused per host, at most max_per_host transfers run
+    against the same host. File work of the targets (hashing a resumed
+    part, writing chunks, moving the result into place) runs in a small
+    thread pool, so a slow disk never stalls the loop. download() and
+    completed() behave exactly like FuturesSessionVerifiedDownload. Needs
+    httpx, HTTP/2 needs httpx[http2].
+    """
+    BLOCKSIZE = 65536
+
+    def __init__(self, max_workers=100, max_per_host=8, http2=False, retry=None, mirrors=None, limiter=None,
+                 user_agent='Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)'):
+        if httpx is None:
+            raise ImportError('the async download engine needs httpx: pip install fdroid-dl[async]')
+        self.__max_workers = max_workers
+        self.__max_per_host = max_per_host
+        self.__http2 = http2
+        self.__headers = {'User-Agent': user_agent}
+        self.__settings = {}
+        self.__settings_keys = []
+        self.__clients = {}
+        self.__hosts = {}
+        self.__retry = retry
+        self.__mirrors = mirrors
+        self.__limiter = limiter
+        self.__scheduler = self.__new_scheduler()
+        self.__loop = None
+        self.__thread = None
+        self.__executor = None
+
+    @property
+    def mirrors(self):
+        return self.__mirrors
+
+    @property
+    def limiter(self):
+        return self.__limiter
+
+    def __new_scheduler(self):
+        failover = None if self.__mirrors is None else self.__mirrors.failover
+        return RetryScheduler(self.__submit, self.__retry, transient=(httpx.TransportError,), failover=failover)
+
+    def map(self, pattern='http://', session=None):
+        ''' use auth and ssl verification of given requests session for urls starting with pattern '''
+        self.__settings[pattern] = (getattr(session, 'auth', None), getattr(session, 'verify', True))
+        if not pattern in self.__settings_keys:
+            self.__settings_keys.append(pattern)
+        self.__settings_keys = sorted(self.__settings_keys, key=len, reverse=True)
+
+    def set_headers(self, headers):
+        self.__headers.update(headers)
+
+    @staticmethod
+    def h_size(nbytes):
+        return FuturesSessionFlex.h_size(nbytes)
+
+    def __lookup_settings(self, url):
+        for key in self.__settings_keys:
+            if url.find(key) == 0:
+                return self.__settings[key]
+        return (None, True)
+
+    def __client(self, verify):
+        ''' one pooled client per ssl verification setting, only called on the loop '''
+        if not verify in self.__clients:
+            limits = httpx.Limits(max_connections=self.__max_workers, max_keepalive_connections=self.__max_workers)
+            self.__clients[verify] = httpx.AsyncClient(http2=self.__http2, verify=verify, limits=limits,
+                                                       headers=self.__headers, follow_redirects=True)
+        return self.__clients[verify]
+
+    def __semaphore(self, host):
+        if not host in self.__hosts:
+            self.__hosts[host] = asyncio.Semaphore(self.__max_per_host)
+        return self.__hosts[host]
+
+    def __io(self, func, *args):
+        ''' run blocking file work of a target in the executor, awaitable '''
+        return self.__loop.run_in_executor(self.__executor, func, *args)
+
+    async def __transfer(self, client, url, auth, timeout, target, start):
+        ''' one request for target, None if a resume was refused and the part file discarded '''
+        host = urlparse(url).netloc
+        headers = await self.__io(target.request_headers)
+        async with client.stream('GET', url, auth=auth, timeout=timeout, headers=headers) as response:
+            latency = time.time() - start
+            if response.status_code == 304:
+                unmodified = await self.__io(target.unmodified)
+                return (unmodified, 0, timedelta(seconds=time.time() - start), latency, 304)
+            if response.status_code == 416 and 'Range' in headers:
+                await self.__io(target.discard) # part file does not fit the remote file anymore
+                return None
+            response.raise_for_status()
+            await self.__io(target.open, response.status_code, response.headers)
+            try:
+                async for chunk in response.aiter_bytes(chunk_size=AsyncVerifiedDownload.BLOCKSIZE):
+                    if not self.__limiter is None:
+                        wait = self.__limiter.reserve(host, len(chunk))
+                        if wait > 0:
+                            await asyncio.sleep(wait)
+                    await self.__io(target.write, chunk)
+                success = await self.__io(target.finish)
+            except BaseException:
+                await self.__io(target.abort)
+                raise
+        return (success, target.bytes - target.resumed, timedelta(seconds=time.time() - start), latency,
+                response.status_code)
+
+    async def __fetch(self, url, filename, timeout, hash_type, hash, resume, blobs=None, key=None):
+        (auth, verify) = self.__lookup_settings(url)
+        client = self.__client(verify)
+        target = DownloadTarget(filename, hash_type, hash, url=url, resumable=resume, blobs=blobs, key=key)
+        async with self.__semaphore(urlparse(url).netloc):
+            start = time.time()
+            result = await self.__transfer(client, url, auth, timeout, target, start)
+            if result is None:
+                LOGGER.info("restarting %s, range not satisfiable", url)
+                result = await self.__transfer(client, url, auth, timeout, target, start)
+            return result
+
+    async def __aclose(self):
+        for client in self.__clients.values():
+            await client.aclose()
+        self.__clients = {}
+
+    def open(self):
+        self.__executor = ThreadPoolExecutor(max_workers=min(self.__max_workers, 16),
+                                             thread_name_prefix='AsyncVerifiedDownload-io')
+        self.__loop = asyncio.new_event_loop()
+        self.__thread = Thread(target=self.__loop.run_forever, name='AsyncVerifiedDownload')
+        self.__thread.daemon = True
+        self.__thread.start()
+        return self
+
+    def __submit(self, job):
+        url = job['url'] if self.__mirrors is None else self.__mirrors.start(job)
+        future = asyncio.run_coroutine_threadsafe(self.__fetch(url, job['filename'], job['timeout'],
+                                                               job['hash_type'], job['hash'], job['resume'],
+                                                               job['blobs'], job['url']), self.__loop)
+        future.request_url = url
+        return future
+
+    def download(self, url, filename, timeout=600, hash_type=None, hash=None, resume=False, blobs=None):
+        if self.__loop is None:
+            self.open()
+        self.__scheduler.add({'url': url, 'filename': filename, 'timeout': timeout, 'hash_type': hash_type,
+                              'hash': hash, 'resume': resume, 'blobs': blobs, 'start': time.time()})
+
+    def completed(self):
+        ''' same results as FuturesSessionVerifiedDownload.completed '''
+        for future in self.__scheduler.completed():
+            url = future.job['url']
+            filename = future.job['filename']
+            try:
+                (success, bytes, elapsed, latency, status_code) = future.result()
+                hbytes = AsyncVerifiedDownload.h_size(bytes)
+                if not self.__mirrors is None:
+                    self.__mirrors.finish(future.job, success, latency=latency, bytes=bytes, elapsed=elapsed.total_seconds())
+                    if not success and self.__mirrors.failover(future.job, 'hash verification failed'):
+                        self.__scheduler.add(future.job)
+                        continue
+                if status_code == 304:
+                    LOGGER.debug("not modified %s [%s]", url, elapsed)
+                elif not success:
+                    LOGGER.warning("hash verification failed %s [%s] (%s) ❌", url, elapsed, hbytes)
+                elif not future.job['hash_type'] is None:
+                    LOGGER.info("downloaded and hash verified %s [%s] (%s) ✔", url, elapsed, hbytes)
+                else:
+                    LOGGER.info("downloaded %s [%s] (%s) ✔", url, elapsed, hbytes)
+                yield (success, filename, bytes, hbytes, elapsed)
+            except Exception as ex:
+                if logging.getLogger().isEnabledFor(logging.DEBUG):
+                    LOGGER.exception("Error downloading %s to file %s", url, filename)
+                else:
+                    LOGGER.warning("Error downloading %s to file %s: %s", url, filename, str(ex))
+                elapsed = time.time() - future.job['start']
+                yield (False, filename, 0, AsyncVerifiedDownload.h_size(0), timedelta(seconds=elapsed))
+
+    def close(self):
+        self.__scheduler.cancel()
+        if self.__loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.__aclose(), self.__loop).result()
+        self.__loop.call_soon_threadsafe(self.__loop.stop)
+        self.__thread.join()
+        self.__loop.close()
+        self.__loop = None
+        self.__executor.shutdown()
+        self.__executor = None
+
+    #######################
+    # implement "with"
+    #######################
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+        self.__scheduler = self.__new_scheduler()
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import sys
+from .verifieddownload import FuturesSessionVerifiedDownload
+
+
+ENGINES = ['thread', 'async']
+
+
+LOGGER = logging.getLogger('download.engine')
+def engine_error(engine='thread', http2=False):
+    ''' reason why engine can not be used in this environment, None if it can '''
+    if engine != 'async':
+        return None
+    if sys.version_info < (3, 6):
+        return 'the async engine needs python 3.6 or newer'
+    # only look for the packages, importing them is left to the engine
+    from importlib.util import find_spec
+    if find_spec('httpx') is None:
+        return 'the async engine needs httpx: pip install fdroid-dl[async]'
+    if http2 and find_spec('h2') is None:
+        return 'HTTP/2 needs the h2 package: pip install fdroid-dl[http2]'
+    return None
+
+
+def download_session(engine='thread', max_workers=10, max_per_host=8, http2=False, retry=None, mirrors=None, limiter=None):
+    '''
+    download session of given engine, both share the download()/completed() contract.
+    the async engine is imported on demand, it needs python 3 and httpx.
+    '''
+    if engine == 'async':
+        from .asyncdownload import AsyncVerifiedDownload
+        return AsyncVerifiedDownload(max_workers=max_workers, max_per_host=max_per_host, http2=http2, retry=retry,
+                                     mirrors=mirrors, limiter=limiter)
+    if http2:
+        LOGGER.warning("HTTP/2 is only supported by the async engine")
+    return FuturesSessionVerifiedDownload(max_workers=max_workers, max_per_host=max_per_host, retry=retry,
+                                          mirrors=mirrors, limiter=limiter)
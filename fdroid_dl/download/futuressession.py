@@ -1,16 +1,21 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import os
 import logging
 import hashlib
 import time
-import copy
+from functools import partial
 from datetime import timedelta
-from zipfile import ZipFile
 from tempfile import NamedTemporaryFile
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+from requests import Session
 from requests.adapters import HTTPAdapter
 from requests_futures.sessions import FuturesSession
+from .jarstream import JarIndexStream
+from .hostscheduler import HostScheduler
 
 
 LOGGER = logging.getLogger('download.FuturesSessionFlex')
@@ -19,29 +24,48 @@ class FuturesSessionFlex(FuturesSession):
     SUFFIXES = ['B', 'KB', 'MB', 'GB', 'TB', 'PB']
 
     def __init__(self, max_workers=1, user_agent='Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)', *args, **kwargs):
+        '''
+        all requests share one executor and one connection pool per host,
+        max_per_host caps the parallel requests against a single host,
+        limiter is an optional RateLimiter for the bandwidth of response bodies.
+        '''
+        max_per_host = kwargs.pop('max_per_host', 8)
+        self.__limiter = kwargs.pop('limiter', None)
         kwargs.update({'max_workers': max_workers})
         super(FuturesSessionFlex, self).__init__(*args, **kwargs)
-        self.__sessions = {}
-        self.__sessions_keys = []
+        self.__settings = {}
+        self.__settings_keys = []
+        self.__scheduler = HostScheduler(self.executor, max_workers, max_per_host)
 
-        self.__fs_kwargs = {}
-        self.__fs_kwargs.update(kwargs)
-
-        _adapter_kwargs = {'pool_connections': max_workers, 'pool_maxsize': max_workers, 'pool_block': True}
+        _pool_size = max(1, min(max_workers, max_per_host))
+        _adapter_kwargs = {'pool_connections': max_workers, 'pool_maxsize': _pool_size, 'pool_block': True}
         self.mount('https://', HTTPAdapter(**_adapter_kwargs))
         self.mount('http://', HTTPAdapter(**_adapter_kwargs))
         if self.headers is None:
             self.headers = {}
         self.headers.update({'User-Agent': user_agent})
 
+    @property
+    def scheduler(self):
+        return self.__scheduler
+
+    @property
+    def limiter(self):
+        return self.__limiter
+
     def map(self, pattern='http://', session=None):
-        ''' if called with session None -> default session for ctor is used '''
-        kwargs = copy.deepcopy(self.__fs_kwargs)
-        kwargs['session'] = session
-        if pattern not in self.__sessions:
-            self.__sessions_keys.append(pattern)
-        self.__sessions[pattern] = FuturesSessionFlex(*(), **kwargs)
-        self.__sessions_keys = sorted(self.__sessions_keys, key=len, reverse=True)
+        '''
+        use auth and ssl verification of session for urls starting with pattern,
+        if called with session None -> settings of this session are used.
+        only the settings are kept, requests still share the pools of this session.
+        '''
+        settings = (getattr(session, 'auth', self.auth), getattr(session, 'verify', self.verify))
+        if self.__settings.get(pattern) == settings:
+            return
+        if pattern not in self.__settings:
+            self.__settings_keys.append(pattern)
+            self.__settings_keys = sorted(self.__settings_keys, key=len, reverse=True)
+        self.__settings[pattern] = settings
 
     def set_headers(self, headers):
         self.headers.update(headers)
@@ -70,54 +94,67 @@ class FuturesSessionFlex(FuturesSession):
     @staticmethod
     def add_hash(response, *args, **kwargs):
         response.hash = None
-        if response.ok:
-            timestamp = str(time.time())
-            cache_var = response.headers.get('Last-Modified', timestamp) + response.headers.get('ETag', timestamp)
+        if response.ok and ('Last-Modified' in response.headers or 'ETag' in response.headers):
+            cache_var = response.headers.get('Last-Modified', '') + response.headers.get('ETag', '')
             response.hash = hashlib.sha1(str(cache_var).encode('UTF-8')).hexdigest()
         return response
 
     @staticmethod
     def extract_jar(response, *args, **kwargs):
-        if response.ok:
+        '''
+        spool jar to disk once while hashing, index is decompressed lazily on read.
+        bind a RateLimiter with functools.partial(extract_jar, limiter=...) to throttle it.
+        '''
+        limiter = kwargs.pop('limiter', None)
+        if response.ok and response.status_code != 304 and not response.is_redirect:
             start = time.time()
             response = FuturesSessionFlex.add_size(response, *args, **kwargs)
-            response.index = NamedTemporaryFile()
-            with NamedTemporaryFile() as temp_file:
+            content_hash = hashlib.sha256()
+            spooled = 0
+            jar = NamedTemporaryFile(suffix='.jar')
+            try:
                 for chunk in response.iter_content(chunk_size=FuturesSessionFlex.BLOCKSIZE):
                     if chunk:
-                        temp_file.write(chunk)
-                zip_file = ZipFile(temp_file)
-                idxfile = 'index-v1.json' if 'index-v1.json' in zip_file.namelist() else 'index.xml'
-                with zip_file.open(idxfile) as file:
-                    while True:
-                        byte = file.read(FuturesSessionFlex.BLOCKSIZE)
-                        if not byte:
-                            break
-                        response.index.write(byte)
-            LOGGER.debug("%s - %s - (%s)", response.index.name, response.url, FuturesSessionFlex.h_size(os.stat(response.index.name).st_size))
+                        if not limiter is None:
+                            limiter.throttle(urlparse(response.url).netloc, len(chunk))
+                        content_hash.update(chunk)
+                        jar.write(chunk)
+                        spooled += len(chunk)
+                jar.flush()
+                jar.seek(0)
+                response.index = JarIndexStream(jar, spooled=spooled, content_hash=content_hash.hexdigest())
+            except Exception:
+                jar.close()
+                raise
+            response.content_hash = response.index.content_hash
+            LOGGER.debug("%s:%s - %s - (%s)", response.index.name, response.index.member, response.url, FuturesSessionFlex.h_size(response.index.size))
             elapsed = time.time() - start
             response.elapsed += timedelta(seconds=elapsed)
         return response
 
-    def __lookup_fs_session(self, url):
+    def __lookup_settings(self, url):
         # fast direct matches
-        if url in self.__sessions:
-            return self.__sessions[url]
+        if url in self.__settings:
+            return self.__settings[url]
         # slower pattern search depends on pattern count and size
-        for k in self.__sessions_keys:
+        for k in self.__settings_keys:
             if url.find(k) == 0:
-                return self.__sessions[k]
+                return self.__settings[k]
         return None
 
-    def request(self, *args, **kwargs):
-        session = self.__lookup_fs_session(args[1])
-        if not session is None:
-            return session.request(*args, **kwargs)
-        return super(FuturesSessionFlex, self).request(*args, **kwargs)
+    def request(self, method, url, *args, **kwargs):
+        '''
+        queues the request with the HostScheduler, returns a future.
+        auth and verify of a mapped pattern are passed per request, urllib3
+        keeps apart connections with different ssl verification on its own.
+        '''
+        settings = self.__lookup_settings(url)
+        if not settings is None:
+            kwargs.setdefault('auth', settings[0])
+            kwargs.setdefault('verify', settings[1])
+        func = partial(Session.request, self)
+        return self.__scheduler.submit(urlparse(url).netloc, func, method, url, *args, **kwargs)
 
     def close(self):
-        try:
-            for key, session in self.__sessions.items():
-                session.close()
-        except Exception:
-            LOGGER.exception("Error closing sessions")
+        self.__scheduler.cancel()
+        super(FuturesSessionFlex, self).close()
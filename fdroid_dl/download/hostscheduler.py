@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+from collections import deque
+from functools import partial
+from threading import Lock
+from concurrent.futures import Future
+
+
+LOGGER = logging.getLogger('download.HostScheduler')
+class HostScheduler(object):
+    """
+    Hands requests to one executor, fairly across hosts.
+
+    Every host gets a queue of its own. A request starts once fewer than
+    max_workers requests run overall and fewer than max_per_host against
+    its host, free slots are given to the waiting hosts round robin. A
+    large repo can not starve the small ones this way and no host sees
+    more parallel connections than it allows.
+    """
+
+    def __init__(self, executor, max_workers, max_per_host=8):
+        self.__executor = executor
+        self.__max_workers = max(1, max_workers)
+        self.__max_per_host = max(1, max_per_host)
+        self.__lock = Lock()
+        self.__queues = {}
+        self.__hosts = deque()
+        self.__running = {}
+        self.__active = 0
+
+    @property
+    def max_per_host(self):
+        return int(self.__max_per_host)
+
+    @property
+    def active(self):
+        ''' requests handed to the executor and not finished yet '''
+        return int(self.__active)
+
+    @property
+    def pending(self):
+        ''' requests waiting for a free slot '''
+        with self.__lock:
+            return sum(len(queue) for queue in self.__queues.values())
+
+    def submit(self, host, fn, *args, **kwargs):
+        ''' returns a future that resolves with the result of fn once it ran '''
+        future = Future()
+        with self.__lock:
+            if not host in self.__queues:
+                self.__queues[host] = deque()
+                self.__hosts.append(host)
+            self.__queues[host].append((future, fn, args, kwargs))
+        self.__dispatch()
+        return future
+
+    def __next(self):
+        ''' next (host, job) allowed to start, None if all slots are taken. called with lock held '''
+        if self.__active >= self.__max_workers:
+            return None
+        for _ in range(len(self.__hosts)):
+            host = self.__hosts[0]
+            self.__hosts.rotate(-1)
+            if self.__running.get(host, 0) < self.__max_per_host:
+                queue = self.__queues[host]
+                job = queue.popleft()
+                if len(queue) == 0:
+                    del self.__queues[host]
+                    self.__hosts.remove(host)
+                return (host, job)
+        return None
+
+    def __dispatch(self):
+        while True:
+            with self.__lock:
+                picked = self.__next()
+                if picked is None:
+                    return
+                (host, (future, fn, args, kwargs)) = picked
+                if not future.set_running_or_notify_cancel():
+                    continue
+                self.__running[host] = self.__running.get(host, 0) + 1
+                self.__active += 1
+            # submitted outside the lock, the done callback may run right away
+            try:
+                inner = self.__executor.submit(fn, *args, **kwargs)
+            except Exception as ex:
+                self.__release(host)
+                future.set_exception(ex)
+                continue
+            inner.add_done_callback(partial(self.__done, host, future))
+
+    def __release(self, host):
+        with self.__lock:
+            self.__active -= 1
+            self.__running[host] -= 1
+            if self.__running[host] <= 0:
+                del self.__running[host]
+
+    def __done(self, host, future, inner):
+        self.__release(host)
+        if inner.cancelled():
+            future.set_exception(RuntimeError('request was cancelled'))
+        elif not inner.exception() is None:
+            future.set_exception(inner.exception())
+        else:
+            future.set_result(inner.result())
+        self.__dispatch()
+
+    def cancel(self):
+        ''' drop all requests that did not start yet '''
+        with self.__lock:
+            queued = [job[0] for queue in self.__queues.values() for job in queue]
+            self.__queues = {}
+            self.__hosts.clear()
+        for future in queued:
+            future.cancel()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+from zipfile import ZipFile
+
+
+LOGGER = logging.getLogger('download.JarIndexStream')
+class JarIndexStream(object):
+    ''' read only stream of the index file packed into a spooled index jar '''
+    MEMBERS = (('index-v1.json', 'json'), ('index.xml', 'xml'))
+
+    def __init__(self, jar, spooled=0, content_hash=None):
+        self.__jar = jar
+        self.__spooled = spooled
+        self.__content_hash = content_hash
+        self.__zip = ZipFile(jar)
+        names = self.__zip.namelist()
+        for member, fmt in JarIndexStream.MEMBERS:
+            if member in names:
+                self.__member = member
+                self.__format = fmt
+                break
+        else:
+            self.__zip.close()
+            raise IOError('no index file found in %s' % jar.name)
+        self.__file = self.__zip.open(self.__member)
+
+    @property
+    def name(self):
+        return str(self.__jar.name)
+
+    @property
+    def path(self):
+        return str(self.__jar.name)
+
+    @property
+    def member(self):
+        return str(self.__member)
+
+    @property
+    def format(self):
+        return str(self.__format)
+
+    @property
+    def size(self):
+        ''' uncompressed size of the index file '''
+        return self.__zip.getinfo(self.__member).file_size
+
+    @property
+    def spooled(self):
+        ''' bytes written to disk while spooling the jar '''
+        return int(self.__spooled)
+
+    @property
+    def content_hash(self):
+        return self.__content_hash
+
+    def read(self, size=-1):
+        return self.__file.read(size)
+
+    def readline(self, size=-1):
+        return self.__file.readline(size)
+
+    def close(self):
+        try:
+            self.__file.close()
+            self.__zip.close()
+        finally:
+            self.__jar.close()
+
+    #######################
+    # implement "with"
+    #######################
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
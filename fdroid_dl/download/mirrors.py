@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import time
+from threading import Lock
+
+
+class MirrorStats(object):
+    ''' running averages of one mirror '''
+    ALPHA = 0.3
+
+    def __init__(self, url):
+        self.url = url
+        self.active = 0
+        self.requests = 0
+        self.failures = 0
+        self.errors = 0 # consecutive failures
+        self.bytes = 0
+        self.latency = None
+        self.throughput = None
+
+    @property
+    def disabled(self):
+        return self.errors >= MirrorPool.MAX_ERRORS
+
+    def cost(self):
+        ''' expected seconds per transfer, mirrors without numbers yet are tried first '''
+        if self.latency is None:
+            return 0.0
+        cost = self.latency
+        if self.throughput:
+            cost += MirrorPool.TYPICAL_SIZE / self.throughput
+        return cost * (self.active + 1)
+
+    def average(self, old, new):
+        if old is None:
+            return new
+        return MirrorStats.ALPHA * new + (1 - MirrorStats.ALPHA) * old
+
+    def __repr__(self):
+        return "<MirrorStats: %s requests(%s) failures(%s) latency(%s) throughput(%s)>"%(
+            self.url, self.requests, self.failures, self.latency, self.throughput)
+
+
+LOGGER = logging.getLogger('download.MirrorPool')
+class MirrorPool(object):
+    """
+    Spreads downloads of a repo across the mirrors it advertises.
+
+    Urls below a registered repo url are rewritten to the mirror that is
+    expected to finish first, based on latency, throughput and the transfers
+    already running against it. A failed transfer moves on to a mirror that
+    was not tried yet, a mirror failing MAX_ERRORS times in a row is only
+    used if nothing else is left. Every file is still verified against the
+    hash of the index, so the content of a mirror does not need to be trusted.
+    """
+    MAX_ERRORS = 3
+    TYPICAL_SIZE = 1024 * 1024
+
+    def __init__(self):
+        self.__lock = Lock()
+        self.__repos = {}
+        self.__stats = {}
+
+    @staticmethod
+    def clean_url(url):
+        if not url.endswith('/'):
+            url += '/'
+        return url
+
+    def add(self, url, mirrors):
+        ''' register mirrors of repo url, url itself always stays a candidate '''
+        url = MirrorPool.clean_url(url)
+        bases = [url]
+        for mirror in mirrors or []:
+            mirror = MirrorPool.clean_url(mirror)
+            if not mirror in bases:
+                bases.append(mirror)
+        with self.__lock:
+            self.__repos[url] = bases
+            for base in bases:
+                if not base in self.__stats:
+                    self.__stats[base] = MirrorStats(base)
+        return bases
+
+    def __repo(self, url):
+        ''' longest registered repo url url starts with '''
+        found = None
+        for repo in self.__repos:
+            if url.startswith(repo) and (found is None or len(repo) > len(found)):
+                found = repo
+        return found
+
+    def __base(self, url):
+        found = None
+        for base in self.__stats:
+            if url.startswith(base) and (found is None or len(base) > len(found)):
+                found = base
+        return found
+
+    def candidates(self, url):
+        ''' url on every mirror of its repo, best first '''
+        with self.__lock:
+            repo = self.__repo(url)
+            if repo is None:
+                return [url]
+            path = url[len(repo):]
+            bases = sorted(self.__repos[repo], key=lambda base: (self.__stats[base].disabled, self.__stats[base].cost(),
+                                                                 self.__stats[base].active))
+            return [base + path for base in bases]
+
+    def untried(self, url, tried):
+        ''' mirror urls of url not in tried, best first '''
+        return [candidate for candidate in self.candidates(url) if not candidate in tried]
+
+    def start(self, job):
+        ''' url the download job should fetch next, prefers mirrors it did not try yet '''
+        tried = job.setdefault('tried', [])
+        candidates = self.untried(job['url'], tried) or self.candidates(job['url'])
+        fetch = candidates[0]
+        tried.append(fetch)
+        job['fetch'] = fetch
+        job['fetch_start'] = time.time()
+        with self.__lock:
+            base = self.__base(fetch)
+            if not base is None:
+                self.__stats[base].active += 1
+                self.__stats[base].requests += 1
+        return fetch
+
+    def finish(self, job, success, latency=None, bytes=0, elapsed=None):
+        ''' record the outcome of the last fetch of job '''
+        if not 'fetch' in job:
+            return
+        if elapsed is None:
+            elapsed = time.time() - job['fetch_start']
+        with self.__lock:
+            base = self.__base(job.pop('fetch'))
+            if base is None:
+                return
+            stats = self.__stats[base]
+            stats.active = max(0, stats.active - 1)
+            if not success:
+                stats.failures += 1
+                stats.errors += 1
+                return
+            stats.errors = 0
+            stats.bytes += bytes
+            if not latency is None:
+                stats.latency = stats.average(stats.latency, latency)
+            transfer = elapsed - (latency or 0)
+            if bytes > 0 and transfer > 0:
+                stats.throughput = stats.average(stats.throughput, float(bytes) / transfer)
+
+    def failover(self, job, error=None):
+        ''' records a failed fetch, True if job should go on with another mirror right away '''
+        self.finish(job, False)
+        if len(self.untried(job['url'], job.get('tried', []))) == 0:
+            return False
+        LOGGER.info("FAILOVER %s: %s", job['url'], str(error))
+        return True
+
+    def stats(self):
+        ''' stats of all mirrors that were used '''
+        with self.__lock:
+            return [stats for stats in self.__stats.values() if stats.requests > 0]
+
+    def __repr__(self): return "<MirrorPool: %s>"%(self.__repos)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import re
+import time
+from datetime import datetime, timedelta
+from threading import Lock
+from .futuressession import FuturesSessionFlex
+
+clock = getattr(time, 'monotonic', time.time)
+
+
+class TokenBucket(object):
+    '''
+    bytes/s limit, one second worth of bytes can be sent in a burst.
+    reserve() may run into debt, the caller sleeps until it is paid back.
+    '''
+
+    def __init__(self, rate):
+        self.__lock = Lock()
+        self.__rate = rate
+        self.__tokens = float(rate)
+        self.__last = clock()
+
+    @property
+    def rate(self):
+        return self.__rate
+
+    @rate.setter
+    def rate(self, rate):
+        with self.__lock:
+            self.__rate = rate
+            self.__tokens = min(self.__tokens, float(rate))
+
+    def reserve(self, nbytes):
+        ''' take nbytes, returns the seconds to wait before sending them '''
+        with self.__lock:
+            now = clock()
+            self.__tokens = min(float(self.__rate), self.__tokens + (now - self.__last) * self.__rate)
+            self.__last = now
+            self.__tokens -= nbytes
+            if self.__tokens >= 0:
+                return 0.0
+            return -self.__tokens / self.__rate
+
+
+LOGGER = logging.getLogger('download.RateLimiter')
+class RateLimiter(object):
+    """
+    Caps the bandwidth of all downloads of a run.
+
+    Every chunk read from a response is paid for in a global bucket and in
+    the bucket of its host, the reading thread (or coroutine) sleeps until
+    both allow it. Time of day profiles replace the global rate while they
+    are active, e.g. to run at full speed at night only. A rate of None
+    means unlimited.
+    """
+    UNITS = {'': 1, 'B': 1, 'K': 1024, 'KB': 1024, 'M': 1024 ** 2, 'MB': 1024 ** 2, 'G': 1024 ** 3, 'GB': 1024 ** 3}
+
+    def __init__(self, rate=None, per_host=None, profiles=None):
+        self.__rate = rate
+        self.__per_host = per_host
+        self.__profiles = profiles or []
+        self.__lock = Lock()
+        self.__global = None
+        self.__hosts = {}
+        self.__bytes = 0
+        self.__waited = 0.0
+
+    @staticmethod
+    def parse_rate(value):
+        ''' "500K", "2M", "1.5MB" -> bytes/s, "0" or "unlimited" -> None '''
+        if value is None:
+            return None
+        value = str(value).strip().upper()
+        if value in ('', '0', 'UNLIMITED'):
+            return None
+        match = re.match(r'^([0-9]+(?:\.[0-9]+)?)\s*([KMG]?B?)(?:/S)?$', value)
+        if match is None:
+            raise ValueError("invalid rate %s, use e.g. 500K or 2M" % value)
+        return int(float(match.group(1)) * RateLimiter.UNITS[match.group(2)]) or None
+
+    @staticmethod
+    def parse_profile(value):
+        ''' "22:00-06:00=10M" -> (start minute, end minute, bytes/s) '''
+        match = re.match(r'^\s*([0-9]{1,2}):([0-9]{2})\s*-\s*([0-9]{1,2}):([0-9]{2})\s*=\s*(.+)$', str(value))
+        if match is None:
+            raise ValueError("invalid profile %s, use e.g. 08:00-18:00=1M" % value)
+        (start_h, start_m, end_h, end_m) = [int(group) for group in match.groups()[:4]]
+        if start_h > 23 or end_h > 24 or start_m > 59 or end_m > 59:
+            raise ValueError("invalid time in profile %s" % value)
+        return (start_h * 60 + start_m, end_h * 60 + end_m, RateLimiter.parse_rate(match.group(5)))
+
+    @property
+    def per_host(self):
+        return self.__per_host
+
+    @property
+    def bytes(self):
+        ''' bytes paid for so far '''
+        return int(self.__bytes)
+
+    @property
+    def waited(self):
+        ''' seconds all readers spent sleeping so far '''
+        return float(self.__waited)
+
+    def rate(self, now=None):
+        ''' global rate in effect at now, local time '''
+        now = now or datetime.now()
+        minute = now.hour * 60 + now.minute
+        for (start, end, rate) in self.__profiles:
+            if start <= end and start <= minute < end:
+                return rate
+            if start > end and (minute >= start or minute < end): # crosses midnight
+                return rate
+        return self.__rate
+
+    def reserve(self, host, nbytes):
+        ''' seconds to wait before nbytes of host may be read '''
+        rate = self.rate()
+        with self.__lock:
+            self.__bytes += nbytes
+            if rate is None:
+                self.__global = None
+            elif self.__global is None:
+                self.__global = TokenBucket(rate)
+            elif self.__global.rate != rate:
+                self.__global.rate = rate
+            if not self.__per_host is None and not host in self.__hosts:
+                self.__hosts[host] = TokenBucket(self.__per_host)
+            buckets = [bucket for bucket in (self.__global, self.__hosts.get(host)) if not bucket is None]
+        wait = max([bucket.reserve(nbytes) for bucket in buckets] or [0.0])
+        if wait > 0:
+            with self.__lock:
+                self.__waited += wait
+        return wait
+
+    def throttle(self, host, nbytes):
+        ''' blocking version of reserve for worker threads '''
+        wait = self.reserve(host, nbytes)
+        if wait > 0:
+            time.sleep(wait)
+
+    def report(self, stage, nbytes, elapsed):
+        ''' log achieved against configured throughput of a stage that read nbytes in elapsed seconds '''
+        if isinstance(elapsed, timedelta):
+            elapsed = elapsed.total_seconds()
+        achieved = nbytes / elapsed if elapsed > 0 else 0
+        rate = self.rate()
+        LOGGER.info("THROUGHPUT %s achieved(%s/s) configured(%s) per host(%s)", stage, FuturesSessionFlex.h_size(achieved),
+                    'unlimited' if rate is None else FuturesSessionFlex.h_size(rate) + '/s',
+                    'unlimited' if self.__per_host is None else FuturesSessionFlex.h_size(self.__per_host) + '/s')
+
+    def __repr__(self): return "<RateLimiter: rate(%s) per_host(%s) profiles(%s)>"%(self.__rate, self.__per_host, self.__profiles)
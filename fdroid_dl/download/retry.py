@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import random
+import time
+from threading import Lock, Timer
+from email.utils import parsedate_tz, mktime_tz
+from concurrent.futures import Future
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+import requests
+from .target import IncompleteDownload
+
+
+LOGGER = logging.getLogger('download.RetryPolicy')
+class RetryPolicy(object):
+    """
+    Decides if and when a failed request is tried again.
+
+    Connection errors, timeouts, truncated bodies and the status codes in
+    STATUS are retried up to retries times with exponential backoff plus
+    jitter, a Retry-After header sent by the server takes precedence. Every
+    host has a budget of retries per run, so a host that is down does not
+    hold up everything else. Shared by all stages of a run, the counters end up in the
+    summaries.
+    """
+    STATUS = (408, 425, 429, 500, 502, 503, 504)
+    TRANSIENT = (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                 requests.exceptions.ChunkedEncodingError, IncompleteDownload)
+
+    def __init__(self, retries=3, backoff=1.0, max_backoff=120.0, jitter=0.5, host_budget=50):
+        self.__retries = retries
+        self.__backoff = backoff
+        self.__max_backoff = max_backoff
+        self.__jitter = jitter
+        self.__host_budget = host_budget
+        self.__lock = Lock()
+        self.__hosts = {}
+        self.__total = 0
+        self.__exhausted = 0
+
+    @property
+    def retries(self):
+        ''' retries scheduled so far '''
+        return int(self.__total)
+
+    @property
+    def exhausted(self):
+        ''' requests given up on after all retries or with an empty host budget '''
+        return int(self.__exhausted)
+
+    @property
+    def hosts(self):
+        ''' retries per host '''
+        return dict(self.__hosts)
+
+    def retryable(self, error, transient=()):
+        response = getattr(error, 'response', None)
+        if not response is None and getattr(response, 'status_code', None) in RetryPolicy.STATUS:
+            return True
+        return isinstance(error, RetryPolicy.TRANSIENT + tuple(transient))
+
+    @staticmethod
+    def retry_after(error):
+        ''' seconds requested by a Retry-After header, None if there is none '''
+        response = getattr(error, 'response', None)
+        if response is None or response.headers.get('Retry-After') is None:
+            return None
+        value = response.headers.get('Retry-After').strip()
+        if value.isdigit():
+            return float(value)
+        date = parsedate_tz(value)
+        if date is None:
+            return None
+        return max(0.0, mktime_tz(date) - time.time())
+
+    def delay(self, attempt, error=None):
+        retry_after = RetryPolicy.retry_after(error)
+        if not retry_after is None:
+            return min(retry_after, self.__max_backoff)
+        delay = min(self.__backoff * (2 ** attempt), self.__max_backoff)
+        return delay * (1 - self.__jitter * random.random())
+
+    def retry(self, url, error, attempt, transient=()):
+        ''' seconds to wait before attempt+1, None if the request should not be retried '''
+        if not self.retryable(error, transient):
+            return None
+        host = urlparse(url).netloc
+        with self.__lock:
+            if attempt >= self.__retries or self.__hosts.get(host, 0) >= self.__host_budget:
+                self.__exhausted += 1
+                return None
+            self.__hosts[host] = self.__hosts.get(host, 0) + 1
+            self.__total += 1
+        return self.delay(attempt, error)
+
+    def __repr__(self): return "<RetryPolicy: retries(%s) exhausted(%s)>"%(self.__total, self.__exhausted)
+
+
+class RetryScheduler(object):
+    """
+    Collects the futures of submitted jobs and resubmits failed ones.
+
+    submit(job) has to return a future with a request_url attribute.
+    Retries are started from timers after their backoff delay, so waiting
+    for them never blocks other transfers. completed() yields each job's
+    final future once, either successful or failed for good.
+
+    failover(job, error) is asked first for every failed job, if it returns
+    True the job is submitted again right away without a backoff, e.g. to
+    try another mirror.
+    """
+
+    def __init__(self, submit, policy=None, transient=(), failover=None):
+        self.__submit = submit
+        self.__policy = policy or RetryPolicy(retries=0)
+        self.__transient = transient
+        self.__failover = failover
+        self.__done = Queue()
+        self.__outstanding = 0
+        self.__timers = []
+
+    @property
+    def policy(self):
+        return self.__policy
+
+    def add(self, job):
+        self.__outstanding += 1
+        self.__schedule(job, 0)
+
+    def __schedule(self, job, attempt):
+        try:
+            future = self.__submit(job)
+        except Exception as ex:
+            future = Future()
+            future.set_exception(ex)
+            future.request_url = ''
+        future.job = job
+        future.attempt = attempt
+        future.add_done_callback(self.__done.put)
+
+    @staticmethod
+    def error(future):
+        ''' exception raised by future, including http error status of a response '''
+        try:
+            result = future.result()
+            if hasattr(result, 'raise_for_status'):
+                result.raise_for_status()
+        except Exception as ex:
+            return ex
+        return None
+
+    def completed(self):
+        while self.__outstanding > 0:
+            future = self.__done.get()
+            error = RetryScheduler.error(future)
+            if not error is None and not self.__failover is None and self.__failover(future.job, error):
+                self.__schedule(future.job, future.attempt)
+                continue
+            if not error is None:
+                delay = self.__policy.retry(future.request_url, error, future.attempt, self.__transient)
+                if not delay is None:
+                    LOGGER.info("RETRY %s in %.1fs (%s): %s", future.request_url, delay, future.attempt + 1, str(error))
+                    timer = Timer(delay, self.__schedule, (future.job, future.attempt + 1))
+                    timer.daemon = True
+                    self.__timers.append(timer)
+                    timer.start()
+                    continue
+            self.__outstanding -= 1
+            yield future
+        self.__timers = []
+
+    def cancel(self):
+        for timer in self.__timers:
+            timer.cancel()
+        self.__timers = []
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import hashlib
+import json
+import os
+import os.path
+try:
+    from os import replace
+except ImportError:
+    from os import rename as replace
+from tempfile import NamedTemporaryFile
+
+
+# temp files are created 0600, finished downloads get the usual umask permissions
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+class IncompleteDownload(IOError):
+    ''' the body ended before all bytes announced by Content-Length/Content-Range were received '''
+    pass
+
+
+LOGGER = logging.getLogger('download.DownloadTarget')
+class DownloadTarget(object):
+    """
+    File a download is written to.
+
+    Chunks go to a temp file next to filename and are hashed as they are
+    written. finish() moves the temp file into place if the hash matches,
+    so a download is written once and never read back. Used by all
+    download engines. A body shorter or longer than announced by
+    Content-Length/Content-Range raises IncompleteDownload instead, which
+    is retried like a broken connection.
+
+    Resumable targets write to ``.<name>.part`` instead and keep it when a
+    transfer breaks off, together with a ``.<name>.part.json`` sidecar
+    holding url, validator and byte offset. The next attempt asks for the
+    missing bytes with Range/If-Range, see resume_headers().
+
+    Targets with a BlobStore hand the finished file to the store and link
+    filename to the blob, the url is recorded with its digest and response
+    validators. The next attempt asks with If-None-Match/If-Modified-Since,
+    see conditional_headers(), a 304 answer is handled by unmodified().
+    """
+    BLOCKSIZE = 65536
+
+    def __init__(self, filename, hash_type=None, hash=None, url=None, resumable=False, blobs=None, key=None):
+        ''' key: url recorded in blobs, defaults to url '''
+        self.__filename = filename
+        self.__hash_type = hash_type
+        self.__hash = hash
+        self.__url = url
+        self.__resumable = resumable
+        self.__blobs = blobs
+        self.__key = url if key is None else key
+        self.__validator = None
+        self.__headers = {}
+        self.__hasher = None
+        self.__digest = None
+        self.__tmp = None
+        self.__bytes = 0
+        self.__resumed = 0
+
+    @property
+    def filename(self):
+        return str(self.__filename)
+
+    @property
+    def bytes(self):
+        ''' bytes written so far, including a resumed prefix '''
+        return int(self.__bytes)
+
+    @property
+    def resumed(self):
+        ''' bytes taken over from an earlier attempt '''
+        return int(self.__resumed)
+
+    @property
+    def part(self):
+        (foldername, basename) = os.path.split(self.__filename)
+        return os.path.join(foldername, '.' + basename + '.part')
+
+    @property
+    def sidecar(self):
+        return self.part + '.json'
+
+    def __journal(self):
+        ''' sidecar of an earlier attempt at the same url, None if there is nothing to resume '''
+        if not self.__resumable or not os.path.isfile(self.part) or not os.path.isfile(self.sidecar):
+            return None
+        try:
+            with open(self.sidecar, 'r') as file:
+                journal = json.load(file)
+        except ValueError:
+            return None
+        if journal.get('url') != self.__url or journal.get('hash') != self.__hash or journal.get('validator') is None:
+            return None
+        return journal
+
+    def resume_headers(self):
+        ''' request headers to fetch only the missing part, empty if nothing can be resumed '''
+        journal = self.__journal()
+        if journal is None:
+            return {}
+        offset = os.path.getsize(self.part)
+        if offset <= 0:
+            return {}
+        return {'Range': 'bytes=%d-' % offset, 'If-Range': journal['validator']}
+
+    def conditional_headers(self):
+        ''' headers to revalidate the stored blob of the url, empty without BlobStore or earlier download '''
+        if self.__blobs is None:
+            return {}
+        return self.__blobs.conditional_headers(self.__key)
+
+    def request_headers(self):
+        ''' resume headers if there is a part file to continue, conditional headers otherwise '''
+        return self.resume_headers() or self.conditional_headers()
+
+    def unmodified(self):
+        ''' server answered 304, filename is linked to the stored blob. False if there is none '''
+        if self.__blobs is None:
+            return False
+        return self.__blobs.unmodified(self.__key, self.__filename)
+
+    @staticmethod
+    def validator(headers):
+        ''' strong validator usable in If-Range, None if the server sent none '''
+        etag = headers.get('ETag')
+        if not etag is None and not etag.startswith('W/'):
+            return etag
+        return headers.get('Last-Modified')
+
+    def open(self, status_code=200, headers=None):
+        '''
+        prepare for the body of a response, a 206 response continues the
+        part file of an earlier attempt after hashing what is already there.
+        '''
+        foldername = os.path.dirname(self.__filename)
+        if len(foldername) > 0 and not os.path.exists(foldername):
+            os.makedirs(foldername)
+        if not self.__hash_type is None:
+            self.__hasher = hashlib.new(self.__hash_type)
+        if not self.__blobs is None:
+            self.__digest = hashlib.new(self.__blobs.HASH_TYPE)
+        self.__bytes = 0
+        self.__resumed = 0
+        self.__headers = headers or {}
+        if not self.__resumable:
+            self.__tmp = NamedTemporaryFile(mode='wb', dir=foldername or '.', prefix='.', suffix='.part', delete=False)
+            return self
+        self.__validator = DownloadTarget.validator(headers or {})
+        if status_code == 206 and not self.__journal() is None:
+            self.__tmp = open(self.part, 'r+b')
+            while True:
+                block = self.__tmp.read(DownloadTarget.BLOCKSIZE)
+                if not block:
+                    break
+                self.__bytes += len(block)
+                self.__update(block)
+            self.__resumed = self.__bytes
+            LOGGER.info("resuming %s at %s bytes", self.__url, self.__resumed)
+        else:
+            self.__tmp = open(self.part, 'wb')
+        self.__save_journal()
+        return self
+
+    def __save_journal(self):
+        with open(self.sidecar, 'w') as file:
+            json.dump({'url': self.__url, 'validator': self.__validator, 'hash': self.__hash,
+                       'hash_type': self.__hash_type, 'offset': self.__bytes}, file)
+
+    def __update(self, chunk):
+        if not self.__hasher is None:
+            self.__hasher.update(chunk)
+        if not self.__digest is None:
+            self.__digest.update(chunk)
+
+    def write(self, chunk):
+        self.__tmp.write(chunk)
+        self.__bytes += len(chunk)
+        self.__update(chunk)
+
+    def expected(self):
+        ''' total size announced by the response headers, None if unknown or the body was decoded '''
+        content_range = self.__headers.get('Content-Range')
+        if not content_range is None:
+            try:
+                return int(content_range.split('/')[0].split('-')[1]) + 1
+            except (IndexError, ValueError):
+                return None
+        if self.__headers.get('Content-Encoding', 'identity') != 'identity':
+            return None # requests/httpx hand out the decoded body
+        try:
+            return self.__resumed + int(self.__headers.get('Content-Length'))
+        except (TypeError, ValueError):
+            return None
+
+    def finish(self):
+        '''
+        returns True if the file was verified and moved into place.
+        raises IncompleteDownload if the body does not have the announced size,
+        resumable targets keep what they got for the next attempt.
+        '''
+        expected = self.expected()
+        if not expected is None and expected != self.__bytes:
+            self.abort()
+            raise IncompleteDownload('received %s of %s bytes of %s' % (self.__bytes, expected, self.__url))
+        self.__tmp.close()
+        if not self.__hasher is None and self.__hasher.hexdigest() != self.__hash:
+            self.discard()
+            return False
+        os.chmod(self.__tmp.name, 0o666 & ~UMASK)
+        if self.__blobs is None:
+            replace(self.__tmp.name, self.__filename)
+        else:
+            digest = self.__digest.hexdigest()
+            self.__blobs.add(self.__tmp.name, digest, url=self.__key, etag=self.__headers.get('ETag'),
+                             last_modified=self.__headers.get('Last-Modified'))
+            self.__blobs.link(digest, self.__filename)
+        if self.__resumable and os.path.exists(self.sidecar):
+            os.remove(self.sidecar)
+        return True
+
+    def abort(self):
+        ''' transfer broke off, resumable targets keep what they got so far '''
+        self.__tmp.close()
+        if self.__resumable and not self.__validator is None and self.__bytes > 0:
+            self.__save_journal()
+            return
+        self.discard()
+
+    def discard(self):
+        ''' remove all traces of this and earlier attempts '''
+        if not self.__tmp is None:
+            self.__tmp.close()
+            if os.path.exists(self.__tmp.name):
+                os.remove(self.__tmp.name)
+        if self.__resumable:
+            for filename in (self.part, self.sidecar):
+                if os.path.exists(filename):
+                    os.remove(filename)
+
+    #######################
+    # implement "with"
+    #######################
+    def __enter__(self):
+        if self.__tmp is None:
+            self.open()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if not type is None:
+            self.abort()
@@ -2,14 +2,17 @@
 # -*- coding: utf-8 -*-
 
 import logging
-from tempfile import NamedTemporaryFile
-from concurrent.futures import as_completed
-import os.path
 import time
-import shutil
 import hashlib
 from datetime import timedelta
+from functools import partial
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
 from .futuressession import FuturesSessionFlex
+from .target import DownloadTarget
+from .retry import RetryScheduler
 
 
 LOGGER = logging.getLogger('download.FuturesSessionVerifiedDownload')
@@ -17,17 +20,40 @@ class FuturesSessionVerifiedDownload(FuturesSessionFlex):
     BLOCKSIZE = 65536
 
     def __init__(self, *args, **kwargs):
+        '''
+        retry: RetryPolicy for failed downloads, none are retried without
+        mirrors: MirrorPool to spread downloads across repo mirrors
+        '''
+        self.__retry = kwargs.pop('retry', None)
+        self.__mirrors = kwargs.pop('mirrors', None)
         super(FuturesSessionVerifiedDownload, self).__init__(*args, **kwargs)
-        self.__futures = []
-        self.__files = {}
-
-    def download(self, url, filename, timeout=600, hash_type=None, hash=None):
-        request = self.get(url, stream=True, timeout=timeout)
-        request.filename = filename
-        request.hash_type = hash_type
-        request.hash = hash
+        self.__scheduler = self.__new_scheduler()
+
+    @property
+    def mirrors(self):
+        return self.__mirrors
+
+    def __new_scheduler(self):
+        failover = None if self.__mirrors is None else self.__mirrors.failover
+        return RetryScheduler(self.__request, self.__retry, failover=failover)
+
+    def __request(self, job):
+        url = job['url'] if self.__mirrors is None else self.__mirrors.start(job)
+        target = DownloadTarget(job['filename'], job['hash_type'], job['hash'], url=url, resumable=job['resume'],
+                                blobs=job['blobs'], key=job['url'])
+        hook = partial(FuturesSessionVerifiedDownload.store_response, target=target, limiter=self.limiter)
+        request = self.get(url, stream=True, timeout=job['timeout'], headers=target.request_headers(),
+                           hooks={'response': [hook]})
         request.request_url = url
-        self.__futures.append(request)
+        return request
+
+    def download(self, url, filename, timeout=600, hash_type=None, hash=None, resume=False, blobs=None):
+        '''
+        with resume=True broken transfers are kept and continued by the next download of url,
+        with a BlobStore the file is stored as blob and filename becomes a link to it
+        '''
+        self.__scheduler.add({'url': url, 'filename': filename, 'timeout': timeout, 'hash_type': hash_type,
+                              'hash': hash, 'resume': resume, 'blobs': blobs, 'start': time.time()})
 
     @staticmethod
     def verify(filename, hash_type, hash):
@@ -41,52 +67,90 @@ class FuturesSessionVerifiedDownload(FuturesSessionFlex):
         file_hash = tmphash.hexdigest()
         return file_hash == hash
 
+    @staticmethod
+    def store(response, target, limiter=None):
+        '''
+        stream response body to DownloadTarget, hashing chunks as they arrive.
+        the file is only replaced if the hash matches. returns (success, bytes transferred)
+        '''
+        host = urlparse(response.url).netloc
+        with target.open(response.status_code, response.headers):
+            for chunk in response.iter_content(chunk_size=FuturesSessionVerifiedDownload.BLOCKSIZE):
+                if chunk:
+                    if not limiter is None:
+                        limiter.throttle(host, len(chunk))
+                    target.write(chunk)
+            return (target.finish(), target.bytes - target.resumed)
+
+    @staticmethod
+    def restart(response, **kwargs):
+        ''' send the request of a failed resume again without Range/If-Range, kwargs as given to the response hook '''
+        start = time.time()
+        request = response.request.copy()
+        for header in ('Range', 'If-Range'):
+            request.headers.pop(header, None)
+        restarted = response.connection.send(request, **kwargs)
+        restarted.elapsed = response.elapsed + timedelta(seconds=time.time() - start)
+        return restarted
+
+    @staticmethod
+    def store_response(response, target=None, limiter=None, **kwargs):
+        ''' response hook, runs store() inside the worker thread that made the request '''
+        response.stored = None
+        if response.status_code == 416 and 'Range' in response.request.headers:
+            # part file does not fit the remote file anymore, start over right away
+            target.discard()
+            response.close()
+            LOGGER.info("restarting %s, range not satisfiable", response.url)
+            restarted = FuturesSessionVerifiedDownload.restart(response, **kwargs)
+            return FuturesSessionVerifiedDownload.store_response(restarted, target=target, limiter=limiter, **kwargs)
+        if response.status_code == 304:
+            response.latency = response.elapsed.total_seconds()
+            response.stored = (target.unmodified(), 0)
+            response.close()
+        elif response.ok and not response.is_redirect:
+            start = time.time()
+            response.latency = response.elapsed.total_seconds()
+            response.stored = FuturesSessionVerifiedDownload.store(response, target, limiter)
+            response.elapsed += timedelta(seconds=time.time() - start)
+        elif not response.ok:
+            response.close() # hand the connection back to the pool
+        return response
+
     def completed(self):
-        for future in as_completed(self.__futures):
-            url = future.request_url
-            filename = future.filename
-            foldername = os.path.dirname(filename)
-            hash_type = future.hash_type
-            hash = future.hash
+        ''' collects results of finished downloads, bodies are stored by the worker threads '''
+        for future in self.__scheduler.completed():
+            url = future.job['url']
+            filename = future.job['filename']
+            bytes = 0
+            hbytes = FuturesSessionVerifiedDownload.h_size(bytes)
             try:
                 response = future.result()
                 response.raise_for_status()
-                start = time.time()
-                with NamedTemporaryFile(mode='wb') as tmp:
-                    for chunk in response.iter_content(chunk_size=FuturesSessionVerifiedDownload.BLOCKSIZE):
-                        if chunk:
-                            tmp.write(chunk)
-                    tmp.flush()
-                    bytes = os.stat(tmp.name).st_size
-                    hbytes = FuturesSessionVerifiedDownload.h_size(bytes)
-                    if not hash_type is None:
-                        elapsed = time.time() - start
-                        LOGGER.info("downloaded %s [%s] (%s) ✔", response.request.url, timedelta(seconds=elapsed), hbytes)
-                        tmp.seek(0)
-                        if FuturesSessionVerifiedDownload.verify(tmp.name, hash_type, hash):
-                            if not os.path.exists(foldername):
-                                os.makedirs(foldername)
-                            shutil.copy(tmp.name, filename)
-                            elapsed = time.time() - start
-                            LOGGER.info("hash verified %s [%s] (%s) ✔", response.request.url, timedelta(seconds=elapsed), hbytes)
-                            yield (True, filename, bytes, hbytes, timedelta(seconds=elapsed))
-                        else:
-                            elapsed = time.time() - start
-                            LOGGER.warning("hash verification failed %s [%s] (%s) ❌", response.request.url, timedelta(seconds=elapsed), hbytes)
-                            yield (False, filename, bytes, hbytes, timedelta(seconds=elapsed))
-                    else:
-                        if not os.path.exists(foldername):
-                            os.makedirs(foldername)
-                        shutil.copy(tmp.name, filename)
-                        elapsed = time.time() - start
-                        LOGGER.info("downloaded %s [%s] (%s) ✔", response.request.url, timedelta(seconds=elapsed), hbytes)
-                        yield (True, filename, bytes, hbytes, timedelta(seconds=elapsed))
+                (success, bytes) = response.stored
+                hbytes = FuturesSessionVerifiedDownload.h_size(bytes)
+                elapsed = response.elapsed
+                if not self.__mirrors is None:
+                    self.__mirrors.finish(future.job, success, latency=response.latency, bytes=bytes,
+                                          elapsed=elapsed.total_seconds())
+                    if not success and self.__mirrors.failover(future.job, 'hash verification failed'):
+                        self.__scheduler.add(future.job)
+                        continue
+                if response.status_code == 304:
+                    LOGGER.debug("not modified %s [%s]", response.request.url, elapsed)
+                elif not success:
+                    LOGGER.warning("hash verification failed %s [%s] (%s) ❌", response.request.url, elapsed, hbytes)
+                elif not future.job['hash_type'] is None:
+                    LOGGER.info("downloaded and hash verified %s [%s] (%s) ✔", response.request.url, elapsed, hbytes)
+                else:
+                    LOGGER.info("downloaded %s [%s] (%s) ✔", response.request.url, elapsed, hbytes)
+                yield (success, filename, bytes, hbytes, elapsed)
             except Exception as ex:
                 if logging.getLogger().isEnabledFor(logging.DEBUG):
                     LOGGER.exception("Error downloading %s to file %s", url, filename)
                 else:
                     LOGGER.warning("Error downloading %s to file %s: %s", url, filename, str(ex))
-                elapsed = time.time() - start
+                elapsed = time.time() - future.job['start']
                 yield (False, filename, bytes, hbytes, timedelta(seconds=elapsed))
 
 
@@ -98,6 +162,6 @@ class FuturesSessionVerifiedDownload(FuturesSessionFlex):
         return self
 
     def __exit__(self, type, value, traceback):
+        self.__scheduler.cancel()
         super(FuturesSessionVerifiedDownload, self).__exit__(type, value, traceback)
-        self.__futures = []
-        self.__files = {}
+        self.__scheduler = self.__new_scheduler()
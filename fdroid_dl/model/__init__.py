@@ -6,5 +6,15 @@ from .repoconfig import RepoConfig
 from .appmetadata import AppMetadata
 from .metadata import Metadata
 from .index import Index
+from .indexreader import IndexReader
+from .xmlindexreader import XmlIndexReader
+from .indexcache import IndexCache, IndexCacheWriter
+from .selectorset import SelectorSet
+from .changeset import Changeset
+from .hashcache import HashCache
+from .blobstore import BlobStore
+from .packagerecord import PackageRecord
 
-__all__ = ['Config', 'RepoConfig', 'AppMetadata', 'Metadata', 'Index']
+__all__ = ['Config', 'RepoConfig', 'AppMetadata', 'Metadata', 'Index', 'IndexReader', 'XmlIndexReader', 'IndexCache',
+           'IndexCacheWriter', 'SelectorSet', 'Changeset',
+           'HashCache', 'BlobStore', 'PackageRecord']
@@ -11,28 +11,64 @@ import json
 from ..json import GenericJSONEncoder
 
 
+def overlay(values):
+    '''
+    value of the first layer, dicts are merged with the dicts of the layers
+    below. only nodes present in more than one layer are built, all other
+    values are shared with their layer.
+    '''
+    if not isinstance(values[0], dict):
+        return values[0]
+    dicts = [value for value in values if isinstance(value, dict)]
+    if len(dicts) == 1:
+        return dicts[0]
+    merged = {}
+    for layer in reversed(dicts):
+        for key in layer:
+            if not key in merged:
+                merged[key] = overlay([value[key] for value in dicts if key in value])
+    return merged
+
+
 LOGGER = logging.getLogger('model.AppMetadata')
 class AppMetadata(MutableMapping):
-    def __init__(self, appid, cfg=dict(), json=dict(), default_locale='en-US'):
+    """
+    Metadata of one app, config overrides layered over index data.
+
+    Layers are looked up in order, the config first, then the indices the
+    app was merged from. Nothing is copied up front, a key is resolved on
+    first access and cached, nested dicts only get merged where several
+    layers have them. Values are shared with the index data, changes have
+    to go through __setitem__ or update() and end up in the config.
+    """
+
+    def __init__(self, appid, cfg=None, json=None, default_locale='en-US'):
         if appid is None:
             raise KeyError("no appid defined")
         self.__id = appid
-        self.__cfg = cfg
+        self.__cfg = {} if cfg is None else cfg
+        self.__layers = [self.__cfg]
         if not json is None:
-            self.__store = self.__merge(copy.deepcopy(cfg), copy.deepcopy(json))
-        else:
-            self.__store = copy.deepcopy(cfg)
+            self.__layers.append(json)
+        self.__cache = {}
+        self.__hidden = set()
         self.__default_locale = default_locale
 
-    def __merge(self, source, destination):
+    @staticmethod
+    def __merge(source, destination):
         for key, value in source.items():
             if isinstance(value, dict):
                 node = destination.setdefault(key, {})
-                self.__merge(value, node)
+                AppMetadata.__merge(value, node)
             else:
                 destination[key] = value
         return destination
 
+    @property
+    def layers(self):
+        ''' config and index data of this app, highest priority first '''
+        return list(self.__layers)
+
     # pylint: disable=C0103
     @property
     def id(self):
@@ -43,22 +79,27 @@ class AppMetadata(MutableMapping):
         return str(self.__id)
 
     def merge(self, appmetadata):
-        ''' used for adding addition data from e.g. index '''
+        ''' used for adding addition data from e.g. index, existing values win '''
         if not isinstance(appmetadata, AppMetadata) and not isinstance(appmetadata, dict):
             raise NotImplementedError("I can only merge two instances of AppMetadata at the moment")
-        self.__store = self.__merge(self.__store, copy.deepcopy(appmetadata))
+        if isinstance(appmetadata, AppMetadata):
+            self.__layers.extend(appmetadata.layers)
+        else:
+            self.__layers.append(appmetadata)
+        self.__cache = {}
         return self
 
     def update(self, appmetadata):
         ''' apply manual changes and save tose in config '''
         if not isinstance(appmetadata, AppMetadata) and not isinstance(appmetadata, dict):
             raise NotImplementedError("I can only merge two instances of AppMetadata at the moment")
-        self.__store = self.__merge(copy.deepcopy(appmetadata), self.__store)
-        self.__cfg = self.__merge(copy.deepcopy(appmetadata), self.__cfg)
+        AppMetadata.__merge(copy.deepcopy(dict(appmetadata)), self.__cfg)
+        self.__hidden.difference_update(appmetadata.keys())
+        self.__cache = {}
         return self
 
     def localized(self, locale=None):
-        return self.__store.get('localized', {}).get(locale, {})
+        return self.get('localized', {}).get(locale, {})
 
     def full_description(self, locale=None):
         return self.localized(locale).get('description', None)
@@ -103,7 +144,7 @@ class AppMetadata(MutableMapping):
         return []
 
     def __repr__(self):
-        return "<AppMetadata: %s>"%str(json.dumps(self.__store, indent=4, cls=GenericJSONEncoder))
+        return "<AppMetadata: %s>"%str(json.dumps(dict(self), indent=4, cls=GenericJSONEncoder))
 
     @property
     def __json__(self):
@@ -120,15 +161,31 @@ class AppMetadata(MutableMapping):
     # implement "dict"
     #######################
     def __getitem__(self, key):
-        return self.__store[key]
+        if not key in self.__cache:
+            values = [layer[key] for layer in self.__layers if key in layer]
+            if len(values) == 0 or key in self.__hidden:
+                raise KeyError(key)
+            self.__cache[key] = overlay(values)
+        return self.__cache[key]
     def __setitem__(self, key, value):
         self.__cfg[key] = value
-        self.__store[key] = value
+        self.__hidden.discard(key)
+        self.__cache.pop(key, None)
     def __delitem__(self, key):
+        if not key in self:
+            raise KeyError(key)
         if key in self.__cfg:
             del self.__cfg[key]
-        del self.__store[key]
+        self.__hidden.add(key) # index layers are not changed
+        self.__cache.pop(key, None)
+    def __contains__(self, key):
+        return not key in self.__hidden and any(key in layer for layer in self.__layers)
     def __iter__(self):
-        return iter(self.__store)
+        seen = set(self.__hidden)
+        for layer in reversed(self.__layers):
+            for key in layer:
+                if not key in seen:
+                    seen.add(key)
+                    yield key
     def __len__(self):
-        return len(self.__store)
+        return len(list(iter(self)))
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import json
+import os
+import os.path
+import shutil
+import uuid
+try:
+    from os import replace
+except ImportError:
+    from os import rename as replace
+from threading import Lock
+from tempfile import NamedTemporaryFile
+
+
+LOGGER = logging.getLogger('model.BlobStore')
+class BlobStore(object):
+    """
+    Content addressed store of downloaded assets.
+
+    Every blob is kept once as ``<folder>/<2 hex>/<sha256>`` and the files
+    below the metadata dir are hardlinks to it, byte identical images of
+    several locales, apps or repos use their disk space only once. Where a
+    hardlink is not possible (other file system, no support) the blob is
+    copied.
+
+    ``<folder>.json`` is the manifest of all downloaded urls, it maps each
+    url to ``[digest, size, etag, last_modified]``. The next download of a
+    url sends these validators along, a 304 answer just links the blob.
+    """
+    HASH_TYPE = 'sha256'
+
+    def __init__(self, folder):
+        self.__folder = folder
+        self.__filename = folder.rstrip(os.sep) + '.json'
+        self.__urls = {}
+        self.__lock = Lock()
+        self.__dirty = False
+        self.__stored = 0
+        self.__deduped = 0
+        self.__revalidated = 0
+
+    @property
+    def folder(self):
+        return str(self.__folder)
+
+    @property
+    def filename(self):
+        return str(self.__filename)
+
+    @property
+    def stored(self):
+        ''' new blobs added so far '''
+        return int(self.__stored)
+
+    @property
+    def deduped(self):
+        ''' downloads that matched a blob already present '''
+        return int(self.__deduped)
+
+    @property
+    def revalidated(self):
+        ''' downloads answered with 304 not modified '''
+        return int(self.__revalidated)
+
+    def path(self, digest):
+        return os.path.join(self.__folder, digest[:2], digest)
+
+    def entry(self, url):
+        ''' [digest, size, etag, last_modified] of the last download of url, None if unknown or its blob is broken '''
+        entry = self.__urls.get(url)
+        if entry is None:
+            return None
+        try:
+            if os.path.getsize(self.path(entry[0])) != entry[1]:
+                return None
+        except OSError:
+            return None
+        return entry
+
+    def digest(self, url):
+        ''' digest of the last download of url, None if unknown or its blob is gone '''
+        entry = self.entry(url)
+        return None if entry is None else entry[0]
+
+    def conditional_headers(self, url):
+        ''' If-None-Match/If-Modified-Since of the last download of url, empty if it has to be fetched anyway '''
+        entry = self.entry(url)
+        headers = {}
+        if not entry is None:
+            if not entry[2] is None:
+                headers['If-None-Match'] = entry[2]
+            if not entry[3] is None:
+                headers['If-Modified-Since'] = entry[3]
+        return headers
+
+    def add(self, tmpname, digest, url=None, etag=None, last_modified=None):
+        '''
+        move downloaded tmpname into the store, dropped if the blob exists already.
+        url is recorded in the manifest with the validators of its response. returns the blob path
+        '''
+        path = self.path(digest)
+        with self.__lock:
+            if os.path.isfile(path):
+                os.remove(tmpname)
+                self.__deduped += 1
+            else:
+                if not os.path.exists(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                try:
+                    replace(tmpname, path)
+                except OSError: # cache dir on another file system
+                    shutil.move(tmpname, path)
+                self.__stored += 1
+            if not url is None:
+                entry = [digest, os.path.getsize(path), etag, last_modified]
+                if self.__urls.get(url) != entry:
+                    self.__urls[url] = entry
+                    self.__dirty = True
+        return path
+
+    def link(self, digest, filename):
+        ''' make filename a hardlink (or copy) of the blob of digest '''
+        blob = self.path(digest)
+        if os.path.exists(filename) and os.path.samefile(blob, filename):
+            return
+        (foldername, basename) = os.path.split(filename)
+        if len(foldername) > 0 and not os.path.exists(foldername):
+            os.makedirs(foldername)
+        tmp = os.path.join(foldername, '.%s.%s.link' % (basename, uuid.uuid4().hex[:8]))
+        try:
+            os.link(blob, tmp)
+        except (OSError, AttributeError):
+            shutil.copyfile(blob, tmp)
+        replace(tmp, filename)
+
+    def unmodified(self, url, filename):
+        ''' url answered 304, filename is linked to its blob again in case it was changed or removed '''
+        digest = self.digest(url)
+        if digest is None:
+            return False
+        self.link(digest, filename)
+        with self.__lock:
+            self.__revalidated += 1
+        return True
+
+    def load(self):
+        if os.path.isfile(self.__filename):
+            try:
+                with open(self.__filename, 'r') as file:
+                    self.__urls = dict((url, entry) for url, entry in json.load(file).items()
+                                       if isinstance(entry, list) and len(entry) == 4)
+            except ValueError:
+                LOGGER.warning("ignoring corrupt blob manifest %s", self.__filename)
+                self.__urls = {}
+        self.__dirty = False
+        return self
+
+    def save(self):
+        if not self.__dirty:
+            return self
+        with self.__lock:
+            folder = os.path.dirname(os.path.abspath(self.__filename))
+            with NamedTemporaryFile(mode='w', dir=folder, prefix='.', suffix='.tmp', delete=False) as tmp:
+                json.dump(self.__urls, tmp, separators=(',', ':'))
+            replace(tmp.name, self.__filename)
+            self.__dirty = False
+        return self
+
+    def __repr__(self): return "<BlobStore: %s (%s urls)>"%(self.__folder, len(self.__urls))
+
+    #######################
+    # implement "with"
+    #######################
+    def __enter__(self):
+        return self.load()
+
+    def __exit__(self, type, value, traceback):
+        self.save()
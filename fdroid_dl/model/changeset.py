@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+
+
+LOGGER = logging.getLogger('model.Changeset')
+class Changeset(object):
+    """
+    Difference between two versions of a repo index.
+
+    Built while a new index is streamed into the cache, by comparing every
+    app's lastUpdated and the versionCodes of its packages against the
+    previous cache file. An empty Changeset means nothing changed.
+    Removed apps are no app change, they are listed in removed only, their
+    packages show up in packages_removed like any other package list that
+    dropped to zero.
+    Changesets not applied yet are kept per repo, see RepoConfig.pending.
+    """
+
+    def __init__(self, timestamp=None, previous_timestamp=None):
+        self.timestamp = timestamp
+        self.previous_timestamp = previous_timestamp
+        self.added = set()
+        self.changed = set()
+        self.removed = set()
+        self.packages_added = {}
+        self.packages_removed = {}
+
+    @staticmethod
+    def version_codes(packages):
+        return set(pkg.get('versionCode') for pkg in packages or [])
+
+    def diff_app(self, app, previous):
+        appid = app.get('packageName')
+        if previous is None:
+            self.added.add(appid)
+        elif app.get('lastUpdated') != previous.get('lastUpdated'):
+            self.changed.add(appid)
+
+    def diff_packages(self, appid, version_codes, previous_packages):
+        previous = Changeset.version_codes(previous_packages)
+        added = version_codes - previous
+        removed = previous - version_codes
+        if len(added) > 0:
+            self.packages_added[appid] = sorted(added)
+        if len(removed) > 0:
+            self.packages_removed[appid] = sorted(removed)
+
+    def diff_removed(self, appids, previous_appids):
+        for appid in previous_appids:
+            if not appid in appids:
+                self.removed.add(appid)
+
+    def update(self, changes):
+        ''' add the changes of a later refresh '''
+        self.timestamp = changes.timestamp
+        self.added |= changes.added
+        self.changed |= changes.changed
+        self.removed |= changes.removed
+        for mine, theirs in ((self.packages_added, changes.packages_added),
+                             (self.packages_removed, changes.packages_removed)):
+            for appid, codes in theirs.items():
+                mine[appid] = sorted(set(mine.get(appid, [])) | set(codes), key=str)
+        return self
+
+    def to_json(self):
+        return {'timestamp': self.timestamp, 'previous_timestamp': self.previous_timestamp,
+                'added': sorted(self.added), 'changed': sorted(self.changed), 'removed': sorted(self.removed),
+                'packages_added': self.packages_added, 'packages_removed': self.packages_removed}
+
+    @classmethod
+    def from_json(cls, data):
+        changes = cls(data.get('timestamp'), data.get('previous_timestamp'))
+        changes.added = set(data.get('added', []))
+        changes.changed = set(data.get('changed', []))
+        changes.removed = set(data.get('removed', []))
+        changes.packages_added = dict(data.get('packages_added', {}))
+        changes.packages_removed = dict(data.get('packages_removed', {}))
+        return changes
+
+    def app_changed(self, appid):
+        ''' metadata of appid needs to be updated '''
+        return appid in self.added or appid in self.changed
+
+    def app_removed(self, appid):
+        ''' appid is not in the index anymore '''
+        return appid in self.removed
+
+    def packages_changed(self, appid):
+        ''' packages of appid need to be updated '''
+        return appid in self.added or appid in self.packages_added or appid in self.packages_removed
+
+    def __contains__(self, appid):
+        return self.app_changed(appid) or self.app_removed(appid) or self.packages_changed(appid)
+
+    def __len__(self):
+        return len(self.added | self.changed | self.removed |
+                   set(self.packages_added.keys()) | set(self.packages_removed.keys()))
+
+    def __repr__(self):
+        return "<Changeset: apps added(%s) changed(%s) removed(%s) packages added(%s) removed(%s)>" % (
+            len(self.added), len(self.changed), len(self.removed),
+            sum(len(codes) for codes in self.packages_added.values()),
+            sum(len(codes) for codes in self.packages_removed.values()))
@@ -15,6 +15,8 @@ from tempfile import NamedTemporaryFile
 from .repoconfig import RepoConfig
 from .metadata import Metadata
 from .index import Index
+from .hashcache import HashCache
+from .blobstore import BlobStore
 from ..json import GenericJSONEncoder
 
 
@@ -38,7 +40,8 @@ class Config(MutableMapping):
     }
 
     def __init__(self, filename='fdroid-dl.json', repo_dir='./repo',
-                 metadata_dir='./metadata', cache_dir='.cache', apk_versions=1):
+                 metadata_dir='./metadata', cache_dir='.cache', apk_versions=1,
+                 src_download=True, metadata_download=True, default_locale='en-US'):
         """
         Parameters
         ----------
@@ -54,6 +57,13 @@ class Config(MutableMapping):
             f-droid repo
         apk_versions: int
             how many versions of apk files should be downloaded
+        src_download: bool
+            download source tarballs, repos may override this
+        metadata_download: bool
+            download metadata, repos may override this
+        default_locale: str
+            locale used for metadata without localization, repos may
+            override this
         """
         self.__filename = filename
         self.__repo = repo_dir
@@ -62,7 +72,12 @@ class Config(MutableMapping):
         self.__store = {}
         self.__indices = {}
         self.__metadata = None
+        self.__hashes = None
+        self.__blobs = None
         self.__apk_versions = apk_versions
+        self.__src_download = src_download
+        self.__metadata_download = metadata_download
+        self.__default_locale = default_locale
         self.__init_defaults()
         self.__prepare_fs()
 
@@ -90,6 +105,20 @@ class Config(MutableMapping):
     def metadata(self):
         return self.__metadata
 
+    @property
+    def hashes(self):
+        ''' HashCache of verified files, loaded on first access '''
+        if self.__hashes is None:
+            self.__hashes = HashCache(os.path.join(self.__cache_dir, 'hashes.json')).load()
+        return self.__hashes
+
+    @property
+    def blobs(self):
+        ''' BlobStore of downloaded assets, loaded on first access '''
+        if self.__blobs is None:
+            self.__blobs = BlobStore(os.path.join(self.__cache_dir, 'blobs')).load()
+        return self.__blobs
+
     @property
     def size(self):
         return len(self.__store.keys())
@@ -98,6 +127,18 @@ class Config(MutableMapping):
     def apk_versions(self):
         return int(self.__apk_versions)
 
+    @property
+    def src_download(self):
+        return self.__src_download is True
+
+    @property
+    def metadata_download(self):
+        return self.__metadata_download is True
+
+    @property
+    def default_locale(self):
+        return str(self.__default_locale)
+
     def __init_defaults(self):
         self.__store = copy.deepcopy(Config.DEFAULTS)
         for key in Config.DEFAULTS['f-droid'].keys():
@@ -147,6 +188,10 @@ class Config(MutableMapping):
                       indent=4, cls=GenericJSONEncoder)
             tmp.flush()
             shutil.copy(tmp.name, self.__filename)
+        if not self.__hashes is None:
+            self.__hashes.save()
+        if not self.__blobs is None:
+            self.__blobs.save()
         return self
 
     @property
@@ -154,7 +199,7 @@ class Config(MutableMapping):
         for key in self.__store['f-droid'].keys():
             cfg = self.__store['f-droid'][key]
             if not isinstance(cfg, RepoConfig):
-                self.__store['f-droid'][key] = RepoConfig(key, cfg, self)
+                cfg = self.__store['f-droid'][key] = RepoConfig(key, cfg, self)
             yield cfg
 
     @property
@@ -163,9 +208,9 @@ class Config(MutableMapping):
             if repo.url in self.__indices:
                 yield self.__indices[repo.url]
             elif os.path.exists(repo.filename):
-                with Index.from_json(repo.filename, key=repo.url) as idx:
-                    self.__indices[repo.url] = idx
-                    yield idx
+                idx = Index.from_cache(repo.filename, key=repo.url)
+                self.__indices[repo.url] = idx
+                yield idx
 
     def repo(self, url):
         """
@@ -222,8 +267,7 @@ class Config(MutableMapping):
         if repo.url in self.__indices:
             return self.__indices[repo.url]
         if os.path.exists(repo.filename):
-            with Index.from_json(repo.filename, key=repo.url) as idx:
-                self.__indices[repo.url] = idx
+            self.__indices[repo.url] = Index.from_cache(repo.filename, key=repo.url)
             return self.__indices[repo.url]
         raise KeyError(
             "index with url: %s not found on filesystem file: %s" %
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+import json
+import os
+import os.path
+try:
+    from os import replace
+except ImportError:
+    from os import rename as replace
+from threading import Lock
+from tempfile import NamedTemporaryFile
+
+
+LOGGER = logging.getLogger('model.HashCache')
+class HashCache(MutableMapping):
+    """
+    Persistent cache of already verified file hashes.
+
+    Maps a file path to ``[size, mtime_ns, inode, hash_type, hash]`` as
+    recorded right after the file was verified. As long as size, mtime and
+    inode of the file are unchanged the recorded hash is trusted and the
+    file does not need to be read again.
+    """
+
+    def __init__(self, filename):
+        self.__filename = filename
+        self.__store = {}
+        self.__lock = Lock()
+        self.__dirty = False
+
+    @property
+    def filename(self):
+        return str(self.__filename)
+
+    @staticmethod
+    def key(filename):
+        return os.path.abspath(filename)
+
+    @staticmethod
+    def fingerprint(filename):
+        ''' (size, mtime_ns, inode) of filename, None if it does not exist '''
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        mtime_ns = getattr(stat, 'st_mtime_ns', None)
+        if mtime_ns is None:
+            mtime_ns = int(stat.st_mtime * 1000000000)
+        return (stat.st_size, mtime_ns, stat.st_ino)
+
+    def verified(self, filename, hash_type, hash):
+        ''' True if filename was verified against hash and did not change since '''
+        entry = self.__store.get(HashCache.key(filename))
+        if entry is None or entry[3] != hash_type or entry[4] != hash:
+            return False
+        return tuple(entry[0:3]) == HashCache.fingerprint(filename)
+
+    def add(self, filename, hash_type, hash):
+        ''' record hash of filename, call only after it was verified '''
+        fingerprint = HashCache.fingerprint(filename)
+        if not fingerprint is None:
+            self[HashCache.key(filename)] = list(fingerprint) + [hash_type, hash]
+
+    def discard(self, filename):
+        key = HashCache.key(filename)
+        if key in self.__store:
+            del self[key]
+
+    def load(self):
+        if os.path.isfile(self.__filename):
+            try:
+                with open(self.__filename, 'r') as file:
+                    self.__store = json.load(file)
+            except ValueError:
+                LOGGER.warning("ignoring corrupt hash cache %s", self.__filename)
+                self.__store = {}
+        self.__dirty = False
+        return self
+
+    def save(self):
+        if not self.__dirty:
+            return self
+        with self.__lock:
+            folder = os.path.dirname(os.path.abspath(self.__filename))
+            with NamedTemporaryFile(mode='w', dir=folder, prefix='.', suffix='.tmp', delete=False) as tmp:
+                json.dump(self.__store, tmp, separators=(',', ':'))
+            replace(tmp.name, self.__filename)
+            self.__dirty = False
+        return self
+
+    def __repr__(self): return "<HashCache: %s (%s files)>"%(self.__filename, len(self.__store))
+
+    #######################
+    # implement "dict"
+    #######################
+    def __getitem__(self, key):
+        return self.__store[key]
+    def __setitem__(self, key, value):
+        with self.__lock:
+            self.__store[key] = value
+            self.__dirty = True
+    def __delitem__(self, key):
+        with self.__lock:
+            del self.__store[key]
+            self.__dirty = True
+    def __iter__(self):
+        return iter(self.__store)
+    def __len__(self):
+        return len(self.__store)
+
+    #######################
+    # implement "with"
+    #######################
+    def __enter__(self):
+        return self.load()
+
+    def __exit__(self, type, value, traceback):
+        self.save()
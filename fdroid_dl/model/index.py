@@ -5,18 +5,19 @@ try:
     from collections.abc import MutableMapping
 except ImportError:
     from collections import MutableMapping
-import re
 import json
-import xml.etree.ElementTree as ET
-from time import mktime, strptime
 import logging
 try:
     from urllib.parse import urljoin
 except ImportError:
     from urlparse import urljoin
-from tempfile import NamedTemporaryFile
-import shutil
-from ..json import GenericJSONEncoder
+import os
+import os.path
+from .indexreader import IndexReader
+from .indexcache import IndexCacheWriter, IndexCache
+from .selectorset import SelectorSet
+from .changeset import Changeset
+from .xmlindexreader import XmlIndexReader, number
 
 
 LOGGER = logging.getLogger('model.Index')
@@ -26,19 +27,62 @@ class Index(MutableMapping):
     index-v1.json files.
     """
 
-    def __init__(self, key=None, filename=None, format='json', default_locale='en-US', store=dict()):
+    LOCALIZED_GRAPHICS = ['icon', 'featureGraphic', 'promoGraphic', 'tvBanner']
+    LOCALIZED_SCREENSHOTS = ['phoneScreenshots', 'sevenInchScreenshots', 'tenInchScreenshots',
+                             'tvScreenshots', 'wearScreenshots']
+
+    def __init__(self, key=None, filename=None, format='json', default_locale='en-US', store=None):
         self.__key = key
         self.__filename = filename
         self.__format = format
         self.__default_locale = default_locale
         self.__store = store
+        self.__header = {}
+        self.__cache = None
+        self.__appindex = None
+        self.__written = 0
+        self.__changes = None
+
+    def __backend(self):
+        ''' binary cache file backing this index, None if store is in memory '''
+        if self.__store is None and self.__cache is None:
+            if not self.__filename is None and IndexCache.is_cache(self.__filename):
+                self.__cache = IndexCache(self.__filename)
+                self.__header = self.__cache.header
+        if self.__store is None:
+            return self.__cache
+        return None
+
+    def __data(self):
+        ''' store is loaded from the cache file on first access '''
+        if self.__store is None:
+            cache = self.__backend()
+            if not cache is None:
+                store = dict(cache.header)
+                store['apps'] = list(cache.apps())
+                store['packages'] = dict(cache.all_packages())
+                self.__store = store
+            elif not self.__filename is None and os.path.exists(self.__filename):
+                # legacy json cache files
+                with open(self.__filename, 'r') as idxfl:
+                    self.__store = json.load(idxfl)
+            else:
+                self.__store = {}
+        return self.__store
+
+    @classmethod
+    def from_cache(cls, filename, **kwargs):
+        ''' index backed by a cache file, entries are read on demand '''
+        kwargs['format'] = 'json'
+        kwargs['filename'] = filename
+        return cls(**kwargs)
 
     @classmethod
     def from_json(cls, source, **kwargs):
         if not hasattr(source, "read"):
             source = open(source, "r")
         kwargs['format'] = 'json'
-        kwargs['filename'] = source.name
+        kwargs['filename'] = getattr(source, 'name', None)
         return cls(**kwargs).load(source)
 
     @classmethod
@@ -46,7 +90,7 @@ class Index(MutableMapping):
         if not hasattr(source, "read"):
             source = open(source, "r")
         kwargs['format'] = 'xml'
-        kwargs['filename'] = source.name
+        kwargs['filename'] = getattr(source, 'name', None)
         return cls(**kwargs).load(source)
 
     @property
@@ -69,278 +113,217 @@ class Index(MutableMapping):
     def default_locale(self):
         return str(self.__default_locale)
 
+    @property
+    def written(self):
+        ''' bytes written to the cache file by from_stream or save '''
+        return int(self.__written)
+
+    @property
+    def changes(self):
+        ''' Changeset against the cache file replaced by from_stream, None if there was none '''
+        return self.__changes
+
+    def appids(self):
+        ''' packageNames of all apps '''
+        cache = self.__backend()
+        if not cache is None:
+            return cache.appids()
+        return (app['packageName'] for app in self.__data().get('apps', []))
+
+    def apps(self):
+        ''' iterate all apps, cache backed indices parse one app at a time '''
+        cache = self.__backend()
+        if not cache is None:
+            return cache.apps()
+        return iter(self.__data().get('apps', []))
+
+    def __apps_by_id(self):
+        ''' packageName -> app hash index for in memory stores '''
+        if self.__appindex is None:
+            self.__appindex = dict((app['packageName'], app) for app in self.__data().get('apps', [])
+                                   if 'packageName' in app)
+        return self.__appindex
+
+    def has_app(self, appid):
+        cache = self.__backend()
+        if not cache is None:
+            return appid in cache
+        return appid in self.__apps_by_id()
+
+    def app(self, appid):
+        cache = self.__backend()
+        if not cache is None:
+            return cache.app(appid)
+        return self.__apps_by_id().get(appid)
+
+    def packages(self, appid):
+        cache = self.__backend()
+        if not cache is None:
+            return cache.packages(appid)
+        return self.__data().get('packages', {}).get(appid, [])
+
+    def select(self, selectors):
+        ''' appids matching any of given selectors, see SelectorSet '''
+        return SelectorSet.compile(selectors).select(self.appids, self.has_app)
+
     def find_appids(self, key):
         if key is None:
             raise KeyError("key must not be empty")
-        ret_val = set()
-        if key.startswith('regex:'):
-            regexc = re.compile(key[6:], re.I | re.S)
-            for app in self.__store['apps']:
-                match = regexc.match(app['packageName'])
-                if not match is None:
-                    ret_val.add(app['packageName'])
-        elif key in ['*', '.*', 'all']:
-            for app in self.__store['apps']:
-                ret_val.add(app['packageName'])
-        else:
-            for app in self.__store['apps']:
-                if app['packageName'] == key:
-                    ret_val.add(app['packageName'])
-        return list(ret_val)
-
-    def defaultnum(self, value):
-        if value.isnumeric():
-            return int(value)
-        return value
-
-    def custom_func(self, xpath):
-        if not xpath is None:
-            regexc = re.compile(r'(.*?):(.*)$', re.I | re.S)
-            match = regexc.match(xpath)
-            if not match is None:
-                return (match.group(1), match.group(2))
-            return (xpath, None)
-        return (None, None)
-
-    def run_custom_func(self, method, value):
-        if method is None or value is None:
-            return None
-        try:
-            return eval(method, {'mktime': mktime, 'strptime': strptime}, {'value': value})
-        except:
-            LOGGER.exception("error in eval(%s)", method)
-
-    def xmlattr(self, node, xml_node, key=None, xpath=None):
-        if xpath is None and key is None:
-            return None
-        if xpath is None and not key is None:
-            xpath = key
-        value = self.xmlattrval(xml_node, xpath)
-        if not value is None:
-            if not key is None:
-                node[key] = value
-            else:
-                node = value
-
-    def xmlattrval(self, xml_node, xpath):
-        if not xml_node is None:
-            regexc = re.compile(r'^.*?\[@([^\]]+)\]$')
-            match = regexc.match(xpath)
-            if not match is None:
-                attr_name = m.group(1)
-            else:
-                attr_name = xpath
-            (xpath, func) = self.custom_func(xpath)
-            if not xpath is None:
-                xml_node = xml_node.find(xpath)
-            if not xml_node is None:
-                value = xml_node.get(attr_name, None)
-                #print(xml_node,attr_name,value)
-                if not value is None:
-                    if not func is None:
-                        return self.run_custom_func(func, self.defaultnum(value.strip()))
-                    else:
-                        return self.defaultnum(value.strip())
-        return None
-
-    def xmltext(self, node, xml_node, key=None, xpath=None):
-        if xpath is None and key is None:
-            return None
-        if xpath is None and not key is None:
-            xpath = key
-        value = self.xmltextval(xml_node, xpath)
-        if not value is None:
-            if not key is None:
-                node[key] = value
-            else:
-                node = value
-
-    def xmltextval(self, xml_node, xpath=None):
-        (xpath, func) = self.custom_func(xpath)
-        if not xpath is None:
-            xml_node = xml_node.find(xpath)
-        if not xml_node is None:
-            value = xml_node.text
-            if not value is None:
-                if not func is None:
-                    return self.run_custom_func(func, self.defaultnum(value.strip()))
-                else:
-                    return self.defaultnum(value.strip())
-
-    def xmllist(self, root, xpath):
-        ret_val = []
-        regexc = re.compile(r'^.*?\[@([^\]]+)\]$')
-        match = regexc.match(xpath)
-        if not match is None:
-            attr_name = match.group(1)
-            matches = root.findall(xpath)
-            if not matches is None:
-                for match in matches:
-                    value = match.get(attr_name, None)
-                    if not value is None:
-                        ret_val.append(self.defaultnum(value.strip()))
-        else:
-            matches = root.findall(xpath)
-            if not matches is None:
-                for match in matches:
-                    value = self.xmltextval(match)
-                    if not value is None:
-                        ret_val.append(value)
-        return ret_val
+        return self.select([key])
 
     def convert(self, root):
+        ''' convert legacy index.xml element tree '''
+        self.__appindex = None
         self.__store = {}
         store = self.__store
         repo = root.find('repo')
         if not repo is None:
-            srepo = store['repo'] = {}
-            self.xmlattr(srepo, root, 'timestamp', './repo[@timestamp]')
-            self.xmlattr(srepo, root, 'version', './repo[@version]')
-            self.xmlattr(srepo, root, 'maxage', './repo[@maxage]')
-            self.xmlattr(srepo, root, 'name', './repo[@name]')
-            self.xmlattr(srepo, root, 'icon', './repo[@icon]')
-            self.xmlattr(srepo, root, 'url', './repo[@address]')
-            self.xmltext(srepo, root, 'description', './description')
-            srepo['mirrors'] = self.xmllist(repo, './mirror')
-        requ = store['requests'] = {}
-        requ['install'] = self.xmllist(root, './install[@packageName]')
-        requ['uninstall'] = self.xmllist(root, './uninstall[@packageName]')
+            store['repo'] = XmlIndexReader.convert_repo(repo)
+        store['requests'] = {
+            'install': [number(e.get('packageName').strip()) for e in root.findall('./install[@packageName]')],
+            'uninstall': [number(e.get('packageName').strip()) for e in root.findall('./uninstall[@packageName]')]
+        }
         apps = store['apps'] = []
         pkgs = store['packages'] = {}
-        applications = root.findall('application[@id]')
-        for xmlapp in applications:
-            app_val = {}
-            self.xmltext(app_val, xmlapp, 'authorEmail', './email')
-            self.xmltext(app_val, xmlapp, 'authorName', './author')
-            self.xmltext(app_val, xmlapp, 'authorWebSite', './web')
-            self.xmltext(app_val, xmlapp, 'bitcoin', './bitcoin')
-            self.xmltext(app_val, xmlapp, 'donate', './donate')
-            self.xmltext(app_val, xmlapp, 'flattr', './flattr')
-            self.xmltext(app_val, xmlapp, 'liberapay', './liberapay')
-            self.xmltext(app_val, xmlapp, 'litecoin', './litecoin')
-            cat = self.xmltextval(xmlapp, 'categories')
-            if not cat is None and len(cat) > 0:
-                app_val['categories'] = cat.split(',')
-            afaet = self.xmltextval(xmlapp, 'antiFeatures')
-            if not afaet is None and len(afaet) > 0:
-                app_val['antiFeatures'] = afaet.split(',')
-            self.xmltext(app_val, xmlapp, 'suggestedVersionName',
-                         './marketversion')
-            self.xmltext(app_val, xmlapp, 'suggestedVersionCode',
-                         './marketvercode')
-            self.xmltext(app_val, xmlapp, 'issueTracker', './tracker')
-            self.xmltext(app_val, xmlapp, 'changelog', './changelog')
-            self.xmltext(app_val, xmlapp, 'license', './license')
-            self.xmltext(app_val, xmlapp, 'name', './name')
-            self.xmltext(app_val, xmlapp, 'sourceCode', './source')
-            self.xmltext(app_val, xmlapp, 'webSite', './web')
-            self.xmltext(app_val, xmlapp, 'added',
-                         './added:int(mktime(strptime(value, "%Y-%m-%d")))')
-            self.xmltext(app_val, xmlapp, 'icon', './icon')
-            self.xmltext(app_val, xmlapp, 'packageName', './id')
-            self.xmltext(app_val, xmlapp, 'lastUpdated',
-                         './lastupdated:int(mktime(strptime(value, "%Y-%m-%d")))')
-            loc = app_val['localized'] = {}
-            dloc = loc[self.default_locale] = {}
-            self.xmltext(dloc, xmlapp, 'description', './desc')
-            self.xmltext(dloc, xmlapp, 'summary', './summary')
-
-            app_id = self.xmltextval(xmlapp, './id')
-            if not app_id is None:
-                pkg = pkgs[app_id] = []
-                packages = xmlapp.findall('./package')
-                for xmlpkg in packages:
-                    pkg_val = {}
-                    self.xmltext(
-                        pkg_val, xmlpkg, 'added', './added:int(mktime(strptime(value, "%Y-%m-%d")))')
-                    self.xmltext(pkg_val, xmlpkg, 'apkName', './apkname')
-                    self.xmltext(pkg_val, xmlpkg, 'hash', './hash')
-                    self.xmlattr(pkg_val, xmlpkg, 'hashType', './hash[@type]')
-                    self.xmltext(pkg_val, xmlpkg, 'minSdkVersion', './sdkver')
-                    self.xmltext(pkg_val, xmlpkg, 'targetSdkVersion',
-                                 './targetSdkVersion')
-                    pkg_val['packageName'] = app_id
-                    self.xmltext(pkg_val, xmlpkg, 'sig', './sig')
-                    self.xmltext(pkg_val, xmlpkg, 'versionName', './version')
-                    self.xmltext(pkg_val, xmlpkg, 'versionCode',
-                                 './versioncode')
-                    self.xmltext(pkg_val, xmlpkg, 'size', './size')
-                    perm = xmlpkg.find('permissions')
-                    if not perm is None:
-                        user_permission = pkg_val['uses-permission'] = []
-                        user_permission_split = perm.text.split(",")
-                        for user_permission_str in user_permission_split:
-                            user_permission.append(['android.permission.'+user_permission_str.strip(), None])
-                    if len(pkg_val) > 0:
-                        pkg.append(pkg_val)
-            if len(app_val) > 1:
-                apps.append(app_val)
+        for xmlapp in root.findall('application[@id]'):
+            (app, packages) = XmlIndexReader.convert_app(xmlapp, self.default_locale)
+            if 'packageName' in app:
+                pkgs[app['packageName']] = packages
+            if len(app) > 1:
+                apps.append(app)
+
+    def patch_package(self, pkg):
+        ''' fixup package paths -> url '''
+        if self.__key is None:
+            raise AttributeError('key not defined')
+        pkg['apkName'] = urljoin(self.__key, pkg['apkName'])
+        if not pkg.get('srcname') is None:
+            pkg['srcname'] = urljoin(
+                self.__key, pkg['srcname'])
+        return pkg
+
+    def patch_app(self, app):
+        ''' fixup metadata paths -> url '''
+        if self.__key is None:
+            raise AttributeError('key not defined')
+        if 'icon' in app:
+            app['icon'] = urljoin(self.__key, "icons/"+app['icon'])
+        locs = app.get('localized', {})
+        for k in locs.keys():
+            loc = locs[k]
+            prefix = app['packageName']+'/'+k+'/'
+            for attr in Index.LOCALIZED_GRAPHICS:
+                if attr in loc:
+                    loc[attr] = urljoin(self.__key, prefix+loc[attr])
+            for attr in Index.LOCALIZED_SCREENSHOTS:
+                if attr in loc:
+                    loc[attr] = [urljoin(
+                        self.__key, prefix+attr+'/'+value) for value in loc[attr]]
+        return app
 
     def monkeypatch(self):
         ''' fixup metadata paths -> url '''
-        if not '_monkeypatched' in self.__store:
+        store = self.__data()
+        if not '_monkeypatched' in store:
             if self.__key is None:
                 raise AttributeError('key not defined')
-            self.__store['_monkeypatched'] = True
-            if 'packages' in self.__store:
-                for key in self.__store['packages']:
-                    for pkg in self.__store['packages'][key]:
-                        pkg['apkName'] = urljoin(self.__key, pkg['apkName'])
-                        if not pkg.get('srcname') is None:
-                            pkg['srcname'] = urljoin(
-                                self.__key, pkg['srcname'])
-
-            if 'apps' in self.__store:
-                for app in self.__store['apps']:
-                    if 'icon' in app:
-                        app['icon'] = urljoin(self.__key, "icons/"+app['icon'])
-                    locs = app.get('localized', {})
-                    for k in locs.keys():
-                        loc = locs[k]
-                        if 'icon' in loc:
-                            loc['icon'] = urljoin(
-                                self.__key, app['packageName']+'/'+k+'/'+loc['icon'])
-                        if 'featureGraphic' in loc:
-                            loc['featureGraphic'] = urljoin(
-                                self.__key, app['packageName']+'/'+k+'/'+loc['featureGraphic'])
-                        if 'promoGraphic' in loc:
-                            loc['promoGraphic'] = urljoin(
-                                self.__key, app['packageName']+'/'+k+'/'+loc['promoGraphic'])
-                        if 'tvBanner' in loc:
-                            loc['tvBanner'] = urljoin(
-                                self.__key, app['packageName']+'/'+k+'/'+loc['tvBanner'])
-                        if 'phoneScreenshots' in loc:
-                            loc['phoneScreenshots'] = [urljoin(
-                                self.__key, app['packageName']+'/'+k+'/phoneScreenshots/'+value) for value in loc['phoneScreenshots']]
-                        if 'sevenInchScreenshots' in loc:
-                            loc['sevenInchScreenshots'] = [urljoin(
-                                self.__key, app['packageName']+'/'+k+'/sevenInchScreenshots/'+value) for value in loc['sevenInchScreenshots']]
-                        if 'tenInchScreenshots' in loc:
-                            loc['tenInchScreenshots'] = [urljoin(
-                                self.__key, app['packageName']+'/'+k+'/tenInchScreenshots/'+value) for value in loc['tenInchScreenshots']]
-                        if 'tvScreenshots' in loc:
-                            loc['tvScreenshots'] = [urljoin(
-                                self.__key, app['packageName']+'/'+k+'/tvScreenshots/'+value) for value in loc['tvScreenshots']]
-                        if 'wearScreenshots' in loc:
-                            loc['wearScreenshots'] = [urljoin(
-                                self.__key, app['packageName']+'/'+k+'/wearScreenshots/'+value) for value in loc['wearScreenshots']]
+            store['_monkeypatched'] = True
+            if 'packages' in store:
+                for key in store['packages']:
+                    for pkg in store['packages'][key]:
+                        self.patch_package(pkg)
+            if 'apps' in store:
+                for app in store['apps']:
+                    self.patch_app(app)
         return self
 
+    @classmethod
+    def from_stream(cls, source, filename, format='json', **kwargs):
+        '''
+        walk a json or xml index entry by entry, fixing up urls and writing
+        the cache file as it goes. the returned index loads the cache lazily.
+        if filename already holds a cache file, index.changes lists what
+        differs from it.
+        '''
+        kwargs['format'] = 'json'
+        kwargs['filename'] = filename
+        index = cls(**kwargs)
+        if format == 'xml':
+            reader = XmlIndexReader(source, default_locale=index.default_locale)
+        else:
+            reader = IndexReader(source)
+        header = {}
+        previous = None
+        if IndexCache.is_cache(filename):
+            try:
+                previous = IndexCache(filename)
+            except IOError as ex:
+                # rewritten below, nothing to compare against
+                LOGGER.warning("replacing damaged cache file: %s", str(ex))
+        changes = None
+        if not previous is None:
+            changes = Changeset(previous_timestamp=previous.header.get('repo', {}).get('timestamp'))
+        seen = set()
+        packaged = set()
+        versions = (None, set())
+        try:
+            with IndexCacheWriter(filename) as writer:
+                writer.value('_monkeypatched', True)
+                for event in reader:
+                    if event[0] == 'app':
+                        seen.add(event[1]['packageName'])
+                        if not changes is None:
+                            changes.diff_app(event[1], previous.app(event[1]['packageName']))
+                        writer.app(index.patch_app(event[1]))
+                    elif event[0] == 'package':
+                        if not changes is None and event[1] != versions[0]:
+                            if not versions[0] is None:
+                                changes.diff_packages(versions[0], versions[1], previous.packages(versions[0]))
+                            versions = (event[1], set())
+                        packaged.add(event[1])
+                        versions[1].add(event[2].get('versionCode'))
+                        writer.package(event[1], index.patch_package(event[2]))
+                    elif event[1] != '_monkeypatched':
+                        header[event[1]] = event[2]
+                        writer.value(event[1], event[2])
+                if not changes is None:
+                    if not versions[0] is None:
+                        changes.diff_packages(versions[0], versions[1], previous.packages(versions[0]))
+                    changes.diff_removed(seen, previous.appids())
+                    for appid in previous.packageids():
+                        if not appid in packaged: # package list dropped to zero
+                            changes.diff_packages(appid, set(), previous.packages(appid))
+                    changes.timestamp = header.get('repo', {}).get('timestamp')
+        finally:
+            if not previous is None:
+                previous.close()
+        index.__changes = changes
+        index.__header = header
+        index.__written = writer.written
+        return index
+
     def load(self, file, format=None):
         if not hasattr(file, 'read'):
             file = open(file, 'r')
         if not format is None:
             self.__format = format
+        self.__appindex = None
 
         if self.__format == 'json':
             with file as idxfl:
                 self.__store = json.load(idxfl)
         elif self.__format == 'xml':
             # we have no json verison we need som transformation to apply
-            tree = ET.parse(file)
-            file.close()
-            root = tree.getroot()
-            self.convert(root)
+            store = {'apps': [], 'packages': {}}
+            with XmlIndexReader(file, default_locale=self.default_locale) as reader:
+                for event in reader:
+                    if event[0] == 'app':
+                        store['apps'].append(event[1])
+                    elif event[0] == 'package':
+                        store['packages'].setdefault(event[1], []).append(event[2])
+                    else:
+                        store[event[1]] = event[2]
+            self.__store = store
             self.__format = 'json'
         else:
             # try loading json anyway
@@ -353,44 +336,59 @@ class Index(MutableMapping):
     def save(self, filename=None):
         if not filename is None:
             self.__filename = filename
-        with NamedTemporaryFile(mode='w') as tmp:
-            json.dump(self.__store, tmp, sort_keys=True,
-                      indent=4, cls=GenericJSONEncoder)
-            tmp.flush()
-            shutil.copy(tmp.name, self.__filename)
+        store = self.__data()
+        with IndexCacheWriter(self.__filename) as writer:
+            for key, value in store.items():
+                if key == 'apps':
+                    for app in value:
+                        writer.app(app)
+                elif key == 'packages':
+                    for appid, pkgs in value.items():
+                        for pkg in pkgs:
+                            writer.package(appid, pkg)
+                else:
+                    writer.value(key, value)
+        self.__written = writer.written
         return self
 
     def __repr__(self):
-        return "<Index: %s>" % str(json.dumps(self.__store, indent=4))
+        return "<Index: %s>" % str(json.dumps(self.__data(), indent=4))
 
     @property
     def __json__(self):
         ''' make Index json serializable '''
-        return self.__store
+        return self.__data()
     #######################
     # implement "dict"
     #######################
 
     def __getitem__(self, key):
-        return self.__store[key]
+        if not key in ['apps', 'packages'] and not self.__backend() is None:
+            return self.__header[key]
+        if self.__store is None and key in self.__header:
+            return self.__header[key]
+        return self.__data()[key]
 
     def __setitem__(self, key, value):
-        self.__store[key] = value
+        self.__appindex = None
+        self.__data()[key] = value
 
     def __delitem__(self, key):
-        del self.__store[key]
+        self.__appindex = None
+        del self.__data()[key]
 
     def __iter__(self):
-        return iter(self.__store)
+        return iter(self.__data())
 
     def __len__(self):
-        return len(self.__store)
+        return len(self.__data())
     #######################
     # implement "with"
     #######################
 
     def __enter__(self):
-        self.load(self.__filename)
+        if self.__backend() is None:
+            self.load(self.__filename)
         return self
 
     def __exit__(self, type, value, traceback):
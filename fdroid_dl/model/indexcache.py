@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Binary cache format for parsed index files.
+
+All integers are little endian. The file starts with ``MAGIC`` followed by
+length prefixed records (``<I`` length + compact utf-8 json). Each app and
+each app's package list is a record of its own, so a single app can be read
+without touching the rest of the file. The file ends with:
+
+* a names blob holding all packageNames
+* an offset table sorted by packageName, one ``ENTRY`` per app
+* a ``FOOTER`` pointing to the header record and the offset table
+"""
+
+import logging
+import json
+import mmap
+import os
+import os.path
+import struct
+try:
+    from os import replace
+except ImportError:
+    from os import rename as replace
+from tempfile import NamedTemporaryFile
+from ..json import GenericJSONEncoder
+
+
+MAGIC = b'FDLC\x01\x00\x00\x00'
+RECORD = struct.Struct('<I')
+# name_off, name_len, app_off, app_len, pkgs_off, pkgs_len
+ENTRY = struct.Struct('<QIQIQI')
+# header_off, header_len, table_off, count, magic
+FOOTER = struct.Struct('<QIQI4s')
+
+
+LOGGER = logging.getLogger('model.IndexCacheWriter')
+class IndexCacheWriter(object):
+    """
+    Incremental writer for the parsed index cache files.
+
+    Entries are written as they are passed in, so a whole index can be
+    written without ever holding it in memory. Only the offset table and the
+    small top level nodes are kept until the file is closed. The file is
+    written next to its destination and swapped in once complete.
+    """
+
+    def __init__(self, filename):
+        self.__filename = filename
+        self.__tmp = None
+        self.__header = {}
+        self.__entries = {}
+        self.__appid = None
+        self.__packages = []
+        self.__written = 0
+
+    @property
+    def filename(self):
+        return str(self.__filename)
+
+    @property
+    def written(self):
+        ''' bytes written to the cache file '''
+        return int(self.__written)
+
+    def __write(self, data):
+        self.__tmp.write(data)
+        self.__written += len(data)
+
+    def __record(self, value):
+        ''' write length prefixed json record, returns (offset, length) of its payload '''
+        data = json.dumps(value, separators=(',', ':'), cls=GenericJSONEncoder).encode('utf-8')
+        self.__write(RECORD.pack(len(data)))
+        offset = self.__written
+        self.__write(data)
+        return (offset, len(data))
+
+    def __entry(self, appid):
+        if not appid in self.__entries:
+            self.__entries[appid] = [0, 0, 0, 0]
+        return self.__entries[appid]
+
+    def __flush_packages(self):
+        if not self.__appid is None:
+            self.__entry(self.__appid)[2:4] = self.__record(self.__packages)
+        self.__appid = None
+        self.__packages = []
+
+    def value(self, key, value):
+        self.__header[key] = value
+
+    def app(self, app):
+        self.__entry(app['packageName'])[0:2] = self.__record(app)
+
+    def package(self, appid, pkg):
+        if appid != self.__appid:
+            self.__flush_packages()
+            self.__appid = appid
+        self.__packages.append(pkg)
+
+    def open(self):
+        folder = os.path.dirname(os.path.abspath(self.__filename))
+        self.__tmp = NamedTemporaryFile(mode='wb', dir=folder, prefix='.', suffix='.tmp', delete=False)
+        self.__written = 0
+        self.__write(MAGIC)
+        return self
+
+    def close(self):
+        self.__flush_packages()
+        (header_off, header_len) = self.__record(self.__header)
+        names = sorted((appid.encode('utf-8'), entry) for appid, entry in self.__entries.items())
+        names_off = self.__written
+        self.__write(b''.join(name for name, entry in names))
+        table_off = self.__written
+        name_off = names_off
+        for name, entry in names:
+            self.__write(ENTRY.pack(name_off, len(name), *entry))
+            name_off += len(name)
+        self.__write(FOOTER.pack(header_off, header_len, table_off, len(names), MAGIC[:4]))
+        self.__tmp.close()
+        replace(self.__tmp.name, self.__filename)
+
+    def abort(self):
+        self.__tmp.close()
+        if os.path.exists(self.__tmp.name):
+            os.remove(self.__tmp.name)
+
+    #######################
+    # implement "with"
+    #######################
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, type, value, traceback):
+        if type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class IndexCache(object):
+    """
+    Memory mapped reader for cache files written by IndexCacheWriter.
+
+    Looking up an app or its packages is a hash lookup on the offset table
+    followed by parsing just that one record.
+    """
+
+    def __init__(self, filename):
+        self.__filename = filename
+        with open(filename, 'rb') as file:
+            self.__map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if self.__map[:len(MAGIC)] != MAGIC:
+                raise IOError('%s is not an index cache file' % filename)
+            if len(self.__map) < len(MAGIC) + FOOTER.size:
+                raise IOError('%s is truncated' % filename)
+            (self.__header_off, self.__header_len, self.__table_off,
+             self.__count, magic) = FOOTER.unpack_from(self.__map, len(self.__map) - FOOTER.size)
+            if magic != MAGIC[:4]:
+                raise IOError('%s is truncated' % filename)
+            if self.__table_off + self.__count * ENTRY.size > len(self.__map) - FOOTER.size or \
+               self.__header_off + self.__header_len > len(self.__map):
+                raise IOError('%s is damaged' % filename)
+        except struct.error as ex:
+            self.__map.close()
+            raise IOError('%s is damaged: %s' % (filename, ex))
+        except Exception:
+            self.__map.close()
+            raise
+        self.__header = None
+        self.__index = None
+
+    @staticmethod
+    def is_cache(filename):
+        ''' check if filename is a binary cache file '''
+        if not os.path.isfile(filename):
+            return False
+        with open(filename, 'rb') as file:
+            return file.read(len(MAGIC)) == MAGIC
+
+    @staticmethod
+    def is_readable(filename):
+        ''' check if filename is a cache file that can be opened, damaged ones are not '''
+        if not IndexCache.is_cache(filename):
+            return False
+        try:
+            IndexCache(filename).close()
+        except IOError:
+            return False
+        return True
+
+    @property
+    def filename(self):
+        return str(self.__filename)
+
+    def __len__(self):
+        return int(self.__count)
+
+    def __json(self, offset, length):
+        if length == 0:
+            return None
+        return json.loads(self.__map[offset:offset+length].decode('utf-8'))
+
+    def __entry(self, idx):
+        return ENTRY.unpack_from(self.__map, self.__table_off + idx * ENTRY.size)
+
+    def __name(self, entry):
+        return self.__map[entry[0]:entry[0]+entry[1]]
+
+    def __lookup(self, appid):
+        ''' packageName -> offset table entry, the hash index is built once from the table '''
+        if self.__index is None:
+            index = {}
+            for idx in range(self.__count):
+                entry = self.__entry(idx)
+                index[self.__name(entry).decode('utf-8')] = entry
+            self.__index = index
+        return self.__index.get(appid)
+
+    @property
+    def header(self):
+        ''' top level nodes except apps and packages '''
+        if self.__header is None:
+            self.__header = self.__json(self.__header_off, self.__header_len) or {}
+        return self.__header
+
+    def __contains__(self, appid):
+        return not self.__lookup(appid) is None
+
+    def app(self, appid):
+        entry = self.__lookup(appid)
+        if entry is None:
+            return None
+        return self.__json(entry[2], entry[3])
+
+    def packages(self, appid):
+        entry = self.__lookup(appid)
+        if entry is None:
+            return []
+        return self.__json(entry[4], entry[5]) or []
+
+    def appids(self):
+        ''' packageNames of all apps in sorted order, no json is parsed '''
+        for idx in range(self.__count):
+            entry = self.__entry(idx)
+            if entry[3] > 0:
+                yield self.__name(entry).decode('utf-8')
+
+    def packageids(self):
+        ''' packageNames of all apps with packages in sorted order, no json is parsed '''
+        for idx in range(self.__count):
+            entry = self.__entry(idx)
+            if entry[5] > 0:
+                yield self.__name(entry).decode('utf-8')
+
+    def apps(self):
+        for idx in range(self.__count):
+            entry = self.__entry(idx)
+            app = self.__json(entry[2], entry[3])
+            if not app is None:
+                yield app
+
+    def all_packages(self):
+        for idx in range(self.__count):
+            entry = self.__entry(idx)
+            if entry[5] > 0:
+                yield (self.__name(entry).decode('utf-8'), self.__json(entry[4], entry[5]))
+
+    def close(self):
+        self.__map.close()
+
+    #######################
+    # implement "with"
+    #######################
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
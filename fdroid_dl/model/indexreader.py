@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import codecs
+import json
+
+
+LOGGER = logging.getLogger('model.IndexReader')
+class IndexReader(object):
+    """
+    Event based reader for f-droid's index-v1.json files.
+
+    Walks the file one entry at a time and never holds more than a single
+    app or package in memory. Iterating yields tuples of:
+
+    * ``('value', key, value)`` for top level nodes like repo and requests
+    * ``('app', app)`` for every entry in apps
+    * ``('package', appid, package)`` for every entry in packages
+    """
+    BLOCKSIZE = 65536
+    WHITESPACE = ' \t\n\r'
+
+    def __init__(self, source, blocksize=BLOCKSIZE):
+        if not hasattr(source, 'read'):
+            source = open(source, 'rb')
+        self.__source = source
+        self.__blocksize = blocksize
+        self.__decoder = json.JSONDecoder()
+        self.__utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.__buf = ''
+        self.__pos = 0
+        self.__eof = False
+
+    def __fill(self, size=None):
+        if self.__eof:
+            return False
+        chunk = self.__source.read(size or self.__blocksize)
+        if not chunk:
+            self.__eof = True
+            self.__buf += self.__utf8.decode(b'', final=True)
+            return False
+        if isinstance(chunk, bytes) and not isinstance(chunk, str):
+            chunk = self.__utf8.decode(chunk)
+        # drop consumed part so the buffer stays bounded
+        self.__buf = self.__buf[self.__pos:] + chunk
+        self.__pos = 0
+        return True
+
+    def __peek(self):
+        while True:
+            while self.__pos < len(self.__buf) and self.__buf[self.__pos] in IndexReader.WHITESPACE:
+                self.__pos += 1
+            if self.__pos < len(self.__buf):
+                return self.__buf[self.__pos]
+            if not self.__fill():
+                raise ValueError('unexpected end of index file')
+
+    def __expect(self, char):
+        found = self.__peek()
+        if found != char:
+            raise ValueError("expected '%s' but found '%s' in index file" % (char, found))
+        self.__pos += 1
+
+    def __value(self):
+        self.__peek()
+        while True:
+            try:
+                value, end = self.__decoder.raw_decode(self.__buf, self.__pos)
+                # a number right at the buffer end might still continue
+                if end < len(self.__buf) or self.__eof:
+                    self.__pos = end
+                    return value
+            except ValueError:
+                if self.__eof:
+                    raise
+            # grow reads so large values are not re-decoded too often
+            self.__fill(max(self.__blocksize, len(self.__buf) - self.__pos))
+
+    def __separator(self, close):
+        ''' returns True if another entry follows '''
+        char = self.__peek()
+        self.__pos += 1
+        if char == ',':
+            return True
+        if char == close:
+            return False
+        raise ValueError("expected ',' or '%s' but found '%s' in index file" % (close, char))
+
+    def __array(self):
+        self.__expect('[')
+        if self.__peek() == ']':
+            self.__pos += 1
+            return
+        while True:
+            yield self.__value()
+            if not self.__separator(']'):
+                return
+
+    def __object(self):
+        self.__expect('{')
+        if self.__peek() == '}':
+            self.__pos += 1
+            return
+        while True:
+            key = self.__value()
+            self.__expect(':')
+            yield key
+            if not self.__separator('}'):
+                return
+
+    def __iter__(self):
+        for key in self.__object():
+            if key == 'apps' and self.__peek() == '[':
+                for app in self.__array():
+                    yield ('app', app)
+            elif key == 'packages' and self.__peek() == '{':
+                for appid in self.__object():
+                    for pkg in self.__array():
+                        yield ('package', appid, pkg)
+            else:
+                yield ('value', key, self.__value())
+
+    def close(self):
+        self.__source.close()
+
+    #######################
+    # implement "with"
+    #######################
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
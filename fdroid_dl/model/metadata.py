@@ -9,10 +9,10 @@ import logging
 import json
 import hashlib
 import copy
-import re
 from ..json import GenericJSONEncoder
 from .index import Index
 from .appmetadata import AppMetadata
+from .selectorset import SelectorSet
 
 LOGGER = logging.getLogger('model.Metadata')
 class Metadata(MutableMapping):
@@ -39,17 +39,41 @@ class Metadata(MutableMapping):
         for app in apps:
             self.add(app)
 
-    def load_all(self):
+    def load_all(self, appids=None):
+        ''' merge apps of all indices, appids limits this to the apps actually needed '''
         for index in self.__repoman.indices:
             LOGGER.info("loading index: %s", index.key)
-            apps = index.get('apps', [])
+            cnt = 0
+            if appids is None:
+                apps = index.apps()
+            else:
+                apps = (index.app(appid) for appid in appids if index.has_app(appid))
             for app in apps:
                 appid = app.get('packageName', None)
                 if not appid is None:
-                    self.add(AppMetadata(appid, app, default_locale=self.__default_locale))
-            LOGGER.info("loaded index: %s apps: %s", index.key, len(apps))
+                    self.add(AppMetadata(appid, json=app, default_locale=self.__default_locale))
+                    cnt += 1
+            LOGGER.info("loaded index: %s apps: %s", index.key, cnt)
         return self
 
+    def reload(self, appid, indices):
+        '''
+        rebuild metadata of appid from the config and given indices, same
+        result as load_all if indices are all indices in config order.
+        '''
+        appmetadata = None
+        if appid in self.__config:
+            appmetadata = AppMetadata(appid, self.__config[appid], default_locale=self.__default_locale)
+        for index in indices:
+            if index.has_app(appid):
+                app = AppMetadata(appid, json=index.app(appid), default_locale=self.__default_locale)
+                appmetadata = app if appmetadata is None else appmetadata.merge(app)
+        if appmetadata is None:
+            self.__store.pop(appid, None)
+        else:
+            self.__store[appid] = appmetadata
+        return appmetadata
+
     def add(self, appmetadata):
         if appmetadata is None:
             return
@@ -64,19 +88,8 @@ class Metadata(MutableMapping):
     def find_all(self, key):
         if key is None:
             raise KeyError("key must not be empty")
-        ret_val = set()
-        if key.startswith('regex:'):
-            regc = re.compile(key[6:], re.I|re.S)
-            for k in self.__store:
-                match = regc.match(k)
-                if not match is None:
-                    ret_val.add(self.__store[k])
-        elif key in ['*', '.*', 'all']:
-            for k in self.__store:
-                ret_val.add(self.__store[k])
-        elif key in self:
-            ret_val.add(self[key])
-        return list(ret_val)
+        appids = SelectorSet.compile([key]).select(lambda: iter(self.__store), self.__store.__contains__)
+        return [self.__store[appid] for appid in appids]
 
     def __repr__(self):
         return "<Metadata: %s>"%str(json.dumps(self.__store, indent=4, cls=GenericJSONEncoder))
@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+class PackageRecord(object):
+    '''
+    The few fields of an index package a download needs. Package dicts of
+    the index carry dozens of keys, candidates are kept as records instead.
+    '''
+    __slots__ = ('url', 'hash', 'hash_type', 'version_code', 'size')
+
+    def __init__(self, url, hash=None, hash_type=None, version_code=0, size=None):
+        self.url = url
+        self.hash = hash
+        self.hash_type = hash_type
+        self.version_code = version_code
+        self.size = size
+
+    def __repr__(self): return "<PackageRecord: %s versionCode(%s) %s:%s>"%(self.url, self.version_code, self.hash_type, self.hash)
@@ -10,6 +10,10 @@ import copy
 import json
 import os, os.path
 import hashlib
+try:
+    from os import replace
+except ImportError:
+    from os import rename as replace
 try:
     from urllib.parse import urlparse, urljoin
 except ImportError:
@@ -18,6 +22,7 @@ import shutil
 from tempfile import NamedTemporaryFile
 from .metadata import Metadata
 from .index import Index
+from .changeset import Changeset
 from ..json import GenericJSONEncoder
 
 
@@ -32,6 +37,8 @@ class RepoConfig(MutableMapping):
         self.__store = RepoConfig.EMPTY.copy()
         self.__store.update(cfg)
         self.__store['id'] = hashlib.sha1(str(self.__url).encode('UTF-8')).hexdigest()
+        self.__changes = None
+        self.__pending = None
 
     def __clean_url(self, url):
         purl = urlparse(url)
@@ -84,10 +91,75 @@ class RepoConfig(MutableMapping):
     def hash(self):
         return self.__store.get('hash', None)
 
+    @property
+    def mirrors(self):
+        ''' mirror urls advertised by the index of this repo '''
+        index = self.index
+        if index is None:
+            return []
+        return [str(mirror) for mirror in index.get('repo', {}).get('mirrors', []) or []]
+
     @property
     def filename(self):
         return os.path.join(self.__config.cache_dir, self.id+".cache")
 
+    @property
+    def changes(self):
+        ''' Changeset of the last index refresh, None means everything needs to be checked '''
+        return self.__changes
+
+    @changes.setter
+    def changes(self, changes):
+        self.__changes = changes
+
+    @property
+    def pending_filename(self):
+        return os.path.join(self.__config.cache_dir, self.id+".pending.json")
+
+    def __load_pending(self):
+        ''' stage -> Changeset not applied by that stage yet, stages without entry have to check everything '''
+        if self.__pending is None:
+            self.__pending = {}
+            if os.path.isfile(self.pending_filename):
+                try:
+                    with open(self.pending_filename, 'r') as file:
+                        self.__pending = dict((stage, Changeset.from_json(changes))
+                                              for stage, changes in json.load(file).items())
+                except (ValueError, AttributeError):
+                    LOGGER.warning("ignoring corrupt pending changes %s", self.pending_filename)
+        return self.__pending
+
+    def __save_pending(self):
+        folder = os.path.dirname(os.path.abspath(self.pending_filename))
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        with NamedTemporaryFile(mode='w', dir=folder, prefix='.', suffix='.tmp', delete=False) as tmp:
+            json.dump(dict((stage, changes.to_json()) for stage, changes in self.__pending.items()), tmp,
+                      separators=(',', ':'))
+        replace(tmp.name, self.pending_filename)
+
+    def pending(self, stage):
+        '''
+        changes of all index refreshes since stage last applied this repo
+        completely, None if unknown and everything needs to be checked
+        '''
+        return self.__load_pending().get(stage)
+
+    def add_pending(self, changes):
+        ''' record the Changeset of an index refresh for all stages, None drops what is known '''
+        pending = self.__load_pending()
+        if changes is None:
+            pending.clear()
+        else:
+            for stage_changes in pending.values():
+                stage_changes.update(changes)
+        self.__save_pending()
+
+    def clear_pending(self, stage):
+        ''' stage applied all pending changes of this repo '''
+        self.__load_pending()[stage] = Changeset()
+        self.__save_pending()
+
     @property
     def format(self):
         if 'format' in self.__store:
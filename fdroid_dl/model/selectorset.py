@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import re
+from threading import Lock
+
+
+LOGGER = logging.getLogger('model.SelectorSet')
+class SelectorSet(object):
+    """
+    Precompiled set of app selectors as used in the config file.
+
+    Selectors are either exact packageNames, ``regex:<pattern>`` or one of
+    ``*``, ``.*`` and ``all``. Exact names are resolved with a hash lookup,
+    all regex selectors are matched in a single pass over the apps.
+    Compiled sets are cached, so the same selectors are compiled only once.
+    """
+    ALL = ['*', '.*', 'all']
+    __cache = {}
+    __lock = Lock()
+
+    def __init__(self, selectors):
+        self.__selectors = tuple(selectors)
+        self.__all = False
+        self.__exact = []
+        self.__regex = []
+        for selector in self.__selectors:
+            if selector is None:
+                raise KeyError("key must not be empty")
+            if selector.startswith('regex:'):
+                self.__regex.append(re.compile(selector[6:], re.I | re.S))
+            elif selector in SelectorSet.ALL:
+                self.__all = True
+            elif not selector in self.__exact:
+                self.__exact.append(selector)
+
+    @classmethod
+    def compile(cls, selectors):
+        if isinstance(selectors, str):
+            selectors = [selectors]
+        key = tuple(selectors)
+        with cls.__lock:
+            if not key in cls.__cache:
+                cls.__cache[key] = cls(key)
+            return cls.__cache[key]
+
+    @property
+    def selectors(self):
+        return list(self.__selectors)
+
+    def matches(self, appid):
+        if self.__all or appid in self.__exact:
+            return True
+        for regexc in self.__regex:
+            if not regexc.match(appid) is None:
+                return True
+        return False
+
+    def select(self, appids, contains):
+        """
+        Return matching appids.
+
+        Parameters
+        ----------
+        appids : callable
+            returns an iterable over all known appids, only called if a
+            regex or wildcard selector needs a full pass
+        contains : callable
+            returns True if given appid is known
+        """
+        ret_val = []
+        if self.__all:
+            return list(appids())
+        seen = set()
+        for appid in self.__exact:
+            if contains(appid):
+                seen.add(appid)
+                ret_val.append(appid)
+        if len(self.__regex) > 0:
+            for appid in appids():
+                if not appid in seen:
+                    for regexc in self.__regex:
+                        if not regexc.match(appid) is None:
+                            seen.add(appid)
+                            ret_val.append(appid)
+                            break
+        return ret_val
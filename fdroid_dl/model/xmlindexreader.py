@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import xml.etree.ElementTree as ET
+from time import mktime
+
+
+def number(value):
+    if value.isdigit():
+        return int(value)
+    return value
+
+
+def date(value):
+    ''' yyyy-mm-dd -> unix timestamp in local time '''
+    (year, month, day) = value.split('-', 2)
+    return int(mktime((int(year), int(month), int(day), 0, 0, 0, 0, 0, -1)))
+
+
+def csv(value):
+    return [item for item in value.split(',') if len(item) > 0] or None
+
+
+def permissions(value):
+    return [['android.permission.'+item.strip(), None] for item in value.split(',')]
+
+
+LOGGER = logging.getLogger('model.XmlIndexReader')
+class XmlIndexReader(object):
+    """
+    Event based reader for f-droid's legacy index.xml files.
+
+    Converts the xml tree with precompiled field tables and yields the same
+    events as IndexReader, see there. Elements are cleared as soon as they
+    are converted, so memory stays constant no matter how many applications
+    the file holds.
+    """
+    # child tag -> [(json key, converter)]
+    APP_FIELDS = {
+        'email': [('authorEmail', number)],
+        'author': [('authorName', number)],
+        'web': [('authorWebSite', number), ('webSite', number)],
+        'bitcoin': [('bitcoin', number)],
+        'donate': [('donate', number)],
+        'flattr': [('flattr', number)],
+        'liberapay': [('liberapay', number)],
+        'litecoin': [('litecoin', number)],
+        'categories': [('categories', csv)],
+        'antiFeatures': [('antiFeatures', csv)],
+        'antifeatures': [('antiFeatures', csv)],
+        'marketversion': [('suggestedVersionName', number)],
+        'marketvercode': [('suggestedVersionCode', number)],
+        'tracker': [('issueTracker', number)],
+        'changelog': [('changelog', number)],
+        'license': [('license', number)],
+        'name': [('name', number)],
+        'source': [('sourceCode', number)],
+        'added': [('added', date)],
+        'icon': [('icon', number)],
+        'id': [('packageName', number)],
+        'lastupdated': [('lastUpdated', date)]
+    }
+    LOCALIZED_FIELDS = {
+        'desc': [('description', number)],
+        'summary': [('summary', number)]
+    }
+    PACKAGE_FIELDS = {
+        'added': [('added', date)],
+        'apkname': [('apkName', number)],
+        'srcname': [('srcname', number)],
+        'hash': [('hash', number)],
+        'sdkver': [('minSdkVersion', number)],
+        'targetSdkVersion': [('targetSdkVersion', number)],
+        'sig': [('sig', number)],
+        'version': [('versionName', number)],
+        'versioncode': [('versionCode', number)],
+        'size': [('size', number)],
+        'permissions': [('uses-permission', permissions)]
+    }
+    # element attribute -> [(json key, converter)]
+    PACKAGE_ATTRS = {
+        'hash': {'type': [('hashType', number)]}
+    }
+    REPO_ATTRS = {
+        'timestamp': [('timestamp', number)],
+        'version': [('version', number)],
+        'maxage': [('maxage', number)],
+        'name': [('name', number)],
+        'icon': [('icon', number)],
+        'url': [('address', number)]
+    }
+
+    def __init__(self, source, default_locale='en-US'):
+        if not hasattr(source, 'read'):
+            source = open(source, 'rb')
+        self.__source = source
+        self.__default_locale = default_locale
+
+    @staticmethod
+    def __apply(fields, tag, value, node):
+        for key, converter in fields.get(tag, ()):
+            try:
+                converted = converter(value)
+            except ValueError:
+                LOGGER.warning("invalid value for %s: %s", key, value)
+                continue
+            if not converted is None:
+                node[key] = converted
+
+    @staticmethod
+    def __text(elem):
+        if elem.text is None:
+            return None
+        return elem.text.strip()
+
+    @staticmethod
+    def convert_package(xmlpkg, appid):
+        pkg = {'packageName': appid}
+        for child in xmlpkg:
+            value = XmlIndexReader.__text(child)
+            if not value is None:
+                XmlIndexReader.__apply(XmlIndexReader.PACKAGE_FIELDS, child.tag, value, pkg)
+            attrs = XmlIndexReader.PACKAGE_ATTRS.get(child.tag)
+            if not attrs is None:
+                for attr, value in child.attrib.items():
+                    XmlIndexReader.__apply(attrs, attr, value.strip(), pkg)
+        return pkg
+
+    @staticmethod
+    def convert_app(xmlapp, default_locale='en-US'):
+        ''' returns (app, packages) for given application element '''
+        app = {}
+        loc = {}
+        xmlpkgs = []
+        for child in xmlapp:
+            if child.tag == 'package':
+                xmlpkgs.append(child)
+                continue
+            value = XmlIndexReader.__text(child)
+            if not value is None:
+                XmlIndexReader.__apply(XmlIndexReader.APP_FIELDS, child.tag, value, app)
+                XmlIndexReader.__apply(XmlIndexReader.LOCALIZED_FIELDS, child.tag, value, loc)
+        app['localized'] = {default_locale: loc}
+        appid = app.get('packageName')
+        if appid is None:
+            return (app, [])
+        return (app, [XmlIndexReader.convert_package(xmlpkg, appid) for xmlpkg in xmlpkgs])
+
+    @staticmethod
+    def convert_repo(xmlrepo):
+        repo = {}
+        for attr, value in xmlrepo.attrib.items():
+            XmlIndexReader.__apply(XmlIndexReader.REPO_ATTRS, attr, value.strip(), repo)
+        mirrors = []
+        for child in xmlrepo:
+            value = XmlIndexReader.__text(child)
+            if child.tag == 'description' and not value is None:
+                repo['description'] = number(value)
+            elif child.tag == 'mirror' and not value is None:
+                mirrors.append(number(value))
+        repo['mirrors'] = mirrors
+        return repo
+
+    def __iter__(self):
+        requests = {'install': [], 'uninstall': []}
+        depth = 0
+        root = None
+        for event, elem in ET.iterparse(self.__source, events=('start', 'end')):
+            if event == 'start':
+                if root is None:
+                    root = elem
+                depth += 1
+                continue
+            depth -= 1
+            if depth != 1:
+                continue
+            # direct children of the root element
+            if elem.tag == 'application' and not elem.get('id') is None:
+                (app, pkgs) = XmlIndexReader.convert_app(elem, self.__default_locale)
+                if len(app) > 1:
+                    yield ('app', app)
+                for pkg in pkgs:
+                    yield ('package', app['packageName'], pkg)
+            elif elem.tag == 'repo':
+                yield ('value', 'repo', XmlIndexReader.convert_repo(elem))
+            elif elem.tag in requests and not elem.get('packageName') is None:
+                requests[elem.tag].append(number(elem.get('packageName').strip()))
+            root.clear()
+        yield ('value', 'requests', requests)
+
+    def close(self):
+        self.__source.close()
+
+    #######################
+    # implement "with"
+    #######################
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
@@ -2,5 +2,6 @@
 # -*- coding: utf-8 -*-
 
 from .index import IndexFileProcessor
+from .hashverifier import HashVerifier
 
-__all__ = ['IndexFileProcessor']
+__all__ = ['IndexFileProcessor', 'HashVerifier']
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import time
+import os
+import multiprocessing
+from datetime import timedelta
+from concurrent.futures import as_completed, ThreadPoolExecutor
+from ..download import FuturesSessionVerifiedDownload
+
+
+def verify_file(filename, hash_type, hash):
+    ''' returns (verified, elapsed, file size) '''
+    start = time.time()
+    verified = FuturesSessionVerifiedDownload.verify(filename, hash_type, hash)
+    return (verified, timedelta(seconds=time.time() - start), os.path.getsize(filename))
+
+
+LOGGER = logging.getLogger('processor.HashVerifier')
+class HashVerifier(object):
+    '''
+    Hashes existing files in a pool of its own.
+
+    Kept apart from the download pool, so reading and hashing files on disk
+    runs while downloads are in flight. hashlib releases the GIL for large
+    blocks, so threads scale with the cpu count, a few extra cover disk
+    latency.
+    '''
+
+    def __init__(self, max_workers=None):
+        if max_workers is None:
+            max_workers = HashVerifier.default_workers()
+        self.__executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.__futures = []
+
+    @staticmethod
+    def default_workers():
+        return min(32, multiprocessing.cpu_count() + 4)
+
+    def verify(self, filename, hash_type, hash, *args):
+        future = self.__executor.submit(verify_file, filename, hash_type, hash)
+        future.filename = filename
+        future.args = args
+        self.__futures.append(future)
+
+    def completed(self):
+        ''' yields (verified, filename, elapsed, file size) + args given to verify '''
+        for future in as_completed(self.__futures):
+            try:
+                (verified, elapsed, size) = future.result()
+            except Exception as ex:
+                LOGGER.warning("Error verifying %s: %s", future.filename, str(ex))
+                yield (False, future.filename, None, 0) + future.args
+                continue
+            yield (verified, future.filename, elapsed, size) + future.args
+        self.__futures = []
+
+    def shutdown(self, wait=True):
+        self.__executor.shutdown(wait=wait)
+
+    #######################
+    # implement "with"
+    #######################
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.shutdown()
@@ -3,22 +3,90 @@
 
 import logging
 import time
-import json
 import os
+import sys
+import multiprocessing
+try:
+    import resource
+except ImportError:
+    resource = None
 from datetime import timedelta
-from concurrent.futures import as_completed, ThreadPoolExecutor
+from zipfile import ZipFile
+from concurrent.futures import as_completed, ThreadPoolExecutor, ProcessPoolExecutor
 from ..model import Index
 
 
+def peak_rss():
+    ''' peak resident set size over the whole lifetime of the calling process in bytes, None if unknown '''
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return rss
+    return rss * 1024
+
+
+def process_index(source, member, format, url, filename):
+    '''
+    parse index file and write the cache file, returns (repo name, elapsed, cache size, peak rss, changeset).
+    peak rss is the lifetime peak of the process that parsed, it includes all earlier work of that process.
+    module level so it can be sent to worker processes, for those source is a
+    path and member the index file inside the jar at that path.
+    '''
+    start = time.time()
+    archive = None
+    if isinstance(source, str):
+        if not member is None:
+            archive = ZipFile(source)
+            source = archive.open(member)
+        else:
+            source = open(source, 'rb')
+    try:
+        with source as file_handle:
+            index = Index.from_stream(file_handle, filename, format=format, key=url)
+    finally:
+        if not archive is None:
+            archive.close()
+    repo_name = index.get('repo', {}).get('name')
+    elapsed = time.time() - start
+    return (repo_name, timedelta(seconds=elapsed), os.path.getsize(filename), peak_rss(), index.changes)
+
+
 LOGGER = logging.getLogger('processor.IndexFileProcessor')
-class IndexFileProcessor(ThreadPoolExecutor):
+class IndexFileProcessor(object):
+    '''
+    Parses downloaded index files into cache files.
+
+    Parsing is CPU bound, with processes=True it runs in a process pool
+    instead of threads. Only paths and small result tuples are passed between
+    processes, so the sources need to be files on disk.
+    '''
 
-    def __init__(self, *args, **kwargs):
-        super(IndexFileProcessor, self).__init__(*args, **kwargs)
+    def __init__(self, max_workers=None, processes=False):
+        self.__processes = processes
+        if processes:
+            if not max_workers is None:
+                max_workers = min(max_workers, multiprocessing.cpu_count())
+            self.__executor = ProcessPoolExecutor(max_workers=max_workers)
+        else:
+            self.__executor = ThreadPoolExecutor(max_workers=max_workers)
         self.__futures = []
 
+    @property
+    def processes(self):
+        return self.__processes is True
+
+    @staticmethod
+    def peak_rss():
+        ''' peak resident set size of this process in bytes, None if unknown '''
+        return peak_rss()
+
     @staticmethod
     def __persist_format(file, repo):
+        if hasattr(file, 'format'):
+            # jar streams know which index file they contain
+            repo['format'] = file.format
+            return
         file.seek(0) # reset fp to beginning
         startchar = file.read(1).decode("utf-8")
         if startchar == '<':
@@ -27,30 +95,36 @@ class IndexFileProcessor(ThreadPoolExecutor):
             repo['format'] = 'json'
         file.seek(0)
 
-    @staticmethod
-    def __process(file, repo, *args):
-        start = time.time()
-        index = None
-        IndexFileProcessor.__persist_format(file, repo)
-        with file as file_handle:
-            if repo['format'] == 'json':
-                index = Index.from_json(file_handle, key=repo.url).monkeypatch().save(filename=repo.filename)
-            else:
-                index = Index.from_xml(file_handle, key=repo.url).monkeypatch().save(filename=repo.filename)
-        elapsed = time.time() - start
-        return (index, timedelta(seconds=elapsed))+args
-
     def process(self, file, repo, *args):
         if not hasattr(file, 'read'):
             raise IOError('file error!')
         if repo is None:
             raise AttributeError('repo is missing')
-        args = (file, repo) + args
-        self.__futures.append(self.submit(IndexFileProcessor.__process, *args))
+        IndexFileProcessor.__persist_format(file, repo)
+        spooled = getattr(file, 'spooled', 0)
+        if self.__processes:
+            # workers reopen the spooled file by path, keep it until they are done
+            source = (getattr(file, 'path', file.name), getattr(file, 'member', None))
+            future = self.__executor.submit(process_index, *(source + (repo['format'], repo.url, repo.filename)))
+            future.add_done_callback(lambda f: file.close())
+        else:
+            future = self.__executor.submit(process_index, file, None, repo['format'], repo.url, repo.filename)
+        future.spooled = spooled
+        future.args = args
+        self.__futures.append(future)
 
     def completed(self):
+        ''' yields (repo name, elapsed, bytes written, peak rss of the parsing process, changeset) + args given to process '''
         for future in as_completed(self.__futures):
-            yield future
+            try:
+                (repo_name, elapsed, written, rss, changes) = future.result()
+            except Exception:
+                LOGGER.exception("Error processing index file %s", future.args)
+                continue
+            yield (repo_name, elapsed, written + future.spooled, rss, changes) + future.args
+
+    def shutdown(self, wait=True):
+        self.__executor.shutdown(wait=wait)
 
     #######################
     # implement "with"
@@ -9,5 +9,6 @@ from .index import IndexUpdate
 from .metadata import MetadataUpdate
 from .apk import ApkUpdate
 from .src import SrcUpdate
+from .pipeline import Pipeline
 
-__all__ = ['Update', 'IndexUpdate', 'MetadataUpdate', 'ApkUpdate', 'SrcUpdate']
+__all__ = ['Update', 'IndexUpdate', 'MetadataUpdate', 'ApkUpdate', 'SrcUpdate', 'Pipeline']
@@ -3,76 +3,168 @@
 
 import logging
 import time
+import heapq
 import os.path
 from datetime import timedelta
+from itertools import chain
 try:
     from urllib.parse import urlparse
 except ImportError:
     from urlparse import urlparse
 from .selector import Selector
-from ..download import FuturesSessionVerifiedDownload, FuturesSessionFlex
+from ..download import FuturesSessionFlex
+from ..model import PackageRecord
+from ..processor import HashVerifier
 
 LOGGER = logging.getLogger('update.ApkUpdate')
 class ApkUpdate(Selector):
-    def __init__(self, config, download_timeout=600, max_workers=10):
-        super(ApkUpdate, self).__init__(config)
+    ''' downloads the newest apk_versions files of each selected app, subclasses pick another file of the package '''
+    STAGE = 'apk'
+    FILES = 'apk files'
+    URL = 'apkName'
+
+    def __init__(self, config, download_timeout=600, max_workers=10, delta=True, reverify=False, hash_workers=None,
+                 **engine):
+        super(ApkUpdate, self).__init__(config, delta=delta and not reverify, **engine)
         self.__config = config
         self.__download_timeout = download_timeout
         self.__max_workers = max_workers
+        self.__reverify = reverify
+        self.__hash_workers = hash_workers
 
     def all_packages(self, session=None):
         downloads = {}
         logging.info("collecting apps to download")
         start = time.time()
         apkcnt = 0
-        # search pkgs
-        for repo, appid in self.all_apps(dupes=True):
-            Selector.apply_session_settings(repo, session)
-            packages = repo.index.get('packages', {}).get(appid, [])
-            if not appid in downloads:
-                downloads[appid] = []
-            for pkg in packages:
-                if not pkg.get('apkName') is None and not pkg.get('hash') is None and not pkg.get('hashType') is None:
-                    downloads[appid].append(pkg)
-                    apkcnt += 1
+        skipcnt = 0
+        # search pkgs, only the newest apk_versions of each app are kept
+        for repo, appid in self.all_apps(dupes=True, session=session):
+            packages = self.candidates(repo, appid)
+            downloads[appid] = self.newest(downloads.get(appid, []), packages)
+            apkcnt += len(packages)
         elapsed = time.time() - start
-        logging.info("found (%s) apk files to download (%s)", apkcnt, timedelta(seconds=elapsed))
+        logging.info("found (%s) %s to download (%s)", apkcnt, self.FILES, timedelta(seconds=elapsed))
 
         for appid in downloads.keys():
-            # sort newest first
-            packages = sorted(downloads[appid], key=lambda e: e.get('versionCode', 0), reverse=True)
-            for idx, pkg in enumerate(packages):
-                if idx >= self.__config.apk_versions:
-                    break # only download number of confgured files
-                url = pkg.get('apkName')
-                filename = os.path.basename(str(urlparse(url).path))
-                filepath = os.path.join(self.__config.repo_dir, filename)
-                yield (url, filepath, pkg.get('hash'), pkg.get('hashType'))
+            (packages, skipped) = self.select_packages(appid, downloads[appid])
+            skipcnt += skipped
+            for package in packages:
+                yield package
+        if skipcnt > 0:
+            LOGGER.info("skipped (%s) %s of unchanged apps", skipcnt, self.FILES)
+
+    def candidates(self, repo, appid):
+        ''' PackageRecords of appid in repo that can be downloaded and verified '''
+        return [self.record(pkg) for pkg in repo.index.packages(appid)
+                if not pkg.get('apkName') is None and not pkg.get('hash') is None and not pkg.get('hashType') is None]
+
+    def checksum(self, pkg):
+        ''' (hash, hash_type) the downloaded file is verified against '''
+        return (pkg.get('hash'), pkg.get('hashType'))
+
+    def record(self, pkg):
+        ''' PackageRecord of the file of index package pkg '''
+        (fhash, hash_type) = self.checksum(pkg)
+        return PackageRecord(pkg.get(self.URL), fhash, hash_type, pkg.get('versionCode') or 0, pkg.get('size'))
+
+    def newest(self, *packages):
+        '''
+        newest configured number of PackageRecords, newest first. a bounded heap,
+        of equal versionCodes the one given first wins just like with a stable sort
+        '''
+        return heapq.nlargest(self.__config.apk_versions, chain(*packages), key=lambda pkg: pkg.version_code)
+
+    def select_packages(self, appid, packages, repos=None):
+        '''
+        newest configured number of packages as (url, filename, hash, hash_type),
+        returns them with the count of files skipped because the app is unchanged
+        '''
+        # packages of unchanged apps were verified by an earlier run
+        unchanged = self.unchanged(appid, packages=True, repos=repos)
+        selected = []
+        skipped = 0
+        for pkg in self.newest(packages):
+            filename = os.path.basename(str(urlparse(pkg.url).path))
+            filepath = os.path.join(self.__config.repo_dir, filename)
+            if unchanged and os.path.exists(filepath):
+                skipped += 1
+                continue
+            selected.append((pkg.url, filepath, pkg.hash, pkg.hash_type))
+        return (selected, skipped)
 
     def update(self):
-        meta = self.__config.metadata
-        LOGGER.info("UPDATING apk files")
-        start = time.time()
-        cnt = 0
-        ecnt = 0
-        with FuturesSessionVerifiedDownload(max_workers=self.__max_workers) as session:
+        self.begin()
+        with self.download_session(max_workers=self.__max_workers) as session, \
+                HashVerifier(max_workers=self.__hash_workers) as verifier:
+            # missing files are downloaded right away, existing ones hashed in parallel
             for url, filename, fhash, hash_type in self.all_packages(session=session):
-                if os.path.exists(filename):
-                    start2 = time.time()
-                    if FuturesSessionVerifiedDownload.verify(filename, hash_type, fhash):
-                        elapsed = time.time() - start2
-                        LOGGER.info("hash verified %s [%s] (%s) ✔", os.path.basename(filename), timedelta(seconds=elapsed), FuturesSessionFlex.h_size(os.stat(filename).st_size))
-                    else:
-                        session.download(url, filename, timeout=self.__download_timeout, hash=fhash, hash_type=hash_type)
-                else:
-                    session.download(url, filename, timeout=self.__download_timeout, hash=fhash, hash_type=hash_type)
-
-            dlsum = 0
+                self.schedule(url, filename, fhash, hash_type, session, verifier)
+            self.verified(verifier, session)
             for success, filename, dbytes, hbytes, elapsed in session.completed():
-                if success:
-                    cnt += 1
-                    dlsum += dbytes
-                else:
-                    ecnt += 1
-        elapsed = time.time() - start
-        LOGGER.info("UPDATED apk files, files(%s) errors(%s) [%s] (%s)", cnt, ecnt, FuturesSessionFlex.h_size(dlsum), timedelta(seconds=elapsed))
+                self.downloaded(success, filename, dbytes)
+        self.end()
+
+    def begin(self):
+        ''' start counting a new run '''
+        LOGGER.info("UPDATING %s", self.FILES)
+        self.__start = time.time()
+        self.__counts = {'files': 0, 'errors': 0, 'unchanged': 0, 'hashed': 0, 'bytes': 0}
+        self.__retries = self.retries()
+        self.__transferred = self.transferred()
+        self.__expected = {}
+
+    def schedule(self, url, filename, fhash, hash_type, session, verifier):
+        ''' download missing files, check existing ones against the HashCache or hash them again '''
+        if filename in self.__expected:
+            return
+        self.__expected[filename] = (url, hash_type, fhash)
+        if not os.path.exists(filename):
+            session.download(url, filename, timeout=self.__download_timeout, hash=fhash, hash_type=hash_type, resume=True)
+        elif fhash is None:
+            self.__counts['unchanged'] += 1 # nothing to verify against, files are never changed in place
+        elif not self.__reverify and self.__config.hashes.verified(filename, hash_type, fhash):
+            self.__counts['unchanged'] += 1 # unchanged since it was last verified
+        else:
+            verifier.verify(filename, hash_type, fhash, url)
+
+    def verified(self, verifier, session):
+        ''' collect hashed files, files that do not match are downloaded again '''
+        hashes = self.__config.hashes
+        for verified, filename, elapsed, size, url in verifier.completed():
+            self.__counts['hashed'] += 1
+            (url, hash_type, fhash) = self.__expected[filename]
+            if verified:
+                hashes.add(filename, hash_type, fhash)
+                LOGGER.info("hash verified %s [%s] (%s) ✔", os.path.basename(filename), elapsed, FuturesSessionFlex.h_size(size))
+            else:
+                hashes.discard(filename)
+                session.download(url, filename, timeout=self.__download_timeout, hash=fhash, hash_type=hash_type, resume=True)
+
+    def downloaded(self, success, filename, dbytes):
+        ''' count a finished download, False if filename is not a file of this run '''
+        if not filename in self.__expected:
+            return False
+        if success:
+            self.__counts['files'] += 1
+            self.__counts['bytes'] += dbytes
+            if not self.__expected[filename][2] is None:
+                self.__config.hashes.add(filename, *self.__expected[filename][1:])
+        else:
+            self.__counts['errors'] += 1
+        return True
+
+    def end(self, report=True, complete=True):
+        '''
+        log the summary of the run, report=False leaves the throughput report to the caller.
+        pending changes are cleared if all files were handled, complete=False keeps them
+        '''
+        self.__config.hashes.save()
+        counts = self.__counts
+        elapsed = time.time() - self.__start
+        LOGGER.info("UPDATED %s, files(%s) errors(%s) retries(%s) hashed(%s) unchanged(%s) [%s] (%s)", self.FILES, counts['files'], counts['errors'],
+                    self.retries() - self.__retries, counts['hashed'], counts['unchanged'], FuturesSessionFlex.h_size(counts['bytes']), timedelta(seconds=elapsed))
+        if report:
+            self.report_throughput(self.FILES, self.transferred() - self.__transferred, elapsed)
+        if complete and counts['errors'] == 0:
+            self.applied()
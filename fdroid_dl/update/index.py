@@ -3,63 +3,104 @@
 
 import logging
 import os.path
-from concurrent.futures import as_completed
+import time
+from functools import partial
 import requests
-from ..download import FuturesSessionFlex
+from ..download import FuturesSessionFlex, RetryScheduler
 from ..processor import IndexFileProcessor
+from ..model import Changeset, IndexCache
 
 
 LOGGER = logging.getLogger('update.IndexUpdate')
 class IndexUpdate(object):
-    def __init__(self, config, head_timeout=10, index_timeout=60, max_workers=10):
+    def __init__(self, config, head_timeout=10, index_timeout=60, max_workers=10, processes=False, retry=None, limiter=None):
         self.config = config
         self.head_timeout = head_timeout
         self.index_timeout = index_timeout
         self.max_workers = max_workers
+        self.processes = processes
+        self.retry = retry
+        self.limiter = limiter
+        self.__refreshed = None
+        self.__notified = set()
 
-    def required(self, repos, timeout=60):
-        # try new index
-        head_futures = self.__future(repos=repos, timeout=timeout)
-        # process result
-        (new_index, notfound) = self.__head_response(head_futures)
-        # retry old index
-        head_futures = self.__future(repos=notfound, attr='url_index', timeout=timeout)
-        # process result
-        (old_index, notfound) = self.__head_response(head_futures)
-        # new_index[] needs to be fetched with index-v1.jar
-        # old_index[] needs to be fetched with index.jar
-        return (new_index, old_index)
+    def refresh(self, repos, connect_timeout=10, timeout=60, refreshed=None):
+        '''
+        fetch index files with a single conditional GET per repo, repos
+        without index-v1.jar are retried with the legacy index.jar. each
+        refreshed repo gets the Changeset against its previous cache file,
+        it is added to the changes pending for the update stages right away.
+        refreshed(repo) is called as soon as a repo is done, failed ones included.
+        '''
+        repos = list(repos)
+        self.__refreshed = refreshed
+        self.__notified = set()
+        for repo in repos:
+            repo.changes = None
+        timeout = (connect_timeout, timeout)
+        retries = self.retry.retries if not self.retry is None else 0
+        start = time.time()
+        transferred = self.limiter.bytes if not self.limiter is None else 0
+        notfound = self.__refresh(repos, 'url_index_v1', timeout)
+        for repo in repos:
+            if not repo in notfound:
+                self.__notify(repo)
+        self.__refresh(notfound, 'url_index', timeout)
+        for repo in repos:
+            self.__notify(repo)
+        if not self.retry is None:
+            retries = self.retry.retries - retries
+        LOGGER.info("REFRESHED index files, repos(%s) errors(%s) retries(%s)", len(repos),
+                    len([repo for repo in repos if 'error' in repo]), retries)
+        if not self.limiter is None:
+            self.limiter.report('index files', self.limiter.bytes - transferred, time.time() - start)
 
-    def download(self, new_index, old_index, timeout=60):
-        if new_index is None:
-            raise AttributeError('new_index missing')
-        if old_index is None:
-            raise AttributeError('old_index missing')
-        new_futures = self.__future(repos=new_index, timeout=timeout, http_method=FuturesSessionFlex.get, hooks={'response':[FuturesSessionFlex.extract_jar]}, stream=True)
-        old_futures = self.__future(repos=old_index, timeout=timeout, http_method=FuturesSessionFlex.get, hooks={'response':[FuturesSessionFlex.extract_jar]}, attr='url_index', stream=True)
-        self.__download_response(new_futures)
-        self.__download_response(old_futures)
+    def __changed(self, repo, changes):
+        ''' changes of repo found by this refresh, None if unknown '''
+        repo.changes = changes
+        repo.add_pending(changes)
+        self.__notify(repo)
 
-    def __future(self, repos=None, attr='url_index_v1', http_method=FuturesSessionFlex.head, hooks=None, timeout=60, **kwargs):
-        if repos is None:
-            raise AttributeError('repos missing %s'%repos)
-        if hooks is None:
-            hooks = {'response': [FuturesSessionFlex.add_hash]}
-        futures = []
-        with FuturesSessionFlex(max_workers=self.max_workers) as session:
+    def __notify(self, repo):
+        if not self.__refreshed is None and not repo.url in self.__notified:
+            self.__notified.add(repo.url)
+            self.__refreshed(repo)
+
+    @staticmethod
+    def conditional_headers(repo):
+        ''' validators stored from the last download, only used if the cache file is present and readable '''
+        headers = {}
+        if IndexCache.is_readable(repo.filename):
+            if not repo.get('etag') is None:
+                headers['If-None-Match'] = repo['etag']
+            if not repo.get('last_modified') is None:
+                headers['If-Modified-Since'] = repo['last_modified']
+        return headers
+
+    def __refresh(self, repos, attr, timeout):
+        ''' returns repos that have no index file at attr '''
+        with FuturesSessionFlex(max_workers=self.max_workers, limiter=self.limiter) as session:
+            scheduler = RetryScheduler(partial(IndexUpdate.__request, session, attr, timeout), self.retry)
             for repo in repos:
                 if not repo.auth is None or repo.verify is False:
                     thread_session = requests.Session()
                     thread_session.auth = repo.auth
                     thread_session.verify = repo.verify
                     session.map(getattr(repo, attr), thread_session)
-                request = http_method(session, getattr(repo, attr), hooks=hooks, timeout=timeout, **kwargs)
-                request.repo = repo # pass repo ref to future processing
-                futures.append(request)
-        return futures
+                scheduler.add(repo)
+            return self.__refresh_response(scheduler.completed())
+
+    @staticmethod
+    def __request(session, attr, timeout, repo):
+        hook = partial(FuturesSessionFlex.extract_jar, limiter=session.limiter)
+        request = session.get(getattr(repo, attr), hooks={'response': [hook]},
+                              headers=IndexUpdate.conditional_headers(repo), timeout=timeout, stream=True)
+        request.repo = repo # pass repo ref to future processing
+        request.request_url = getattr(repo, attr)
+        return request
 
     def __as_completed(self, futures):
-        for future in as_completed(futures):
+        for future in futures:
             repo = future.repo
             try:
                 response = future.result()
@@ -67,48 +108,77 @@ class IndexUpdate(object):
                 yield (repo, response, True)
             except requests.exceptions.HTTPError as ex:
                 if ex.response.status_code == 404: # try old index file
-                    if logging.getLogger().isEnabledFor(logging.DEBUG):
-                        LOGGER.exception()
-                    else:
-                        LOGGER.warning(str(ex))
-                    yield (repo, response, False)
+                    LOGGER.warning(str(ex))
+                    yield (repo, ex.response, False)
                 else:
-                    repo['error'] = {
-                        'code': ex.response.status_code if isinstance(ex, requests.exceptions.HTTPError) else 600,
-                        'msg':str(ex)
-                    }
-                    LOGGER.exception()
+                    repo['error'] = {'code': ex.response.status_code, 'msg': str(ex)}
+                    LOGGER.error("Error fetching index %s: %s", repo.url, str(ex))
+            except requests.exceptions.RequestException as ex:
+                repo['error'] = {'code': 600, 'msg': str(ex)}
+                LOGGER.error("Error fetching index %s: %s", repo.url, str(ex))
 
-    def __head_response(self, futures):
-        success = []
+    @staticmethod
+    def __validators(response):
+        ''' etag, last_modified and hash of a fetched index, stored once it was processed '''
+        validators = {'hash': response.content_hash}
+        for key, header in (('etag', 'ETag'), ('last_modified', 'Last-Modified')):
+            validators[key] = response.headers.get(header)
+        return validators
+
+    @staticmethod
+    def __store_validators(repo, validators):
+        for key, value in validators.items():
+            if not value is None:
+                repo[key] = value
+            elif key in repo:
+                del repo[key]
+
+    def __refresh_response(self, futures):
         notfound = []
-        for repo, response, okheader in self.__as_completed(futures):
-            if okheader:
-                # check cache
-                LOGGER.info("HEAD %s (%s) ", response.url, response.elapsed)
-                if not os.path.exists(repo.filename) or repo.hash != response.hash:
-                    if 'error' in repo:
-                        del repo['error']
-                    repo['hash'] = response.hash
-                    success.append(repo)
-                    if not os.path.exists(repo.filename):
-                        LOGGER.warning("CACHE - (miss) - %s.cache file not found!", repo.id)
-                    else:
-                        LOGGER.info("CACHE - (miss) - %s - %s)", repo.key, response.hash)
+        processing = {}
+        with IndexFileProcessor(max_workers=self.max_workers, processes=self.processes) as ifp:
+            for repo, response, found in self.__as_completed(futures):
+                if not found:
+                    notfound.append(repo)
+                    continue
+                if 'error' in repo:
+                    del repo['error']
+                if response.status_code == 304:
+                    LOGGER.info("CACHE - (hit) - %s - not modified", repo.key)
+                    self.__changed(repo, Changeset())
+                    continue
+                validators = IndexUpdate.__validators(response)
+                if repo.hash == response.content_hash and IndexCache.is_readable(repo.filename):
+                    # servers without validators, compare content instead
+                    response.index.close()
+                    LOGGER.info("CACHE - (hit) - %s - %s", repo.key, response.content_hash)
+                    IndexUpdate.__store_validators(repo, validators)
+                    self.__changed(repo, Changeset())
+                    continue
+                if not os.path.exists(repo.filename):
+                    LOGGER.warning("CACHE - (miss) - %s.cache file not found!", repo.id)
                 else:
-                    # skip do nothing for cache hits
-                    LOGGER.info("CACHE - (hit) - %s - %s)", repo.key, response.hash)
-            else:
-                notfound.append(repo)
-        return (success, notfound)
-
-    def __download_response(self, futures):
-        with IndexFileProcessor(max_workers=self.max_workers) as ifp:
-            for repo, response, success in self.__as_completed(futures):
-                if response.ok:
-                    LOGGER.info("DOWNLOADED %s [%s] (%s) ", response.url, response.elapsed, response.h_size)
-                    ifp.process(response.index, repo, repo.url, response.h_size)
-            for future in ifp.completed():
-                (index, elapsed, url, h_size) = future.result()
-                repo_name = index.get('repo', {}).get('name')
-                LOGGER.info("UPDATED %s - %s [%s] (%s) ", repo_name, url, elapsed, h_size)
+                    LOGGER.info("CACHE - (miss) - %s - %s", repo.key, response.content_hash)
+                LOGGER.info("DOWNLOADED %s [%s] (%s) ", response.url, response.elapsed, response.h_size)
+                processing[repo.url] = repo
+                ifp.process(response.index, repo, repo, response.h_size, validators)
+            peak = None
+            for (repo_name, elapsed, written, rss, changes, repo, h_size, validators) in ifp.completed():
+                del processing[repo.url]
+                # validators only describe the cache file once it was written
+                IndexUpdate.__store_validators(repo, validators)
+                LOGGER.info("UPDATED %s - %s [%s] (%s) written(%s)", repo_name, repo.url, elapsed, h_size,
+                            FuturesSessionFlex.h_size(written))
+                if not rss is None:
+                    peak = rss if peak is None else max(peak, rss)
+                if not changes is None:
+                    LOGGER.info("CHANGES %s - %s", repo.url, changes)
+                self.__changed(repo, changes)
+            if not peak is None:
+                # lifetime peak of the processes that parsed, not attributable to a single repo
+                LOGGER.info("PEAK RSS index processing %s", FuturesSessionFlex.h_size(peak))
+            for repo in processing.values():
+                # fetched again by the next run, the old validators still match the old cache file
+                repo['error'] = {'code': 600, 'msg': 'index file could not be processed'}
+                LOGGER.error("Error processing index %s, keeping the previous cache file", repo.url)
+        return notfound
@@ -2,137 +2,215 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import io
 import time
 from datetime import timedelta
+import os
 import os.path
+try:
+    from os import replace
+except ImportError:
+    from os import rename as replace
 try:
     from urllib.parse import urlparse
 except ImportError:
     from urlparse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import NamedTemporaryFile
 import yaml
+try: # libyaml bindings are an order of magnitude faster
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeLoader, SafeDumper
 from .selector import Selector
-from ..download import FuturesSessionVerifiedDownload
+from ..download.target import UMASK
 
 
 LOGGER = logging.getLogger('update.MetadataUpdate')
 class MetadataUpdate(Selector):
-    def __init__(self, config, download_timeout=600, max_workers=10):
-        super(MetadataUpdate, self).__init__(config)
+    STAGE = 'metadata'
+    CREATED = 'created'
+    UPDATED = 'updated'
+    UNCHANGED = 'unchanged'
+    # (yaml key, index key) of the fields synced to <appid>.yml
+    YAML_FIELDS = (('Categories', 'categories'), ('AuthorName', 'authorName'), ('AuthorEmail', 'authorEmail'),
+                   ('License', 'license'), ('WebSite', 'webSite'), ('SourceCode', 'sourceCode'),
+                   ('IssueTracker', 'issueTracker'), ('Changelog', 'changelog'), ('Donate', 'donate'),
+                   ('FlattrID', 'flattr'), ('LiberapayID', 'liberapay'), ('Bitcoin', 'bitcoin'),
+                   ('Litecoin', 'litecoin'), ('AntiFeatures', 'antiFeatures'))
+
+    def __init__(self, config, download_timeout=600, max_workers=10, delta=True, preload=True, **engine):
+        ''' preload=False leaves loading of app metadata to the caller, see Metadata.reload '''
+        super(MetadataUpdate, self).__init__(config, delta=delta, **engine)
         self.__config = config
         self.__download_timeout = download_timeout
         self.__max_workers = max_workers
         self.__loaded = False
-        self.__load_all()
+        self.__errors = 0
+        if preload:
+            self.__load_all()
+
+    @property
+    def errors(self):
+        ''' apps download_assets failed on so far '''
+        return int(self.__errors)
 
     def __load_all(self):
+        ''' metadata of the selected apps only, the others are never looked at '''
         if not self.__is_loaded():
-            self.__config.metadata.load_all()
+            self.__config.metadata.load_all(appids=sorted(set(appid for repo, appid in self.all_apps())))
             self.__loaded = True
 
     def __is_loaded(self):
         return self.__loaded is True
 
-    @staticmethod
-    def _setyamlattr(yaml_key, json_key, yaml_data, app_meta):
-        value = app_meta.get(json_key)
-        if not value is None:
-            yaml_data[yaml_key] = value
-
     def update_yaml(self):
-        meta = self.__config.metadata
         LOGGER.info("UPDATING YAML metadata")
         start = time.time()
-        cnt = 0
-        for repo, appid in self.all_apps():
-            try:
-                app_meta = meta[appid]
-                yaml_file = os.path.join(self.__config.metadata_dir, appid+'.yml')
-                yaml_data = {}
-                if os.path.exists(yaml_file):
-                    with open(yaml_file, 'r') as yfl:
-                        yaml_data = yaml.load(yfl, Loader=yaml.SafeLoader)
-                    if yaml_data is None:
-                        yaml_data = {}
-                MetadataUpdate._setyamlattr('Categories', 'categories', yaml_data, app_meta)
-                MetadataUpdate._setyamlattr('AuthorName', 'authorName', yaml_data, app_meta)
-                MetadataUpdate._setyamlattr('AuthorEmail', 'authorEmail', yaml_data, app_meta)
-                MetadataUpdate._setyamlattr('License', 'license', yaml_data, app_meta)
-                #self._setyamlattr('Name','name',yaml_data,app_meta)
-                MetadataUpdate._setyamlattr('WebSite', 'webSite', yaml_data, app_meta)
-                MetadataUpdate._setyamlattr('SourceCode', 'sourceCode', yaml_data, app_meta)
-                MetadataUpdate._setyamlattr('IssueTracker', 'issueTracker', yaml_data, app_meta)
-                MetadataUpdate._setyamlattr('Changelog', 'changelog', yaml_data, app_meta)
-                MetadataUpdate._setyamlattr('Donate', 'donate', yaml_data, app_meta)
-                MetadataUpdate._setyamlattr('FlattrID', 'flattr', yaml_data, app_meta)
-                MetadataUpdate._setyamlattr('LiberapayID', 'liberapay', yaml_data, app_meta)
-                MetadataUpdate._setyamlattr('Bitcoin', 'bitcoin', yaml_data, app_meta)
-                MetadataUpdate._setyamlattr('Litecoin', 'litecoin', yaml_data, app_meta)
-                MetadataUpdate._setyamlattr('AntiFeatures', 'antiFeatures', yaml_data, app_meta)
-                with open(yaml_file, 'w') as stream:
-                    yaml.safe_dump(yaml_data, stream, default_flow_style=False, encoding='utf-8', allow_unicode=True)
-                cnt += 1
-            except Exception as ex:
-                if logging.getLogger().isEnabledFor(logging.DEBUG):
-                    LOGGER.exception()
-                else:
-                    LOGGER.warning(str(ex))
+        counts = {MetadataUpdate.CREATED: 0, MetadataUpdate.UPDATED: 0, MetadataUpdate.UNCHANGED: 0, None: 0}
+        appids = [appid for repo, appid in self.all_apps()]
+        with ThreadPoolExecutor(max_workers=self.__max_workers) as executor:
+            for state in executor.map(self.write_yaml, appids):
+                counts[state] += 1
         elapsed = time.time() - start
-        LOGGER.info("UPDATED YAML metadata, %s files (%s)", cnt, timedelta(seconds=elapsed))
+        LOGGER.info("UPDATED YAML metadata, %s created, %s updated, %s unchanged, %s errors (%s)",
+                    counts[MetadataUpdate.CREATED], counts[MetadataUpdate.UPDATED], counts[MetadataUpdate.UNCHANGED],
+                    counts[None], timedelta(seconds=elapsed))
+        self.__errors += counts[None]
+
+    def write_yaml(self, appid, repos=None):
+        '''
+        sync the yaml file of appid with its metadata, the file is only replaced if a field changed.
+        returns CREATED, UPDATED, UNCHANGED or None on error
+        '''
+        try:
+            yaml_file = os.path.join(self.__config.metadata_dir, appid+'.yml')
+            exists = os.path.exists(yaml_file)
+            if self.unchanged(appid, repos=repos) and exists:
+                return MetadataUpdate.UNCHANGED
+            if not appid in self.__config.metadata:
+                return MetadataUpdate.UNCHANGED # removed from all repos, the file is kept
+            app_meta = self.__config.metadata[appid]
+            yaml_data = {}
+            if exists:
+                with open(yaml_file, 'rb') as yfl:
+                    yaml_data = yaml.load(yfl, Loader=SafeLoader)
+                if yaml_data is None:
+                    yaml_data = {}
+            changed = not exists
+            for yaml_key, json_key in MetadataUpdate.YAML_FIELDS:
+                value = app_meta.get(json_key)
+                if not value is None and yaml_data.get(yaml_key) != value:
+                    yaml_data[yaml_key] = value
+                    changed = True
+            if not changed:
+                return MetadataUpdate.UNCHANGED
+            MetadataUpdate.__dump(yaml_data, yaml_file)
+            return MetadataUpdate.UPDATED if exists else MetadataUpdate.CREATED
+        except Exception as ex:
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                LOGGER.exception("Error updating YAML metadata for %s", appid)
+            else:
+                LOGGER.warning(str(ex))
+        return None
+
+    @staticmethod
+    def __dump(yaml_data, yaml_file):
+        ''' write to a temp file next to yaml_file and move it into place '''
+        folder = os.path.dirname(os.path.abspath(yaml_file))
+        with NamedTemporaryFile(mode='wb', dir=folder, prefix='.', suffix='.tmp', delete=False) as tmp:
+            yaml.dump(yaml_data, tmp, Dumper=SafeDumper, default_flow_style=False, encoding='utf-8', allow_unicode=True)
+        os.chmod(tmp.name, 0o666 & ~UMASK)
+        replace(tmp.name, yaml_file)
 
     @staticmethod
     def __write_text(text, filename, foldername):
         if not text is None:
-            text = text.encode('utf-8')
             if not os.path.exists(foldername):
                 os.makedirs(foldername)
-            with open(os.path.join(foldername, filename), "w") as text_file:
+            with io.open(os.path.join(foldername, filename), "w", encoding='utf-8') as text_file:
                 text_file.write(text)
 
-    def __download_image(self, url, filename, session):
-        if not url is None:
-            session.download(url, filename, timeout=self.__download_timeout)
+    def __download_image(self, url, filename, session, scheduled):
+        ''' images go to the BlobStore, urls downloaded by an earlier run are revalidated with a conditional GET '''
+        if not url is None and not (url, filename) in scheduled:
+            scheduled.add((url, filename))
+            session.download(url, filename, timeout=self.__download_timeout, blobs=self.__config.blobs)
 
-    def __download_images(self, urls, foldername, session):
+    def __download_images(self, urls, foldername, session, scheduled):
         for url in urls:
             filename = os.path.basename(urlparse(url).path)
             filename = os.path.join(foldername, filename)
-            self.__download_image(url, filename, session)
+            self.__download_image(url, filename, session, scheduled)
 
     def update_assets(self):
-        meta = self.__config.metadata
         LOGGER.info("UPDATING Assets metadata")
         start = time.time()
         cnt = 0
         ecnt = 0
-        with FuturesSessionVerifiedDownload(max_workers=self.__max_workers) as session:
+        skipcnt = 0
+        retries = self.retries()
+        transferred = self.transferred()
+        blobs = self.blob_counts()
+        with self.download_session(max_workers=self.__max_workers) as session:
             for repo, appid in self.all_apps(session=session):
-                try:
-                    loc_appid = os.path.join(self.__config.metadata_dir, appid)
-                    app_meta = meta[appid]
-                    for locale in app_meta.locales:
-                        loc_path = os.path.join(loc_appid, locale)
-                        imags_path = os.path.join(loc_path, 'images')
-                        # TODO: chech if we need to download really all images & clean folder before/after?
-                        MetadataUpdate.__write_text(app_meta.full_description(locale), 'full_description.txt', loc_path)
-                        MetadataUpdate.__write_text(app_meta.short_description(locale), 'short_description.txt', loc_path)
-                        MetadataUpdate.__write_text(app_meta.title(locale), 'title.txt', loc_path)
-
-                        self.__download_image(app_meta.icon(locale), os.path.join(imags_path, 'icon.png'), session)
-                        self.__download_image(app_meta.feature_graphic(locale), os.path.join(imags_path, 'featureGraphic.png'), session)
-                        self.__download_image(app_meta.promo_graphic(locale), os.path.join(imags_path, 'promoGraphic.png'), session)
-                        self.__download_image(app_meta.tv_banner(locale), os.path.join(imags_path, 'tvBanner.png'), session)
-
-                        self.__download_images(app_meta.phone_screenshots(locale), os.path.join(loc_path, 'phoneScreenshots'), session)
-                        self.__download_images(app_meta.seven_inch_screenshots(locale), os.path.join(loc_path, 'sevenInchScreenshots'), session)
-                        self.__download_images(app_meta.ten_inch_screenshots(locale), os.path.join(loc_path, 'tenInchScreenshots'), session)
-                        self.__download_images(app_meta.tv_screenshots(locale), os.path.join(loc_path, 'tvScreenshots'), session)
-                        self.__download_images(app_meta.wear_screenshots(locale), os.path.join(loc_path, 'wearScreenshots'), session)
-                except Exception:
-                    LOGGER.exception("Error processing Asset download for %s", appid)
+                if self.download_assets(appid, session) is False:
+                    skipcnt += 1
             for success, filename, bts, hbts, elapsed in session.completed():
                 if success:
                     cnt += 1
                 else:
                     ecnt += 1
         elapsed = time.time() - start
-        LOGGER.info("UPDATED Assets metadata, %s files, %s errors (%s)", cnt, ecnt, timedelta(seconds=elapsed))
+        LOGGER.info("UPDATED Assets metadata, %s files, %s errors, %s retries, %s apps unchanged (%s)", cnt, ecnt, self.retries() - retries, skipcnt, timedelta(seconds=elapsed))
+        if ecnt == 0 and self.__errors == 0:
+            self.applied()
+        self.report_blobs(blobs)
+        self.report_throughput('Assets metadata', self.transferred() - transferred, elapsed)
+
+    def blob_counts(self):
+        ''' (stored, deduped, revalidated) counters of the BlobStore '''
+        blobs = self.__config.blobs
+        return (blobs.stored, blobs.deduped, blobs.revalidated)
+
+    def report_blobs(self, since=(0, 0, 0)):
+        ''' log what the BlobStore saved since an earlier blob_counts() '''
+        (stored, deduped, revalidated) = [now - before for now, before in zip(self.blob_counts(), since)]
+        LOGGER.info("BLOBS Assets metadata, %s stored, %s duplicates linked, %s not modified",
+                    stored, deduped, revalidated)
+
+    def download_assets(self, appid, session, repos=None, scheduled=None):
+        '''
+        write texts of appid and queue its images with session, False if the app is unchanged.
+        files in scheduled are not queued again, queued files are added to it.
+        '''
+        loc_appid = os.path.join(self.__config.metadata_dir, appid)
+        if self.unchanged(appid, repos=repos) and os.path.isdir(loc_appid):
+            return False
+        if not appid in self.__config.metadata:
+            return False # removed from all repos
+        scheduled = set() if scheduled is None else scheduled
+        try:
+            app_meta = self.__config.metadata[appid]
+            for locale in app_meta.locales:
+                loc_path = os.path.join(loc_appid, locale)
+                imags_path = os.path.join(loc_path, 'images')
+                # TODO: chech if we need to download really all images & clean folder before/after?
+                MetadataUpdate.__write_text(app_meta.full_description(locale), 'full_description.txt', loc_path)
+                MetadataUpdate.__write_text(app_meta.short_description(locale), 'short_description.txt', loc_path)
+                MetadataUpdate.__write_text(app_meta.title(locale), 'title.txt', loc_path)
+
+                self.__download_image(app_meta.icon(locale), os.path.join(imags_path, 'icon.png'), session, scheduled)
+                self.__download_image(app_meta.feature_graphic(locale), os.path.join(imags_path, 'featureGraphic.png'), session, scheduled)
+                self.__download_image(app_meta.promo_graphic(locale), os.path.join(imags_path, 'promoGraphic.png'), session, scheduled)
+                self.__download_image(app_meta.tv_banner(locale), os.path.join(imags_path, 'tvBanner.png'), session, scheduled)
+
+                self.__download_images(app_meta.phone_screenshots(locale), os.path.join(loc_path, 'phoneScreenshots'), session, scheduled)
+                self.__download_images(app_meta.seven_inch_screenshots(locale), os.path.join(loc_path, 'sevenInchScreenshots'), session, scheduled)
+                self.__download_images(app_meta.ten_inch_screenshots(locale), os.path.join(loc_path, 'tenInchScreenshots'), session, scheduled)
+                self.__download_images(app_meta.tv_screenshots(locale), os.path.join(loc_path, 'tvScreenshots'), session, scheduled)
+                self.__download_images(app_meta.wear_screenshots(locale), os.path.join(loc_path, 'wearScreenshots'), session, scheduled)
+        except Exception:
+            self.__errors += 1
+            LOGGER.exception("Error processing Asset download for %s", appid)
+        return True
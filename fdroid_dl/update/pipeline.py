@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import time
+import os.path
+from datetime import timedelta
+from .selector import Selector
+from .metadata import MetadataUpdate
+from ..processor import HashVerifier
+
+
+LOGGER = logging.getLogger('update.Pipeline')
+class Pipeline(Selector):
+    """
+    Runs the index, metadata, apk and src updates as one stream.
+
+    As soon as the index of a repo is refreshed its selected apps get their
+    YAML file written and their assets, apk and src files queued with a single
+    download session, so all downloads share one worker budget and nothing
+    waits for the slowest repo of an earlier stage. Repos are handed on in
+    config order, a repo refreshed early waits for the ones before it, so
+    the first repo of an app wins just like in the stages. Apps found in
+    more than one repo are processed again whenever another of those repos
+    arrives and files already queued are not queued twice.
+    """
+
+    def __init__(self, config, index=None, metadata=None, apk=None, src=None, max_workers=10, hash_workers=None,
+                 delta=True, **engine):
+        super(Pipeline, self).__init__(config, delta=delta, **engine)
+        self.__config = config
+        self.__index = index
+        self.__metadata = metadata
+        self.__packages = [stage for stage in (apk, src) if not stage is None]
+        self.__max_workers = max_workers
+        self.__hash_workers = hash_workers
+        self.__session = None
+        self.__verifier = None
+        self.__refreshed = set()
+        self.__released = 0
+        self.__order = []
+        self.__selection = {}
+        self.__selected = set()
+        self.__scheduled = set()
+        self.__counts = {}
+
+    def run(self, connect_timeout=10, timeout=60):
+        ''' refresh indices and stream apps into the metadata, apk and src updates '''
+        LOGGER.info("STARTING update pipeline")
+        start = time.time()
+        retries = self.retries()
+        transferred = self.transferred()
+        self.__refreshed = set()
+        self.__released = 0
+        self.__order = list(self.__config.repos)
+        self.__selection = {}
+        self.__selected = set()
+        self.__scheduled = set()
+        self.__counts = {'yaml': {}, 'assets_unchanged': set(), 'assets': 0, 'errors': 0,
+                         'asset_errors': 0, 'skipped': dict((stage.FILES, {}) for stage in self.__packages)}
+        blobs = None if self.__metadata is None else self.__metadata.blob_counts()
+        for stage in self.__packages:
+            stage.begin()
+        with self.download_session(max_workers=self.__max_workers) as session, \
+                HashVerifier(max_workers=self.__hash_workers) as verifier:
+            self.__session = session
+            self.__verifier = verifier
+            if not self.__index is None:
+                self.__index.refresh(self.__order, connect_timeout=connect_timeout, timeout=timeout,
+                                     refreshed=self.__feed)
+            else:
+                for repo in list(self.__order):
+                    self.__feed(repo)
+            for stage in self.__packages:
+                stage.verified(verifier, session)
+            for success, filename, dbytes, hbytes, elapsed in session.completed():
+                if any(stage.downloaded(success, filename, dbytes) for stage in self.__packages):
+                    continue
+                if success:
+                    self.__counts['assets'] += 1
+                else:
+                    self.__counts['asset_errors'] += 1
+            self.__session = None
+            self.__verifier = None
+        self.__summary(blobs)
+        elapsed = time.time() - start
+        LOGGER.info("FINISHED update pipeline, retries(%s) (%s)", self.retries() - retries, timedelta(seconds=elapsed))
+        self.report_throughput('update pipeline', self.transferred() - transferred, elapsed)
+
+    def __summary(self, blobs):
+        counts = self.__counts
+        if not self.__metadata is None:
+            states = list(counts['yaml'].values())
+            LOGGER.info("UPDATED YAML metadata, %s created, %s updated, %s unchanged, %s errors",
+                        states.count(MetadataUpdate.CREATED), states.count(MetadataUpdate.UPDATED),
+                        states.count(MetadataUpdate.UNCHANGED), states.count(None))
+            LOGGER.info("UPDATED Assets metadata, %s files, %s errors, %s apps unchanged", counts['assets'],
+                        counts['asset_errors'], len(counts['assets_unchanged']))
+            self.__metadata.report_blobs(blobs)
+            if counts['errors'] == 0 and states.count(None) == 0 and counts['asset_errors'] == 0 and \
+                    self.__metadata.errors == 0:
+                self.__metadata.applied()
+        for stage in self.__packages:
+            skipped = sum(counts['skipped'][stage.FILES].values())
+            if skipped > 0:
+                LOGGER.info("skipped (%s) %s of unchanged apps", skipped, stage.FILES)
+            stage.end(report=False, complete=counts['errors'] == 0)
+
+    def __repos(self):
+        ''' released repos in config order '''
+        return self.__order[:self.__released]
+
+    def __feed(self, repo):
+        ''' called for every refreshed repo, releases all repos whose predecessors are refreshed too '''
+        self.__refreshed.add(repo.url)
+        while self.__released < len(self.__order) and self.__order[self.__released].url in self.__refreshed:
+            self.__released += 1
+            self.__release(self.__order[self.__released - 1])
+
+    def __release(self, repo):
+        ''' queues the work for the apps of repo '''
+        if 'error' in repo or repo.index is None:
+            return
+        Selector.apply_session_settings(repo, self.__session)
+        selection = set(self.selected(repo))
+        self.__selection[repo.url] = selection
+        index = repo.index
+        # apps selected by earlier repos this repo adds metadata or packages to
+        appids = selection | set(appid for appid in self.__selected if index.has_app(appid))
+        self.__selected.update(selection)
+        LOGGER.info("QUEUING %s apps of %s", len(appids), repo.url)
+        repos = self.__repos()
+        valid = [repo for repo in repos if not 'error' in repo]
+        indices = [repo.index for repo in repos if os.path.exists(repo.filename)]
+        indices = [index for index in indices if not index is None]
+        for appid in sorted(appids):
+            try:
+                self.__process(appid, valid, indices)
+            except Exception:
+                self.__counts['errors'] += 1
+                LOGGER.exception("Error processing %s", appid)
+
+    def __process(self, appid, valid, indices):
+        ''' valid: refreshed repos without error, indices: all indices loaded so far, both in config order '''
+        if not self.__metadata is None:
+            self.__config.metadata.reload(appid, indices)
+            state = self.__metadata.write_yaml(appid, repos=valid)
+            # an app written by an earlier repo keeps that state
+            if self.__counts['yaml'].get(appid, MetadataUpdate.UNCHANGED) == MetadataUpdate.UNCHANGED:
+                self.__counts['yaml'][appid] = state
+            if self.__metadata.download_assets(appid, self.__session, repos=valid, scheduled=self.__scheduled) is False:
+                self.__counts['assets_unchanged'].add(appid)
+            else:
+                self.__counts['assets_unchanged'].discard(appid)
+        for stage in self.__packages:
+            packages = []
+            for repo in valid:
+                if appid in self.__selection.get(repo.url, ()):
+                    packages = stage.newest(packages, stage.candidates(repo, appid))
+            (packages, skipped) = stage.select_packages(appid, packages, repos=valid)
+            self.__counts['skipped'][stage.FILES][appid] = skipped
+            for url, filename, fhash, hash_type in packages:
+                stage.schedule(url, filename, fhash, hash_type, self.__session, self.__verifier)
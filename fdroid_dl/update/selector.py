@@ -2,13 +2,47 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import os.path
 import requests
+from ..download import download_session
 
 
 LOGGER = logging.getLogger('update.Selector')
 class Selector(object):
-    def __init__(self, config):
+    STAGE = None # name the pending changes of this stage are kept under
+
+    def __init__(self, config, delta=True, engine='thread', max_per_host=8, http2=False, retry=None, mirrors=None, limiter=None):
         self.__config = config
+        self.__delta = delta
+        self.__engine = engine
+        self.__max_per_host = max_per_host
+        self.__http2 = http2
+        self.__retry = retry
+        self.__mirrors = mirrors
+        self.__limiter = limiter
+
+    def download_session(self, max_workers=10):
+        ''' download session of the configured engine '''
+        return download_session(self.__engine, max_workers=max_workers, max_per_host=self.__max_per_host,
+                                http2=self.__http2, retry=self.__retry, mirrors=self.__mirrors,
+                                limiter=self.__limiter)
+
+    def retries(self):
+        ''' retries scheduled by the RetryPolicy so far '''
+        if self.__retry is None:
+            return 0
+        return self.__retry.retries
+
+    def transferred(self):
+        ''' bytes read through the RateLimiter so far '''
+        if self.__limiter is None:
+            return 0
+        return self.__limiter.bytes
+
+    def report_throughput(self, stage, nbytes, elapsed):
+        ''' achieved against configured throughput, only if a RateLimiter is used '''
+        if not self.__limiter is None:
+            self.__limiter.report(stage, nbytes, elapsed)
 
     def __meta_repos(self):
         for repo in self.__config.repos:
@@ -19,19 +53,57 @@ class Selector(object):
         yielded = set()
         for repo in self.__meta_repos():
             Selector.apply_session_settings(repo, session)
-            for selector in repo.apps:
-                if not repo.index is None:
-                    for appid in repo.index.find_appids(selector):
-                        if not appid in yielded or dupes:
-                            yielded.add(appid)
-                            yield (repo, appid)
+            for appid in self.selected(repo):
+                if not appid in yielded or dupes:
+                    yielded.add(appid)
+                    yield (repo, appid)
+
+    def selected(self, repo):
+        ''' appids of repo selected by its config, empty for repos with download error '''
+        index = repo.index if not 'error' in repo else None
+        if index is None:
+            return []
+        return index.select(list(repo.apps))
+
+    def unchanged(self, appid, packages=False, repos=None):
+        '''
+        True if no index refresh since this stage last completed found a
+        change for appid, packages=True checks its package list instead of
+        its metadata. repos limits the check to the given repos, e.g. the
+        ones refreshed so far
+        '''
+        if not self.__delta:
+            return False
+        for repo in self.__meta_repos() if repos is None else repos:
+            changes = repo.pending(self.STAGE)
+            if changes is None:
+                return False # stage never completed, check everything
+            if packages and changes.packages_changed(appid):
+                return False
+            # an app removed from one repo may still get metadata from another
+            if not packages and (changes.app_changed(appid) or changes.app_removed(appid)):
+                return False
+        return True
+
+    def applied(self):
+        ''' call once this stage completed without errors, it has applied all pending changes '''
+        if self.STAGE is None:
+            return
+        for repo in self.__meta_repos():
+            if os.path.exists(repo.filename):
+                repo.clear_pending(self.STAGE)
 
     @staticmethod
     def apply_session_settings(repo, session):
-        ''' apply security settings for basic auth and ssl verification '''
+        '''
+        apply security settings for basic auth and ssl verification,
+        mirrors are only used for public repos, credentials stay with the repo url
+        '''
         if not session is None:
             if not repo.auth is None or repo.verify is False:
                 thread_session = requests.Session()
                 thread_session.auth = repo.auth
                 thread_session.verify = repo.verify
                 session.map(repo.url, thread_session)
+            elif not getattr(session, 'mirrors', None) is None:
+                session.mirrors.add(repo.url, repo.mirrors)
@@ -2,14 +2,30 @@
 # -*- coding: utf-8 -*-
 
 import logging
+from .apk import ApkUpdate
 
 
 LOGGER = logging.getLogger('update.SrcUpdate')
-class SrcUpdate(object):
-    def __init__(self, config, download_timeout=600, max_workers=10):
-        self.__config = config
-        self.__download_timeout = download_timeout
-        self.__max_workers = max_workers
-
-    def update(self):
-        pass
+class SrcUpdate(ApkUpdate):
+    '''
+    Mirrors the source tarballs (srcname) of the packages ApkUpdate selects.
+
+    Same download path and version limit as the apk files, repos can opt
+    out with "src_download": false. Tarballs are deduplicated by file name
+    only, the first repo offering a name wins. The index carries no hash
+    for sources, so a tarball is accepted once exactly the bytes announced
+    by Content-Length/Content-Range were received. Short transfers are
+    kept and resumed, existing tarballs are never touched again.
+    '''
+    STAGE = 'src'
+    FILES = 'src files'
+    URL = 'srcname'
+
+    def candidates(self, repo, appid):
+        ''' PackageRecords of appid in repo that have a source tarball '''
+        if not repo.src_download:
+            return []
+        return [self.record(pkg) for pkg in repo.index.packages(appid) if not pkg.get('srcname') is None]
+
+    def checksum(self, pkg):
+        return (None, None)
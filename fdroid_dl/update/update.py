@@ -2,31 +2,65 @@
 # -*- coding: utf-8 -*-
 
 import logging
+from ..download import RetryPolicy, MirrorPool, RateLimiter
 from .index import IndexUpdate
 from .metadata import MetadataUpdate
 from .apk import ApkUpdate
 from .src import SrcUpdate
+from .pipeline import Pipeline
 
 LOGGER = logging.getLogger('update.Update')
 class Update(object):
     ''' handels downloading of repo related data '''
-    def __init__(self, config, max_workers=10, head_timeout=10, index_timeout=60, download_timeout=60):
+    def __init__(self, config, max_workers=10, head_timeout=10, index_timeout=60, download_timeout=60, index_processes=False, delta=True, reverify=False,
+                 engine='thread', max_per_host=8, http2=False, retries=3, retry_backoff=1.0, retry_budget=50, mirrors=False,
+                 rate=None, rate_per_host=None, rate_profiles=None):
         self.__config = config
         self.__head_timeout = head_timeout
         self.__index_timeout = index_timeout
         self.__download_timeout = download_timeout
         self.__max_workers = max_workers
-        self.__index = IndexUpdate(config, head_timeout=head_timeout, index_timeout=index_timeout, max_workers=max_workers)
+        self.__delta = delta
+        self.__retry = RetryPolicy(retries=retries, backoff=retry_backoff, host_budget=retry_budget)
+        self.__mirrors = MirrorPool() if mirrors else None
+        self.__limiter = None
+        if not rate is None or not rate_per_host is None or rate_profiles:
+            self.__limiter = RateLimiter(rate=rate, per_host=rate_per_host, profiles=rate_profiles)
+        self.__engine = {'engine': engine, 'max_per_host': max_per_host, 'http2': http2, 'retry': self.__retry,
+                         'mirrors': self.__mirrors, 'limiter': self.__limiter}
+        self.__index = IndexUpdate(config, head_timeout=head_timeout, index_timeout=index_timeout, max_workers=max_workers, processes=index_processes,
+                                   retry=self.__retry, limiter=self.__limiter)
         self.__meta = None
-        self.__apk = ApkUpdate(config, download_timeout=download_timeout, max_workers=max_workers)
-        self.__src = SrcUpdate(config, download_timeout=download_timeout, max_workers=max_workers)
+        self.__apk = ApkUpdate(config, download_timeout=download_timeout, max_workers=max_workers, delta=delta, reverify=reverify, **self.__engine)
+        self.__src = SrcUpdate(config, download_timeout=download_timeout, max_workers=max_workers, delta=delta, **self.__engine)
+
+    @property
+    def retry(self):
+        ''' RetryPolicy shared by all stages, holds the retry counters of the run '''
+        return self.__retry
+
+    @property
+    def mirrors(self):
+        ''' MirrorPool shared by all stages, None if mirrors are not used '''
+        return self.__mirrors
+
+    def pipeline(self, index=True, metadata=True, apk=True, src=True):
+        ''' run the selected stages as one stream, see Pipeline '''
+        meta = None
+        if metadata:
+            meta = MetadataUpdate(self.__config, download_timeout=self.__download_timeout, max_workers=self.__max_workers, delta=self.__delta,
+                                  preload=False, **self.__engine)
+        pipeline = Pipeline(self.__config, index=self.__index if index else None, metadata=meta, apk=self.__apk if apk else None,
+                            src=self.__src if src else None, max_workers=self.__max_workers, delta=self.__delta, **self.__engine)
+        pipeline.run(connect_timeout=self.__head_timeout, timeout=self.__index_timeout)
+        return self
 
     def index(self):
-        self.__index.download(*self.__index.required(self.__config.repos, timeout=self.__head_timeout), timeout=self.__index_timeout)
+        self.__index.refresh(self.__config.repos, connect_timeout=self.__head_timeout, timeout=self.__index_timeout)
         return self
 
     def metadata(self):
-        self.__meta = MetadataUpdate(self.__config, download_timeout=self.__download_timeout, max_workers=self.__max_workers)
+        self.__meta = MetadataUpdate(self.__config, download_timeout=self.__download_timeout, max_workers=self.__max_workers, delta=self.__delta, **self.__engine)
         self.__meta.update_yaml()
         self.__meta.update_assets()
         return self
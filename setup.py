@@ -23,6 +23,10 @@ setuptools.setup(
         'PyYAML>=3.13',
         'click>=6.7'
     ],
+    extras_require={
+        'async': ['httpx>=0.20; python_version>="3.6"'],
+        'http2': ['httpx[http2]>=0.20; python_version>="3.6"']
+    },
     python_requires='>=2.7, !=3.0.*, !=3.1.*, !=3.2.*, !=3.3.*, <4',
     classifiers=(
         "Development Status :: 2 - Pre-Alpha",
@@ -0,0 +1,86 @@
+from __future__ import unicode_literals
+
+# Allow direct execution
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import unittest
+from fdroid_dl.model import PackageRecord
+from fdroid_dl.update import ApkUpdate, SrcUpdate
+
+
+class Config(object):
+    apk_versions = 2
+    repo_dir = './repo'
+
+
+class Repo(object):
+    ''' repo and index in one, packages are the same for every app '''
+    def __init__(self, packages, src_download=True):
+        self.src_download = src_download
+        self.index = self
+        self.__packages = packages
+
+    def packages(self, appid):
+        return self.__packages
+
+
+class Session(object):
+    def __init__(self):
+        self.downloads = []
+
+    def download(self, url, filename, **kwargs):
+        self.downloads.append((url, filename))
+
+
+class ApkUpdateTestSuite(unittest.TestCase):
+
+    def package(self, version_code, repo='one'):
+        return {'apkName': 'app_%s.apk' % version_code, 'hash': repo, 'hashType': 'sha256', 'versionCode': version_code,
+                'size': 1, 'sig': 'x' * 32, 'permissions': ['INTERNET']}
+
+    def test_newest(self):
+        apk = ApkUpdate(Config(), delta=False)
+        first = [apk.record(self.package(code)) for code in (3, 1, 5, 2)]
+        second = [apk.record(self.package(code, repo='two')) for code in (4, 5)]
+        kept = apk.newest(first)
+        self.assertEqual([pkg.version_code for pkg in kept], [5, 3])
+        self.assertTrue(all(isinstance(pkg, PackageRecord) for pkg in kept))
+        # equal versionCodes, the package given first wins
+        kept = apk.newest(kept, second)
+        self.assertEqual([(pkg.version_code, pkg.hash) for pkg in kept], [(5, 'one'), (5, 'two')])
+        (selected, skipped) = apk.select_packages('app', kept)
+        self.assertEqual(selected[0], ('app_5.apk', os.path.join('./repo', 'app_5.apk'), 'one', 'sha256'))
+        self.assertEqual(skipped, 0)
+
+    def test_record(self):
+        record = ApkUpdate(Config()).record(self.package(7))
+        self.assertFalse(hasattr(record, '__dict__'))
+        self.assertEqual((record.url, record.hash, record.hash_type, record.version_code, record.size),
+                         ('app_7.apk', 'one', 'sha256', 7, 1))
+
+
+class SrcUpdateTestSuite(unittest.TestCase):
+
+    def package(self, version_code, repo):
+        return {'apkName': 'app_%s.apk' % version_code, 'hash': repo, 'hashType': 'sha256', 'versionCode': version_code,
+                'srcname': 'https://%s.example.org/repo/app_%s_src.tar.gz' % (repo, version_code)}
+
+    def test_candidates(self):
+        src = SrcUpdate(Config(), delta=False)
+        one = Repo([self.package(2, 'one'), {'apkName': 'app_1.apk', 'hash': 'one', 'hashType': 'sha256', 'versionCode': 1}])
+        two = Repo([self.package(2, 'two')])
+        self.assertEqual(src.candidates(Repo([self.package(2, 'one')], src_download=False), 'app'), [])
+        # packages without srcname are dropped, sources have no hash to verify against
+        first = src.candidates(one, 'app')
+        self.assertEqual([(pkg.url, pkg.hash, pkg.version_code) for pkg in first],
+                         [('https://one.example.org/repo/app_2_src.tar.gz', None, 2)])
+        # the same file name from a second repo is downloaded once, from the first repo
+        (selected, skipped) = src.select_packages('app', src.newest(first, src.candidates(two, 'app')))
+        self.assertEqual(len(selected), 2)
+        session = Session()
+        src.begin()
+        for url, filename, fhash, hash_type in selected:
+            src.schedule(url, filename, fhash, hash_type, session, None)
+        self.assertEqual(session.downloads, [('https://one.example.org/repo/app_2_src.tar.gz',
+                                              os.path.join('./repo', 'app_2_src.tar.gz'))])
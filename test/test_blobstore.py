@@ -0,0 +1,63 @@
+from __future__ import unicode_literals
+
+# Allow direct execution
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import hashlib
+import shutil
+import tempfile
+import unittest
+from fdroid_dl.model import BlobStore
+from fdroid_dl.download import DownloadTarget
+
+URL = 'https://example.com/repo/app/en-US/icon.png'
+
+
+class BlobStoreTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.folder = os.path.join(self.tmp, 'blobs')
+        self.data = b'icon'
+        self.digest = hashlib.sha256(self.data).hexdigest()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def download(self, blobs, filename, url=URL, headers=None):
+        target = DownloadTarget(filename, url=url, blobs=blobs)
+        with target.open(200, headers):
+            target.write(self.data)
+            return target.finish()
+
+    def test_dedup(self):
+        en = os.path.join(self.tmp, 'en-US', 'icon.png')
+        de = os.path.join(self.tmp, 'de', 'icon.png')
+        with BlobStore(self.folder) as blobs:
+            self.assertTrue(self.download(blobs, en))
+            self.assertTrue(self.download(blobs, de, url=URL.replace('en-US', 'de')))
+            self.assertEqual(blobs.stored, 1)
+            self.assertEqual(blobs.deduped, 1)
+        self.assertTrue(os.path.samefile(en, de))
+        self.assertTrue(os.path.samefile(en, blobs.path(self.digest)))
+        with open(de, 'rb') as file:
+            self.assertEqual(file.read(), self.data)
+
+    def test_conditional(self):
+        filename = os.path.join(self.tmp, 'en-US', 'icon.png')
+        with BlobStore(self.folder) as blobs:
+            self.assertEqual(DownloadTarget(filename, url=URL, blobs=blobs).request_headers(), {})
+            self.download(blobs, filename, headers={'ETag': '"abc"', 'Last-Modified': 'Mon, 01 Jan 2018 00:00:00 GMT'})
+        os.remove(filename)
+        blobs = BlobStore(self.folder).load()
+        self.assertEqual(blobs.digest(URL), self.digest)
+        target = DownloadTarget(filename, url=URL, blobs=blobs)
+        self.assertEqual(target.request_headers(), {'If-None-Match': '"abc"',
+                                                    'If-Modified-Since': 'Mon, 01 Jan 2018 00:00:00 GMT'})
+        self.assertTrue(target.unmodified())
+        self.assertEqual(blobs.revalidated, 1)
+        self.assertTrue(os.path.samefile(filename, blobs.path(self.digest)))
+        os.remove(blobs.path(self.digest))
+        self.assertEqual(target.request_headers(), {})
+        self.assertFalse(target.unmodified())
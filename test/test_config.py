@@ -1,6 +1,8 @@
 import os
+import shutil
+import tempfile
 import unittest
-from fdroid_dl.model import Config
+from fdroid_dl.model import Config, RepoConfig, Changeset
 try:
     from unittest.mock import patch
 except ImportError:
@@ -29,3 +31,40 @@ class ConfigTestSuite(unittest.TestCase):
                              [x for x in iter(Config.DEFAULTS)])
             assert not save.called
         assert save.called
+
+    @patch('os.makedirs')
+    @patch('os.path.exists')
+    @patch.object(Config, 'save')
+    def test_repos(self, save, exists, makedirs):
+        exists.return_value = False
+        with Config() as c:
+            repos = list(c.repos)
+            self.assertTrue(len(repos) > 0)
+            for first, second in zip(repos, c.repos):
+                self.assertIs(first, second)
+                self.assertTrue(first.src_download)
+                self.assertTrue(first.metadata_download)
+
+    def test_pending(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            with Config(filename=os.path.join(tmp, 'fdroid-dl.json'), repo_dir=os.path.join(tmp, 'repo'),
+                        metadata_dir=os.path.join(tmp, 'metadata'), cache_dir=os.path.join(tmp, 'cache')) as c:
+                repo = list(c.repos)[0]
+                self.assertIsNone(repo.pending('metadata'))
+                repo.clear_pending('metadata')
+                changes = Changeset()
+                changes.changed.add('org.example.one')
+                repo.add_pending(changes)
+                repo.add_pending(Changeset())
+                self.assertTrue(repo.pending('metadata').app_changed('org.example.one'))
+                self.assertIsNone(repo.pending('apk'))
+                # a new RepoConfig reads what was saved
+                repo = RepoConfig(repo.url, {}, c)
+                self.assertTrue(repo.pending('metadata').app_changed('org.example.one'))
+                repo.clear_pending('metadata')
+                self.assertEqual(len(repo.pending('metadata')), 0)
+                repo.add_pending(None)
+                self.assertIsNone(repo.pending('metadata'))
+        finally:
+            shutil.rmtree(tmp)
@@ -0,0 +1,273 @@
+from __future__ import unicode_literals
+
+# Allow direct execution
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import hashlib
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import requests_mock
+from fdroid_dl.download import FuturesSessionFlex, FuturesSessionVerifiedDownload, DownloadTarget, IncompleteDownload, \
+    HostScheduler, MirrorPool, RateLimiter, TokenBucket, RetryPolicy, download_session, engine_error
+
+URL = 'https://example.org/repo/app.apk'
+BODY = b'apk' * 50000
+
+
+class VerifiedDownloadTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmp, 'repo', 'app.apk')
+        self.session = requests.Session()
+        adapter = requests_mock.Adapter()
+        adapter.register_uri('GET', URL, content=BODY)
+        self.session.mount('https://', adapter)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_store(self):
+        response = self.session.get(URL, stream=True)
+        digest = hashlib.sha256(BODY).hexdigest()
+        target = DownloadTarget(self.filename, 'sha256', digest)
+        self.assertEqual(FuturesSessionVerifiedDownload.store(response, target), (True, len(BODY)))
+        with open(self.filename, 'rb') as file:
+            self.assertEqual(file.read(), BODY)
+        self.assertEqual(os.listdir(os.path.dirname(self.filename)), ['app.apk'])
+
+    def test_store_hash_mismatch(self):
+        response = self.session.get(URL, stream=True)
+        target = DownloadTarget(self.filename, 'sha256', 'abc')
+        self.assertEqual(FuturesSessionVerifiedDownload.store(response, target), (False, len(BODY)))
+        self.assertEqual(os.listdir(os.path.dirname(self.filename)), [])
+
+    def test_store_truncated(self):
+        target = DownloadTarget(self.filename, url=URL, resumable=True)
+        with self.assertRaises(IncompleteDownload):
+            with target.open(200, {'ETag': '"v1"', 'Content-Length': str(len(BODY))}):
+                target.write(BODY[:1000])
+                target.finish()
+        self.assertFalse(os.path.exists(self.filename))
+        self.assertEqual(os.path.getsize(target.part), 1000)
+        self.assertTrue(RetryPolicy().retryable(IncompleteDownload()))
+
+    def test_resume(self):
+        def ranged(request, context):
+            if request.headers.get('If-Range') == '"v1"' and 'Range' in request.headers:
+                offset = int(request.headers['Range'][6:-1])
+                context.status_code = 206
+                return BODY[offset:]
+            return BODY
+        adapter = requests_mock.Adapter()
+        adapter.register_uri('GET', URL, content=ranged, headers={'ETag': '"v1"'})
+        self.session.mount('https://', adapter)
+        digest = hashlib.sha256(BODY).hexdigest()
+        # first attempt breaks off after 1000 bytes
+        target = DownloadTarget(self.filename, 'sha256', digest, url=URL, resumable=True)
+        try:
+            with target.open(200, {'ETag': '"v1"'}):
+                target.write(BODY[:1000])
+                raise IOError('connection reset')
+        except IOError:
+            pass
+        self.assertEqual(os.path.getsize(target.part), 1000)
+        target = DownloadTarget(self.filename, 'sha256', digest, url=URL, resumable=True)
+        headers = target.resume_headers()
+        self.assertEqual(headers, {'Range': 'bytes=1000-', 'If-Range': '"v1"'})
+        response = self.session.get(URL, stream=True, headers=headers)
+        self.assertEqual(FuturesSessionVerifiedDownload.store(response, target), (True, len(BODY) - 1000))
+        self.assertEqual(target.resumed, 1000)
+        with open(self.filename, 'rb') as file:
+            self.assertEqual(file.read(), BODY)
+        self.assertEqual(os.listdir(os.path.dirname(self.filename)), ['app.apk'])
+
+    def test_resume_refused(self):
+        def ranged(request, context):
+            if 'Range' in request.headers:
+                context.status_code = 416
+                return b''
+            return BODY
+        adapter = requests_mock.Adapter()
+        adapter.register_uri('GET', URL, content=ranged, headers={'ETag': '"v2"'})
+        target = DownloadTarget(self.filename, url=URL, resumable=True)
+        try:
+            with target.open(200, {'ETag': '"v1"'}):
+                target.write(b'old' * 100000)
+                raise IOError('connection reset')
+        except IOError:
+            pass
+        with FuturesSessionVerifiedDownload(max_workers=2) as session:
+            session.mount('https://', adapter)
+            session.download(URL, self.filename, resume=True)
+            results = list(session.completed())
+        self.assertEqual(results[0][0:3], (True, self.filename, len(BODY)))
+        self.assertEqual(adapter.call_count, 2)
+        with open(self.filename, 'rb') as file:
+            self.assertEqual(file.read(), BODY)
+        self.assertEqual(os.listdir(os.path.dirname(self.filename)), ['app.apk'])
+
+    def test_download(self):
+        with FuturesSessionVerifiedDownload(max_workers=2) as session:
+            session.mount('https://', self.session.get_adapter(URL))
+            session.download(URL, self.filename, hash_type='sha256', hash=hashlib.sha256(BODY).hexdigest())
+            results = list(session.completed())
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0][0:3], (True, self.filename, len(BODY)))
+        self.assertTrue(os.path.isfile(self.filename))
+
+    def test_download_retry(self):
+        adapter = requests_mock.Adapter()
+        adapter.register_uri('GET', URL, [{'status_code': 503, 'headers': {'Retry-After': '0'}},
+                                          {'status_code': 200, 'content': BODY}])
+        policy = RetryPolicy(retries=2, backoff=0.01)
+        with FuturesSessionVerifiedDownload(max_workers=2, retry=policy) as session:
+            session.mount('https://', adapter)
+            session.download(URL, self.filename)
+            results = list(session.completed())
+        self.assertEqual([result[0] for result in results], [True])
+        self.assertEqual(policy.retries, 1)
+        self.assertEqual(policy.hosts, {'example.org': 1})
+
+
+class HostSchedulerTestSuite(unittest.TestCase):
+
+    def test_per_host_cap(self):
+        lock = threading.Lock()
+        running = {}
+        peak = {}
+        order = []
+        def job(host):
+            with lock:
+                order.append(host)
+                running[host] = running.get(host, 0) + 1
+                peak[host] = max(peak.get(host, 0), running[host])
+            time.sleep(0.01)
+            with lock:
+                running[host] -= 1
+            return host
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            scheduler = HostScheduler(executor, max_workers=4, max_per_host=2)
+            futures = [scheduler.submit('big', job, 'big') for _ in range(20)]
+            futures += [scheduler.submit('small', job, 'small') for _ in range(2)]
+            self.assertEqual([future.result() for future in futures], ['big'] * 20 + ['small'] * 2)
+        self.assertEqual(peak, {'big': 2, 'small': 2})
+        # small host is not queued behind all of the big one
+        self.assertTrue(order.index('small') < 4)
+
+    def test_map(self):
+        with FuturesSessionFlex(max_workers=2) as session:
+            adapter = requests_mock.Adapter()
+            adapter.register_uri('GET', URL, text='ok')
+            session.mount('https://', adapter)
+            settings = requests.Session()
+            settings.auth = ('user', 'secret')
+            settings.verify = False
+            session.map('https://example.org/repo', settings)
+            session.map('https://example.org/repo', settings)
+            response = session.get(URL).result()
+            self.assertEqual(response.text, 'ok')
+            self.assertTrue(response.request.headers['Authorization'].startswith('Basic '))
+
+
+class MirrorPoolTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmp, 'repo', 'app.apk')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_candidates(self):
+        mirrors = MirrorPool()
+        self.assertEqual(mirrors.add('https://example.org/repo/', ['https://mirror.example.net/fdroid/repo']),
+                         ['https://example.org/repo/', 'https://mirror.example.net/fdroid/repo/'])
+        self.assertEqual(mirrors.candidates('https://other.org/repo/app.apk'), ['https://other.org/repo/app.apk'])
+        job = {'url': URL}
+        self.assertEqual(mirrors.start(job), 'https://example.org/repo/app.apk')
+        mirrors.finish(job, True, latency=0.5, bytes=1000, elapsed=1.0)
+        # untried mirror goes first, then the faster one
+        self.assertEqual(mirrors.candidates(URL), ['https://mirror.example.net/fdroid/repo/app.apk', URL])
+
+    def test_failover(self):
+        adapter = requests_mock.Adapter()
+        adapter.register_uri('GET', 'https://mirror.example.net/fdroid/repo/app.apk', status_code=404)
+        adapter.register_uri('GET', URL, content=BODY)
+        mirrors = MirrorPool()
+        mirrors.add('https://example.org/repo/', ['https://mirror.example.net/fdroid/repo'])
+        mirrors.start({'url': URL}) # make the repo url look busy
+        with FuturesSessionVerifiedDownload(max_workers=2, mirrors=mirrors) as session:
+            session.mount('https://', adapter)
+            session.download(URL, self.filename, hash_type='sha256', hash=hashlib.sha256(BODY).hexdigest())
+            results = list(session.completed())
+        self.assertEqual([result[0] for result in results], [True])
+        stats = dict((stats.url, stats) for stats in mirrors.stats())
+        self.assertEqual(stats['https://mirror.example.net/fdroid/repo/'].failures, 1)
+        self.assertEqual(stats['https://example.org/repo/'].failures, 0)
+
+
+class RateLimiterTestSuite(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual(RateLimiter.parse_rate('500K'), 500 * 1024)
+        self.assertEqual(RateLimiter.parse_rate('1.5MB'), int(1.5 * 1024 * 1024))
+        self.assertEqual(RateLimiter.parse_rate('2m/s'), 2 * 1024 * 1024)
+        self.assertIsNone(RateLimiter.parse_rate('unlimited'))
+        self.assertRaises(ValueError, RateLimiter.parse_rate, 'fast')
+        self.assertEqual(RateLimiter.parse_profile('22:00-06:00=10M'), (22 * 60, 6 * 60, 10 * 1024 * 1024))
+        self.assertRaises(ValueError, RateLimiter.parse_profile, '25:00-06:00=1M')
+
+    def test_profiles(self):
+        limiter = RateLimiter(rate=1000, profiles=[(8 * 60, 18 * 60, 100), (22 * 60, 6 * 60, None)])
+        self.assertEqual(limiter.rate(datetime(2020, 1, 1, 12, 0)), 100)
+        self.assertEqual(limiter.rate(datetime(2020, 1, 1, 20, 0)), 1000)
+        self.assertIsNone(limiter.rate(datetime(2020, 1, 1, 23, 0)))
+        self.assertIsNone(limiter.rate(datetime(2020, 1, 1, 3, 0)))
+
+    def test_bucket(self):
+        bucket = TokenBucket(1000)
+        self.assertEqual(bucket.reserve(1000), 0.0)
+        self.assertAlmostEqual(bucket.reserve(500), 0.5, places=1)
+        limiter = RateLimiter(per_host=1000)
+        self.assertEqual(limiter.reserve('a', 1000), 0.0)
+        self.assertEqual(limiter.reserve('b', 1000), 0.0)
+        self.assertTrue(limiter.reserve('a', 1000) > 0.9)
+        self.assertEqual(limiter.bytes, 3000)
+
+
+class RetryPolicyTestSuite(unittest.TestCase):
+
+    def test_retry(self):
+        error = requests.exceptions.ConnectionError('reset')
+        policy = RetryPolicy(retries=2, backoff=1.0, jitter=0.5, host_budget=3)
+        delay = policy.retry(URL, error, 1)
+        self.assertTrue(1.0 <= delay <= 2.0)
+        self.assertIsNone(policy.retry(URL, error, 2))
+        self.assertIsNone(policy.retry(URL, ValueError('not transient'), 0))
+        policy.retry(URL, error, 0)
+        policy.retry(URL, error, 0)
+        self.assertIsNone(policy.retry(URL, error, 0))
+        self.assertEqual(policy.retries, 3)
+        self.assertEqual(policy.exhausted, 2)
+
+
+class EngineTestSuite(unittest.TestCase):
+
+    def test_thread_engine(self):
+        self.assertIsNone(engine_error('thread'))
+        with download_session('thread', max_workers=2) as session:
+            self.assertIsInstance(session, FuturesSessionVerifiedDownload)
+
+    @unittest.skipIf(not engine_error('async') is None, 'async engine not available')
+    def test_async_engine(self):
+        with download_session('async', max_workers=2) as session:
+            self.assertTrue(hasattr(session, 'completed'))
+            self.assertEqual(list(session.completed()), [])
@@ -0,0 +1,42 @@
+from __future__ import unicode_literals
+
+# Allow direct execution
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import shutil
+import tempfile
+import unittest
+from fdroid_dl.model import HashCache
+
+
+class HashCacheTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmp, 'hashes.json')
+        self.apk = os.path.join(self.tmp, 'app.apk')
+        with open(self.apk, 'wb') as file:
+            file.write(b'apk')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_verified(self):
+        with HashCache(self.filename) as hashes:
+            self.assertFalse(hashes.verified(self.apk, 'sha256', 'abc'))
+            hashes.add(self.apk, 'sha256', 'abc')
+            self.assertTrue(hashes.verified(self.apk, 'sha256', 'abc'))
+            self.assertFalse(hashes.verified(self.apk, 'sha256', 'def'))
+        hashes = HashCache(self.filename).load()
+        self.assertEqual(len(hashes), 1)
+        self.assertTrue(hashes.verified(self.apk, 'sha256', 'abc'))
+
+    def test_changed_file(self):
+        hashes = HashCache(self.filename)
+        hashes.add(self.apk, 'sha256', 'abc')
+        with open(self.apk, 'ab') as file:
+            file.write(b'changed')
+        self.assertFalse(hashes.verified(self.apk, 'sha256', 'abc'))
+        hashes.discard(self.apk)
+        self.assertEqual(len(hashes), 0)
@@ -0,0 +1,238 @@
+from __future__ import unicode_literals
+
+# Allow direct execution
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import io
+import json
+import shutil
+import tempfile
+import unittest
+from fdroid_dl.model import Index, IndexCache, IndexReader, XmlIndexReader, SelectorSet, Metadata
+
+INDEX = {
+    'repo': {'name': 'Test Repo', 'timestamp': 1500000000000},
+    'requests': {'install': [], 'uninstall': []},
+    'apps': [
+        {'packageName': 'org.example.one', 'icon': 'one.png',
+         'localized': {'en-US': {'icon': 'icon.png', 'phoneScreenshots': ['1.png']}}},
+        {'packageName': 'org.example.two'}
+    ],
+    'packages': {
+        'org.example.one': [{'apkName': 'one_2.apk', 'versionCode': 2},
+                            {'apkName': 'one_1.apk', 'versionCode': 1}],
+        'org.example.two': [{'apkName': 'two_1.apk', 'versionCode': 1, 'srcname': 'two_1_src.tar.gz'}]
+    }
+}
+
+class IndexReaderTestSuite(unittest.TestCase):
+
+    def test_events(self):
+        data = json.dumps(INDEX, indent=4).encode('utf-8')
+        for blocksize in (1, 7, 65536):
+            events = list(IndexReader(io.BytesIO(data), blocksize=blocksize))
+            self.assertEqual([e[1] for e in events if e[0] == 'app'], INDEX['apps'])
+            self.assertEqual([(e[1], e[2]['versionCode']) for e in events if e[0] == 'package'],
+                             [('org.example.one', 2), ('org.example.one', 1), ('org.example.two', 1)])
+            self.assertEqual(dict((e[1], e[2]) for e in events if e[0] == 'value'),
+                             {'repo': INDEX['repo'], 'requests': INDEX['requests']})
+
+    def test_truncated(self):
+        data = json.dumps(INDEX).encode('utf-8')[:-10]
+        with self.assertRaises(ValueError):
+            list(IndexReader(io.BytesIO(data)))
+
+
+class IndexTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmp, 'repo.cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_from_stream(self):
+        data = io.BytesIO(json.dumps(INDEX).encode('utf-8'))
+        index = Index.from_stream(data, self.filename, key='https://example.org/repo/')
+        self.assertEqual(index['repo']['name'], 'Test Repo')
+        self.assertEqual(index.written, os.path.getsize(self.filename))
+        self.assertEqual(index['packages']['org.example.one'][0]['apkName'],
+                         'https://example.org/repo/one_2.apk')
+        self.assertEqual(index['packages']['org.example.two'][0]['srcname'],
+                         'https://example.org/repo/two_1_src.tar.gz')
+        app = index['apps'][0]
+        self.assertEqual(app['icon'], 'https://example.org/repo/icons/one.png')
+        self.assertEqual(app['localized']['en-US']['phoneScreenshots'],
+                         ['https://example.org/repo/org.example.one/en-US/phoneScreenshots/1.png'])
+        self.assertEqual(sorted(index.find_appids('regex:org\\.example\\..*')), sorted(index.find_appids('*')))
+
+    def test_from_cache(self):
+        data = io.BytesIO(json.dumps(INDEX).encode('utf-8'))
+        Index.from_stream(data, self.filename, key='https://example.org/repo/')
+        index = Index.from_cache(self.filename, key='https://example.org/repo/')
+        self.assertEqual(index['repo'], INDEX['repo'])
+        self.assertEqual(index.get('apps_missing'), None)
+        self.assertEqual(index.app('org.example.two'), {'packageName': 'org.example.two'})
+        self.assertEqual(index.app('org.example.none'), None)
+        self.assertEqual([p['versionCode'] for p in index.packages('org.example.one')], [2, 1])
+        self.assertEqual(index.packages('org.example.none'), [])
+        self.assertEqual(list(index.appids()), ['org.example.one', 'org.example.two'])
+        self.assertEqual(index.find_appids('org.example.two'), ['org.example.two'])
+        self.assertEqual(index.find_appids('org.example.none'), [])
+        self.assertEqual(len(index['apps']), 2)
+
+    def test_save(self):
+        store = json.loads(json.dumps(INDEX))
+        Index(key='https://example.org/repo/', store=store).monkeypatch().save(filename=self.filename)
+        index = Index.from_cache(self.filename, key='https://example.org/repo/')
+        self.assertEqual(index['_monkeypatched'], True)
+        self.assertEqual(index.packages('org.example.two')[0]['apkName'], 'https://example.org/repo/two_1.apk')
+
+    def test_changes(self):
+        data = io.BytesIO(json.dumps(INDEX).encode('utf-8'))
+        index = Index.from_stream(data, self.filename, key='https://example.org/repo/')
+        self.assertIsNone(index.changes)
+        newer = json.loads(json.dumps(INDEX))
+        newer['apps'][0]['lastUpdated'] = 1600000000000
+        newer['apps'][1] = {'packageName': 'org.example.three'}
+        newer['packages']['org.example.one'].insert(0, {'apkName': 'one_3.apk', 'versionCode': 3})
+        del newer['packages']['org.example.two']
+        data = io.BytesIO(json.dumps(newer).encode('utf-8'))
+        changes = Index.from_stream(data, self.filename, key='https://example.org/repo/').changes
+        self.assertEqual(changes.added, set(['org.example.three']))
+        self.assertEqual(changes.changed, set(['org.example.one']))
+        self.assertEqual(changes.removed, set(['org.example.two']))
+        self.assertEqual(changes.packages_added, {'org.example.one': [3]})
+        self.assertEqual(changes.packages_removed, {'org.example.two': [1]})
+        self.assertTrue(changes.packages_changed('org.example.one'))
+        self.assertTrue(changes.app_removed('org.example.two'))
+        self.assertFalse(changes.app_changed('org.example.two'))
+        self.assertTrue(changes.packages_changed('org.example.two'))
+        data = io.BytesIO(json.dumps(newer).encode('utf-8'))
+        changes = Index.from_stream(data, self.filename, key='https://example.org/repo/').changes
+        self.assertEqual(len(changes), 0)
+        self.assertFalse('org.example.one' in changes)
+        # all packages of an app that stays in the index are gone
+        del newer['packages']['org.example.one']
+        data = io.BytesIO(json.dumps(newer).encode('utf-8'))
+        changes = Index.from_stream(data, self.filename, key='https://example.org/repo/').changes
+        self.assertEqual(changes.packages_removed, {'org.example.one': [1, 2, 3]})
+        self.assertFalse(changes.app_changed('org.example.one'))
+
+    def test_damaged_cache(self):
+        data = json.dumps(INDEX).encode('utf-8')
+        Index.from_stream(io.BytesIO(data), self.filename, key='https://example.org/repo/')
+        size = os.path.getsize(self.filename)
+        for length in (12, size - 10):
+            with open(self.filename, 'r+b') as file:
+                file.truncate(length)
+            with self.assertRaises(IOError):
+                IndexCache(self.filename)
+            self.assertFalse(IndexCache.is_readable(self.filename))
+            # refreshing replaces the damaged file
+            index = Index.from_stream(io.BytesIO(data), self.filename, key='https://example.org/repo/')
+            self.assertIsNone(index.changes)
+            self.assertTrue(IndexCache.is_readable(self.filename))
+            index = Index.from_cache(self.filename, key='https://example.org/repo/')
+            self.assertEqual(list(index.appids()), ['org.example.one', 'org.example.two'])
+
+    def test_legacy_json_cache(self):
+        with open(self.filename, 'w') as file:
+            json.dump(INDEX, file, indent=4)
+        index = Index.from_cache(self.filename, key='https://example.org/repo/')
+        self.assertEqual(index['repo'], INDEX['repo'])
+        self.assertEqual(index.packages('org.example.one'), INDEX['packages']['org.example.one'])
+        self.assertEqual(sorted(index.find_appids('*')), ['org.example.one', 'org.example.two'])
+
+
+class SelectorSetTestSuite(unittest.TestCase):
+
+    def test_select(self):
+        appids = ['org.example.one', 'org.example.two', 'com.other.app']
+        calls = []
+        def all_appids():
+            calls.append(1)
+            return iter(appids)
+        selectors = SelectorSet.compile(['com.other.app', 'org.none', 'regex:org\\.example\\..*', 'regex:.*one'])
+        self.assertIs(selectors, SelectorSet.compile(['com.other.app', 'org.none', 'regex:org\\.example\\..*', 'regex:.*one']))
+        self.assertEqual(selectors.select(all_appids, appids.__contains__),
+                         ['com.other.app', 'org.example.one', 'org.example.two'])
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(SelectorSet.compile('org.example.two').select(all_appids, appids.__contains__),
+                         ['org.example.two'])
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(SelectorSet.compile(['all']).select(all_appids, appids.__contains__), appids)
+
+
+class XmlIndexReaderTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.source = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'testdata', 'index.xml')
+
+    def test_events(self):
+        with XmlIndexReader(self.source) as reader:
+            events = list(reader)
+        values = dict((e[1], e[2]) for e in events if e[0] == 'value')
+        self.assertEqual(values['repo']['name'], 'Old Repo')
+        self.assertEqual(values['repo']['mirrors'], ['https://mirror.example/repo'])
+        self.assertEqual(values['requests'], {'install': ['org.a'], 'uninstall': []})
+        apps = [e[1] for e in events if e[0] == 'app']
+        self.assertEqual([app['packageName'] for app in apps], ['org.a', 'org.b'])
+        self.assertEqual(apps[0]['categories'], ['Games', 'System'])
+        self.assertEqual(apps[0]['antiFeatures'], ['Ads'])
+        self.assertEqual(apps[0]['localized']['en-US'], {'summary': 'sum', 'description': '<p>desc</p>'})
+        self.assertIsInstance(apps[0]['lastUpdated'], int)
+        pkgs = [e[2] for e in events if e[0] == 'package']
+        self.assertEqual([pkg['versionCode'] for pkg in pkgs], [10, 9])
+        self.assertEqual(pkgs[0]['hashType'], 'sha256')
+        self.assertEqual(pkgs[0]['uses-permission'][1], ['android.permission.CAMERA', None])
+
+    def test_from_stream(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmp, 'repo.cache')
+            with open(self.source, 'rb') as source:
+                Index.from_stream(source, filename, format='xml', key='https://old.example/repo/')
+            index = Index.from_cache(filename)
+            self.assertEqual(index['repo']['address'], 'https://old.example/repo')
+            self.assertEqual(index.packages('org.a')[0]['srcname'], 'https://old.example/repo/org.a_10_src.tar.gz')
+            self.assertEqual(index.app('org.a')['icon'], 'https://old.example/repo/icons/org.a.1.png')
+        finally:
+            shutil.rmtree(tmp)
+
+
+class MetadataTestSuite(unittest.TestCase):
+
+    def test_reload(self):
+        first = Index(key='https://one.org/repo/', store={'apps': [{'packageName': 'org.example.one', 'license': 'MIT'}]})
+        second = Index(key='https://two.org/repo/', store={'apps': [{'packageName': 'org.example.one', 'license': 'GPL',
+                                                                     'webSite': 'https://example.org'}]})
+        meta = Metadata(None, config={'org.example.one': {'authorName': 'me'}})
+        app = meta.reload('org.example.one', [first, second])
+        # earlier indices win, later ones fill in what is missing
+        self.assertEqual((app['license'], app['webSite'], app['authorName']), ('MIT', 'https://example.org', 'me'))
+        self.assertEqual(meta.reload('org.example.one', [second])['license'], 'GPL')
+        self.assertIsNone(meta.reload('org.example.two', [first, second]))
+        self.assertFalse('org.example.two' in meta)
+
+    def test_load_all(self):
+        class Repos(object):
+            indices = [Index(key='https://one.org/repo/', store={'apps': [
+                {'packageName': 'org.example.one', 'categories': ['Test'], 'localized': {'en-US': {'name': 'One'}}},
+                {'packageName': 'org.example.two'}]}),
+                       Index(key='https://two.org/repo/', store={'apps': [
+                {'packageName': 'org.example.one', 'localized': {'en-US': {'summary': 'first'}, 'de': {'name': 'Eins'}}}]})]
+        meta = Metadata(Repos(), config={'org.example.one': {'localized': {'de': {'name': 'Uno'}}}})
+        meta.load_all(appids=['org.example.one'])
+        self.assertFalse('org.example.two' in meta)
+        app = meta['org.example.one']
+        self.assertEqual(sorted(app.locales), ['de', 'en-US'])
+        self.assertEqual(app.localized('en-US'), {'name': 'One', 'summary': 'first'})
+        self.assertEqual(app.title('de'), 'Uno')
+        # index data is shared, not copied, and changes end up in the config only
+        self.assertIs(app['categories'], Repos.indices[0].app('org.example.one')['categories'])
+        app['license'] = 'MIT'
+        self.assertEqual(app['license'], 'MIT')
+        self.assertFalse('license' in Repos.indices[0].app('org.example.one'))
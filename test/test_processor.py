@@ -0,0 +1,106 @@
+from __future__ import unicode_literals
+
+# Allow direct execution
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import hashlib
+import json
+import shutil
+import tempfile
+import unittest
+import zipfile
+from datetime import timedelta
+from fdroid_dl.download import JarIndexStream
+from fdroid_dl.model import Changeset, Index
+from fdroid_dl.processor import HashVerifier, IndexFileProcessor
+
+INDEX = {
+    'repo': {'name': 'Test Repo', 'timestamp': 1500000000000},
+    'requests': {'install': [], 'uninstall': []},
+    'apps': [{'packageName': 'org.example.one'}],
+    'packages': {'org.example.one': [{'apkName': 'one_1.apk', 'versionCode': 1}]}
+}
+
+
+class Repo(dict):
+    def __init__(self, url, filename):
+        super(Repo, self).__init__()
+        self.url = url
+        self.filename = filename
+
+
+class IndexFileProcessorTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def jar(self, index):
+        jar = tempfile.NamedTemporaryFile(suffix='.jar', dir=self.tmp)
+        with zipfile.ZipFile(jar, 'w') as archive:
+            archive.writestr('index-v1.json', json.dumps(index))
+        jar.flush()
+        jar.seek(0)
+        return JarIndexStream(jar, spooled=os.path.getsize(jar.name))
+
+    def test_processes(self):
+        repo = Repo('https://example.org/repo/', os.path.join(self.tmp, 'repo.cache'))
+        newer = json.loads(json.dumps(INDEX))
+        newer['packages']['org.example.one'].insert(0, {'apkName': 'one_2.apk', 'versionCode': 2})
+        for index, changed in ((INDEX, False), (newer, True)):
+            stream = self.jar(index)
+            with IndexFileProcessor(max_workers=2, processes=True) as ifp:
+                self.assertTrue(ifp.processes)
+                ifp.process(stream, repo, repo, 'extra')
+                results = list(ifp.completed())
+            self.assertEqual(len(results), 1)
+            (repo_name, elapsed, written, rss, changes, args_repo, extra) = results[0]
+            self.assertEqual(repo['format'], 'json')
+            self.assertEqual((repo_name, extra), ('Test Repo', 'extra'))
+            self.assertIsInstance(elapsed, timedelta)
+            self.assertEqual(written, os.path.getsize(repo.filename) + stream.spooled)
+            self.assertTrue(args_repo is repo)
+            if changed:
+                # the Changeset made it back from the worker process
+                self.assertIsInstance(changes, Changeset)
+                self.assertEqual(changes.packages_added, {'org.example.one': [2]})
+            else:
+                self.assertIsNone(changes)
+        index = Index.from_cache(repo.filename, key=repo.url)
+        self.assertEqual([pkg['versionCode'] for pkg in index.packages('org.example.one')], [2, 1])
+
+
+class HashVerifierTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_verify(self):
+        digests = {}
+        for name in ('one.apk', 'two.apk', 'three.apk'):
+            filename = os.path.join(self.tmp, name)
+            with open(filename, 'wb') as file:
+                file.write(name.encode('utf-8') * 1000)
+            digests[filename] = hashlib.sha256(name.encode('utf-8') * 1000).hexdigest()
+        wrong = os.path.join(self.tmp, 'three.apk')
+        missing = os.path.join(self.tmp, 'missing.apk')
+        with HashVerifier(max_workers=2) as verifier:
+            for filename, digest in digests.items():
+                verifier.verify(filename, 'sha256', 'abc' if filename == wrong else digest, 'url:' + filename)
+            verifier.verify(missing, 'sha256', 'abc', 'url:' + missing)
+            results = dict((result[1], result) for result in verifier.completed())
+        self.assertEqual(sorted(results), sorted(list(digests) + [missing]))
+        for filename, (verified, name, elapsed, size, url) in results.items():
+            self.assertEqual(url, 'url:' + filename)
+            if filename == missing:
+                # unreadable files are failures, not errors of the pool
+                self.assertEqual((verified, elapsed, size), (False, None, 0))
+            else:
+                self.assertEqual(verified, filename != wrong)
+                self.assertEqual(size, os.path.getsize(filename))
@@ -0,0 +1,110 @@
+from __future__ import unicode_literals
+
+# Allow direct execution
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import hashlib
+import io
+import json
+import shutil
+import tempfile
+import unittest
+import zipfile
+import requests_mock
+import yaml
+from fdroid_dl.model import Config, AppMetadata
+from fdroid_dl.update import IndexUpdate, MetadataUpdate
+
+INDEX = {
+    'repo': {'name': 'Test Repo', 'timestamp': 1500000000000},
+    'requests': {'install': [], 'uninstall': []},
+    'apps': [{'packageName': 'org.example.one'}],
+    'packages': {'org.example.one': [{'apkName': 'one_1.apk', 'versionCode': 1}]}
+}
+LAST_MODIFIED = 'Sat, 01 Jul 2017 00:00:00 GMT'
+
+
+def jar(data):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr('index-v1.json', data)
+    return buffer.getvalue()
+
+
+class IndexUpdateTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def config(self):
+        return Config(filename=os.path.join(self.tmp, 'fdroid-dl.json'), repo_dir=os.path.join(self.tmp, 'repo'),
+                      metadata_dir=os.path.join(self.tmp, 'metadata'), cache_dir=os.path.join(self.tmp, 'cache'))
+
+    @staticmethod
+    def refresh(config, repo, mocker, **response):
+        mocker.get(repo.url_index_v1, **response)
+        IndexUpdate(config, max_workers=2).refresh([repo])
+        return mocker.request_history[-1].headers
+
+    def test_conditional_get(self):
+        body = jar(json.dumps(INDEX))
+        with self.config() as config, requests_mock.Mocker() as mocker:
+            repo = list(config.repos)[0]
+            # first fetch stores the validators of the processed index
+            self.refresh(config, repo, mocker, content=body, headers={'ETag': '"v1"', 'Last-Modified': LAST_MODIFIED})
+            self.assertFalse('error' in repo)
+            self.assertEqual((repo['etag'], repo['last_modified']), ('"v1"', LAST_MODIFIED))
+            self.assertEqual(repo.hash, hashlib.sha256(body).hexdigest())
+            self.assertIsNone(repo.changes)
+            mtime = os.path.getmtime(repo.filename)
+            # not modified, the cache file is kept
+            headers = self.refresh(config, repo, mocker, status_code=304)
+            self.assertEqual((headers['If-None-Match'], headers['If-Modified-Since']), ('"v1"', LAST_MODIFIED))
+            self.assertEqual(len(repo.changes), 0)
+            self.assertEqual(os.path.getmtime(repo.filename), mtime)
+            # an index that can not be processed leaves the validators of the cache file alone
+            self.refresh(config, repo, mocker, content=jar(json.dumps(INDEX)[:-10]), headers={'ETag': '"v2"'})
+            self.assertTrue('error' in repo)
+            self.assertEqual(repo['etag'], '"v1"')
+            self.assertEqual(repo.hash, hashlib.sha256(body).hexdigest())
+            self.assertEqual(os.path.getmtime(repo.filename), mtime)
+            # server without validators, the content hash matches the cache file
+            headers = self.refresh(config, repo, mocker, content=body)
+            self.assertEqual(headers['If-None-Match'], '"v1"')
+            self.assertFalse('error' in repo)
+            self.assertEqual(len(repo.changes), 0)
+            self.assertFalse('etag' in repo or 'last_modified' in repo)
+            self.assertEqual(os.path.getmtime(repo.filename), mtime)
+            self.assertEqual(IndexUpdate.conditional_headers(repo), {})
+
+
+class MetadataUpdateTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_write_yaml(self):
+        with Config(filename=os.path.join(self.tmp, 'fdroid-dl.json'), repo_dir=os.path.join(self.tmp, 'repo'),
+                    metadata_dir=os.path.join(self.tmp, 'metadata'), cache_dir=os.path.join(self.tmp, 'cache')) as config:
+            appid = 'org.example.one'
+            yaml_file = os.path.join(config.metadata_dir, appid + '.yml')
+            config.metadata[appid] = AppMetadata(appid, json={'license': 'MIT', 'categories': ['System']})
+            update = MetadataUpdate(config, delta=False, preload=False)
+            self.assertEqual(update.write_yaml(appid), MetadataUpdate.CREATED)
+            # nothing changed, the file is not written again
+            os.utime(yaml_file, (1000000000, 1000000000))
+            self.assertEqual(update.write_yaml(appid), MetadataUpdate.UNCHANGED)
+            self.assertEqual(os.path.getmtime(yaml_file), 1000000000)
+            config.metadata[appid] = AppMetadata(appid, json={'license': 'GPL-3.0', 'categories': ['System']})
+            self.assertEqual(update.write_yaml(appid), MetadataUpdate.UPDATED)
+            self.assertNotEqual(os.path.getmtime(yaml_file), 1000000000)
+            with open(yaml_file, 'rb') as file:
+                self.assertEqual(yaml.safe_load(file), {'License': 'GPL-3.0', 'Categories': ['System']})
+            self.assertEqual(os.listdir(config.metadata_dir), [appid + '.yml'])